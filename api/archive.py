@@ -0,0 +1,204 @@
+import gzip
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from . import partitions
+from .models import ArchivedOrder, Order, OrderProduct
+
+# 封存分兩階段：先把冷訂單逐批複製到封存表或檔案，全部寫完後才刪除原資料，
+# 中途失敗時原資料仍在，重跑即可（封存表以原 id 為主鍵，重複的列會略過）。
+# 已寫入的彙總列會保留；rebuild_rollups 拒絕重算最新封存訂單以前的時段，以免清掉這些彙總。
+# 匯出到檔案的訂單也在封存表留下一列（不含品項），單號與冪等鍵才不會被重複匯入。
+
+FORMATS = ('table', 'ndjson', 'parquet')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def cold_orders(before, batch_size=1000):
+    """
+    Yield the orders created before ``before`` as unsaved ArchivedOrder
+    instances, ``batch_size`` at a time in id order. Each batch costs two
+    indexed queries, so memory stays flat however many orders there are.
+    """
+    last_id = 0
+    while True:
+        orders = list(
+            Order.objects.filter(created_at__lt=before, id__gt=last_id)
+            .order_by('id')
+            .values_list('id', 'order_number', 'idempotency_key', 'total_price', 'promo_code__code', 'created_at')
+            [:batch_size]
+        )
+        if not orders:
+            return
+        items = {}
+        for order_id, *item in (
+            OrderProduct.objects.filter(order_id__in=[order[0] for order in orders])
+            .order_by('order_id', 'id')
+            .values_list('order_id', 'product_id', 'quantity', 'unit_price', 'line_total')
+        ):
+            items.setdefault(order_id, []).append(item)
+        yield [
+            ArchivedOrder(
+                id=order_id,
+                order_number=order_number,
+                idempotency_key=idempotency_key,
+                total_price=total_price,
+                promo_code=promo_code,
+                created_at=created_at,
+                items=items.get(order_id, []),
+            )
+            for order_id, order_number, idempotency_key, total_price, promo_code, created_at in orders
+        ]
+        last_id = orders[-1][0]
+
+
+def archive(before, format='table', output=None, batch_size=1000):
+    """
+    Copy the orders created before ``before`` into ArchivedOrder or a
+    gzipped NDJSON / zstd Parquet file at ``output``, then delete them.
+    Returns ``(archived, dropped)``: the number of orders archived and
+    the names of the partitions dropped.
+
+    Raises ArchiveError when the format needs an ``output`` path or a
+    missing library.
+    """
+    if format not in FORMATS:
+        raise ArchiveError(f"Unknown format: {format}")
+    if format != 'table' and not output:
+        raise ArchiveError(f"The {format} format needs an output path")
+    if format == 'parquet':
+        _pyarrow()
+
+    batches = cold_orders(before, batch_size)
+    if format == 'table':
+        last_id, archived = _to_table(batches)
+    else:
+        # 先寫暫存檔，完整寫完才改名，避免留下看似完整的半個檔案
+        partial = f"{output}.partial"
+        writer = _to_ndjson if format == 'ndjson' else _to_parquet
+        last_id, archived = writer(_keep_keys(batches, output), partial)
+        os.replace(partial, output)
+
+    if not archived:
+        return 0, []
+    return archived, delete_orders(before, last_id, batch_size)
+
+
+def _to_table(batches):
+    last_id = archived = 0
+    for batch in batches:
+        ArchivedOrder.objects.bulk_create(batch, ignore_conflicts=True)
+        last_id = batch[-1].id
+        archived += len(batch)
+    return last_id, archived
+
+
+def _keep_keys(batches, output):
+    for batch in batches:
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order.id,
+                order_number=order.order_number,
+                idempotency_key=order.idempotency_key,
+                total_price=order.total_price,
+                promo_code=order.promo_code,
+                created_at=order.created_at,
+                items=[],
+                archive_file=output,
+            )
+            for order in batch
+        ], ignore_conflicts=True)
+        yield batch
+
+
+def _row(order):
+    return {
+        "id": order.id,
+        "order_number": order.order_number,
+        "idempotency_key": order.idempotency_key,
+        "total_price": order.total_price,
+        "promo_code": order.promo_code,
+        "created_at": order.created_at,
+        "items": [
+            {"product_id": product_id, "quantity": quantity, "unit_price": unit_price, "line_total": line_total}
+            for product_id, quantity, unit_price, line_total in order.items
+        ],
+    }
+
+
+def _to_ndjson(batches, path):
+    last_id = archived = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for batch in batches:
+            for order in batch:
+                f.write(json.dumps(_row(order), cls=DjangoJSONEncoder, ensure_ascii=False))
+                f.write('\n')
+            last_id = batch[-1].id
+            archived += len(batch)
+    return last_id, archived
+
+
+def _pyarrow():
+    # pyarrow 只有 parquet 匯出用到，匯入很慢，用到時才載入
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ArchiveError("The parquet format needs pyarrow installed")
+    return pyarrow
+
+
+def _parquet_schema(pyarrow):
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('order_number', pyarrow.string()),
+        ('idempotency_key', pyarrow.string()),
+        ('total_price', pyarrow.decimal128(10, 2)),
+        ('promo_code', pyarrow.string()),
+        ('created_at', pyarrow.timestamp('us', tz='UTC')),
+        ('items', pyarrow.list_(pyarrow.struct([
+            ('product_id', pyarrow.int64()),
+            ('quantity', pyarrow.int64()),
+            ('unit_price', pyarrow.decimal128(10, 0)),
+            ('line_total', pyarrow.decimal128(12, 2)),
+        ]))),
+    ])
+
+
+def _to_parquet(batches, path):
+    # 每批寫成一個 row group，記憶體只需容納一批
+    pyarrow = _pyarrow()
+    schema = _parquet_schema(pyarrow)
+    last_id = archived = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for batch in batches:
+            writer.write_table(pyarrow.Table.from_pylist([_row(order) for order in batch], schema=schema))
+            last_id = batch[-1].id
+            archived += len(batch)
+    return last_id, archived
+
+
+def delete_orders(before, last_id, batch_size=1000):
+    """
+    Delete the orders created before ``before`` with ids up to ``last_id``
+    and their line items. On the partitioned layout whole cold partitions
+    are detached and dropped first, which frees their space at once.
+    Returns the names of the partitions dropped.
+    """
+    dropped = partitions.drop_partitions_before(before) if partitions.is_partitioned() else []
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Order.objects.filter(created_at__lt=before, id__lte=last_id)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return dropped
+            OrderProduct.objects.filter(order_id__in=ids).delete()
+            Order.objects.filter(id__in=ids).delete()
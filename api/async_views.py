@@ -0,0 +1,119 @@
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+
+from .decorators import get_access_token, is_valid_access_token
+from .models import Product
+from .parsers import loads
+from .services import afind_imported_order, import_orders
+
+# 非同步版本的 import_order / restock_product，供 ASGI (uvicorn) 部署使用。
+# DRF 3.14 不支援 async view，這裡直接使用 Django 的 async view。
+
+
+def _response(data, status_code):
+    return JsonResponse(data, status=status_code, encoder=JSONEncoder)
+
+
+def _parse_post(request):
+    """
+    Return ``(data, None)`` for a POST with a JSON body, or
+    ``(None, error_response)``.
+    """
+    if request.method != 'POST':
+        return None, _response(
+            {"detail": f'Method "{request.method}" not allowed.'},
+            status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+    try:
+        return loads(request.body or b'{}'), None
+    except ValueError as exc:
+        return None, _response(
+            {"detail": f"JSON parse error - {exc}"},
+            status.HTTP_400_BAD_REQUEST
+        )
+
+
+def _replay_response(order):
+    response = _response(
+        {
+            "detail": "Order created successfully",
+            "final_price": order.total_price
+        },
+        status.HTTP_201_CREATED
+    )
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+async def import_order_async(request):
+    token = get_access_token(request.headers)
+    if not await sync_to_async(is_valid_access_token)(token):
+        return _response(
+            {"detail": "Invalid or missing access token"},
+            status.HTTP_400_BAD_REQUEST
+        )
+    data, error = _parse_post(request)
+    if error:
+        return error
+
+    payload = data if isinstance(data, dict) else {}
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        payload = {**payload, 'idempotency_key': idempotency_key}
+    # 冪等鍵也可以放在 body 中，標頭優先
+    idempotency_key = payload.get('idempotency_key')
+
+    previous = await afind_imported_order(payload.get('order_number'), idempotency_key)
+    if previous:
+        return _replay_response(previous)
+
+    # 匯入需要交易與 select_for_update，留在同步執行緒中完成
+    try:
+        result = (await sync_to_async(import_orders)([payload]))[0]
+    except IntegrityError:
+        previous = await afind_imported_order(payload.get('order_number'), idempotency_key)
+        if previous is None:
+            raise
+        return _replay_response(previous)
+
+    if result['status'] != 'created':
+        return _response({"detail": result['detail']}, status.HTTP_400_BAD_REQUEST)
+
+    return _response(
+        {
+            "detail": result['detail'],
+            "final_price": result['final_price']
+        },
+        status.HTTP_201_CREATED
+    )
+
+
+async def restock_product_async(request, product_id):
+    data, error = _parse_post(request)
+    if error:
+        return error
+    quantity = data.get('quantity', 0) if isinstance(data, dict) else 0
+
+    try:
+        product = await Product.objects.only('name').aget(id=product_id)
+    except Product.DoesNotExist:
+        return _response({"detail": "Product not found"}, status.HTTP_404_NOT_FOUND)
+
+    if not isinstance(quantity, int) or quantity <= 0:
+        return _response({"detail": "Invalid quantity"}, status.HTTP_400_BAD_REQUEST)
+
+    # 庫存更新與異動紀錄需在同一交易中寫入；Django 4.2 的非同步 ORM 不支援交易，
+    # 只能在同步執行緒中完成，不能拆成 aupdate 加 acreate
+    await sync_to_async(product.restock)(quantity)
+    return _response(
+        {"detail": f"{product.name} restocked by {quantity}"},
+        status.HTTP_200_OK
+    )
+
+
+# 與 DRF 的 api_view 一致，這些端點以 token 驗證而非 CSRF
+import_order_async.csrf_exempt = True
+restock_product_async.csrf_exempt = True
@@ -0,0 +1,337 @@
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+
+from django.core.signals import request_finished, request_started
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .caches import ProductSnapshot, _local_products, get_products, invalidate_products
+from .loadtest import summarize
+from .metrics import registry
+from .models import Order, OrderProduct, Product, PromotionCode
+
+# manage.py bench 使用的資料與情境。種子資料以 BENCH 前綴命名，
+# 固定亂數種子，讓不同 commit 的結果可以互相比較。
+
+BENCH_PREFIX = 'BENCH'
+
+Scenario = namedtuple('Scenario', ['name', 'method', 'build'])
+
+
+def seed(products, promos, orders, lines=3, seed=0, batch_size=1000):
+    """
+    Create ``products`` products, ``promos`` active promotion codes and
+    ``orders`` historical orders spread over the last 30 days. Existing
+    bench rows are kept, so seeding twice only tops up the volumes.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    existing = Product.objects.filter(name__startswith=BENCH_PREFIX).count()
+    Product.objects.bulk_create(
+        [
+            Product(
+                name=f"{BENCH_PREFIX} product {i}",
+                description=f"Bench item {i} in category {i % 100}",
+                price=rng.randint(10, 5000),
+                quantity_in_stock=10 ** 9,
+            )
+            for i in range(existing, products)
+        ],
+        batch_size=batch_size,
+    )
+    product_ids = list(
+        Product.objects.filter(name__startswith=BENCH_PREFIX).order_by('id').values_list('id', flat=True)
+    )
+    prices = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'price'))
+
+    existing = PromotionCode.objects.filter(code__startswith=BENCH_PREFIX).count()
+    for i in range(existing, promos):
+        promo = PromotionCode.objects.create(
+            name=f"{BENCH_PREFIX} promo {i}",
+            code=f"{BENCH_PREFIX}{i}",
+            discount_type=rng.choice(['percent', 'fixed']),
+            value=rng.randint(1, 20),
+            applies_to='items',
+            start_date=now - timedelta(days=365),
+            end_date=now + timedelta(days=365),
+        )
+        promo.products.add(*rng.sample(product_ids, min(len(product_ids), 50)))
+
+    existing = Order.objects.filter(order_number__startswith=f"{BENCH_PREFIX}-HIST-").count()
+    for start in range(existing, orders, batch_size):
+        with transaction.atomic():
+            new_orders = []
+            items = []
+            for i in range(start, min(start + batch_size, orders)):
+                order = Order(
+                    order_number=f"{BENCH_PREFIX}-HIST-{i}",
+                    total_price=0,
+                    created_at=now - timedelta(seconds=rng.randint(0, 30 * 24 * 3600)),
+                )
+                total = Decimal('0')
+                for product_id in rng.sample(product_ids, min(len(product_ids), lines)):
+                    quantity = rng.randint(1, 3)
+                    line_total = prices[product_id] * quantity
+                    total += line_total
+                    items.append(OrderProduct(
+                        order=order, created_at=order.created_at, product_id=product_id, quantity=quantity,
+                        unit_price=prices[product_id], line_total=line_total,
+                    ))
+                order.total_price = total
+                new_orders.append(order)
+            Order.objects.bulk_create(new_orders)
+            OrderProduct.objects.bulk_create(items)
+
+
+def scenarios(lines=3, batch=50, seed=0):
+    """
+    Return the bench scenarios over the seeded data. Each ``build(i)``
+    returns ``(path, payload)`` for the i-th request of a run.
+    """
+    rng = random.Random(seed)
+    run_id = f"{time.time_ns():x}"
+    product_ids = list(
+        Product.objects.filter(name__startswith=BENCH_PREFIX).order_by('id').values_list('id', flat=True)
+    )
+    promo_codes = list(
+        PromotionCode.objects.filter(code__startswith=BENCH_PREFIX).order_by('id').values_list('code', flat=True)
+    )
+    order_numbers = list(
+        Order.objects.filter(order_number__startswith=f"{BENCH_PREFIX}-HIST-")
+        .order_by('id').values_list('order_number', flat=True)[:1000]
+    )
+    if not product_ids or not order_numbers:
+        return []
+
+    # 單號取自整個執行共用的序號，測試 client 與伺服器不會送出相同單號而被當成重送
+    sequence = count()
+
+    def order(i):
+        data = {
+            "order_number": f"{BENCH_PREFIX}-{run_id}-{next(sequence)}",
+            "products": [
+                {"product_id": product_id, "quantity": 1}
+                for product_id in rng.sample(product_ids, min(len(product_ids), lines))
+            ],
+        }
+        if promo_codes and i % 5 == 0:
+            data["promo_code"] = promo_codes[i % len(promo_codes)]
+        return data
+
+    return [
+        Scenario('import_order', 'POST', lambda i: (
+            '/api/import-order/', order(i)
+        )),
+        Scenario('import_orders_bulk', 'POST', lambda i: (
+            '/api/import-orders/bulk/', {"orders": [order(j) for j in range(batch)]}
+        )),
+        Scenario('restock_product', 'POST', lambda i: (
+            f'/api/products/{product_ids[i % len(product_ids)]}/restock/', {"quantity": 1}
+        )),
+        Scenario('restock_products_bulk', 'POST', lambda i: (
+            '/api/products/restock/bulk/',
+            {"items": [{"product_id": product_id, "quantity": 1} for product_id in rng.sample(
+                product_ids, min(len(product_ids), batch)
+            )]}
+        )),
+        Scenario('list_orders', 'GET', lambda i: ('/api/orders/?page_size=50', None)),
+        Scenario('order_detail', 'GET', lambda i: (
+            f'/api/orders/{order_numbers[i % len(order_numbers)]}/', None
+        )),
+        Scenario('search_products', 'GET', lambda i: (
+            f'/api/products/?q=category+{i % 100}&in_stock=true&page_size=50', None
+        )),
+        Scenario('list_products_by_price', 'GET', lambda i: (
+            f'/api/products/?sort=price&price_min={i % 4000}&page_size=50', None
+        )),
+        Scenario('sales_report', 'GET', lambda i: ('/api/reports/sales/', None)),
+        Scenario('hourly_product_sales', 'GET', lambda i: ('/api/reports/hourly/products/', None)),
+    ]
+
+
+def run_in_process(scenario, requests, token):
+    """
+    Send ``requests`` requests for ``scenario`` through the Django test
+    client, one at a time, and summarize them like loadtest.run_load.
+    """
+    client = Client()
+    latencies = []
+    status_codes = {}
+    queries = []
+    started = time.perf_counter()
+    for i in range(requests):
+        path, payload = scenario.build(i)
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            response = client.generic(
+                scenario.method,
+                path,
+                json.dumps(payload) if payload is not None else '',
+                content_type='application/json',
+                HTTP_X_ACCESS_TOKEN=token,
+            )
+            latencies.append(time.perf_counter() - request_started)
+        status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+        queries.append(len(captured.captured_queries))
+    return summarize(latencies, time.perf_counter() - started, 0, status_codes, queries)
+
+
+def connection_overhead(requests):
+    """
+    Time ``requests`` simulated request cycles of one query each, first
+    with CONN_MAX_AGE=0 (a new connection per request) and then with a
+    persistent, health-checked connection. The request_started and
+    request_finished signals drive Django's usual connection handling.
+    """
+    results = {}
+    original = connection.settings_dict['CONN_MAX_AGE']
+    try:
+        for label, max_age in (('per_request', 0), ('persistent', None)):
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+            connection.close()
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(requests):
+                request_started_at = time.perf_counter()
+                request_started.send(sender=None)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                request_finished.send(sender=None)
+                latencies.append(time.perf_counter() - request_started_at)
+            results[label] = summarize(latencies, time.perf_counter() - started, 0)
+    finally:
+        connection.settings_dict['CONN_MAX_AGE'] = original
+        connection.close()
+    return results
+
+
+def stock_contention(buyers, shards, hold_ms=5):
+    """
+    Have ``buyers`` threads each reserve one unit of the same product in
+    their own transaction, holding it ``hold_ms`` milliseconds as the rest
+    of an import would, first unsharded and then with ``shards`` stock
+    shards. Meaningful on PostgreSQL; SQLite serializes all writers.
+    """
+    product = Product.objects.create(
+        name=f"{BENCH_PREFIX} contention", price=1, quantity_in_stock=buyers * 2
+    )
+    results = {}
+    try:
+        for label, shard_count in (('unsharded', 0), (f'{shards}_shards', shards)):
+            if shard_count:
+                product.enable_sharding(shard_count)
+            barrier = threading.Barrier(buyers)
+            latencies = []
+            errors = 0
+            lock = threading.Lock()
+
+            def buy():
+                nonlocal errors
+                barrier.wait()
+                started = time.perf_counter()
+                try:
+                    with transaction.atomic():
+                        Product.objects.reserve_stock({product.id: 1})
+                        time.sleep(hold_ms / 1000)
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                except Exception:
+                    with lock:
+                        errors += 1
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=buy) for _ in range(buyers)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[label] = summarize(latencies, time.perf_counter() - started, errors)
+    finally:
+        product.delete()
+    return results
+
+
+def product_cache_lookups():
+    """
+    Return ``{layer: count}`` product snapshot lookups recorded so far in
+    this process, for the local, shared and miss (database) layers.
+    """
+    return {
+        result: registry.value('api_product_cache_lookups_total', (('result', result),))
+        for result in ('local', 'shared', 'miss')
+    }
+
+
+def hit_ratio(before, after):
+    lookups = {layer: after[layer] - before[layer] for layer in after}
+    total = sum(lookups.values())
+    return {
+        "lookups": lookups,
+        "hit_ratio": round((lookups['local'] + lookups['shared']) / total, 4) if total else None,
+    }
+
+
+def product_cache(requests, cart_size=20, seed=0):
+    """
+    Time ``requests`` price lookups of ``cart_size`` bench products read
+    straight from the database, from the shared cache and from the
+    per-process cache.
+    """
+    rng = random.Random(seed)
+    product_ids = list(
+        Product.objects.filter(name__startswith=BENCH_PREFIX).order_by('id').values_list('id', flat=True)
+    )
+    carts = [rng.sample(product_ids, min(len(product_ids), cart_size)) for _ in range(requests)]
+    all_ids = {product_id for cart in carts for product_id in cart}
+    invalidate_products(all_ids)
+
+    def database(cart):
+        return list(Product.objects.filter(id__in=cart).values_list(*ProductSnapshot._fields))
+
+    def shared_cache(cart):
+        _local_products.clear()
+        get_products(cart)
+
+    results = {}
+    for label, lookup in (('database', database), ('shared_cache', shared_cache), ('local_cache', get_products)):
+        get_products(all_ids)
+        latencies = []
+        started = time.perf_counter()
+        for cart in carts:
+            lookup_started = time.perf_counter()
+            lookup(cart)
+            latencies.append(time.perf_counter() - lookup_started)
+        results[label] = summarize(latencies, time.perf_counter() - started, 0)
+    return results
+
+
+def compare(baseline, current, tolerance):
+    """
+    Return regression messages for scenarios whose p95 latency grew by
+    more than ``tolerance`` (a fraction) or whose queries per request grew
+    by half a query or more, compared with an earlier ``manage.py bench``
+    report.
+    """
+    regressions = []
+    for name, clients in current['scenarios'].items():
+        for client, summary in clients.items():
+            before = baseline.get('scenarios', {}).get(name, {}).get(client)
+            if not before:
+                continue
+            old_p95, new_p95 = before['latency_ms']['p95'], summary['latency_ms']['p95']
+            if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance):
+                regressions.append(f"{name}/{client}: p95 {old_p95}ms -> {new_p95}ms")
+            old_queries, new_queries = before.get('queries_per_request'), summary.get('queries_per_request')
+            if old_queries is not None and new_queries is not None and new_queries >= old_queries + 0.5:
+                regressions.append(f"{name}/{client}: queries/request {old_queries} -> {new_queries}")
+    return regressions
@@ -0,0 +1,296 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .metrics import registry
+
+PROMO_KEY_PREFIX = 'promo:'
+PRODUCT_KEY_PREFIX = 'product:'
+PRODUCT_VERSION_KEY_PREFIX = 'product-version:'
+
+ProductSnapshot = namedtuple('ProductSnapshot', ['id', 'name', 'price', 'quantity_in_stock', 'shard_count'])
+
+
+class LocalLRU:
+    """
+    Small thread-safe per-process LRU whose entries carry their own
+    absolute expiry time.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_promos = LocalLRU(getattr(settings, 'PROMO_CACHE_LOCAL_SIZE', 1024))
+
+
+def _promo_key(code):
+    return f"{PROMO_KEY_PREFIX}{code.lower()}"
+
+
+def _shared_timeout(promo):
+    # 活動結束時讓快取同步失效，已過期的代碼則照常保留
+    timeout = getattr(settings, 'PROMO_CACHE_TIMEOUT', 300)
+    remaining = promo.end_date.timestamp() - time.time()
+    if remaining > 0:
+        timeout = min(timeout, remaining)
+    return max(1, int(timeout))
+
+
+def _remember_locally(key, promo):
+    local_ttl = getattr(settings, 'PROMO_CACHE_LOCAL_TTL', 5)
+    expires_at = time.time() + local_ttl
+    if promo.end_date.timestamp() > time.time():
+        expires_at = min(expires_at, promo.end_date.timestamp())
+    _local_promos.set(key, promo, expires_at)
+
+
+def get_promotions(codes):
+    """
+    Return ``{code: PromotionCode}`` snapshots for the given codes, matched
+    case-insensitively and looked up in the per-process LRU, then the
+    shared cache, then the database. Each snapshot carries a
+    ``product_ids`` frozenset of applicable products. Unknown codes are
+    left out of the result.
+    """
+    from .models import PromotionCode
+
+    codes = set(codes)
+    found = {}
+    missing = set()
+    for key in {_promo_key(code) for code in codes}:
+        promo = _local_promos.get(key)
+        if promo is None:
+            missing.add(key)
+        else:
+            found[key] = promo
+
+    if missing:
+        for key, promo in cache.get_many(list(missing)).items():
+            missing.discard(key)
+            found[key] = promo
+            _remember_locally(key, promo)
+
+    if missing:
+        promos = {
+            promo.id: promo
+            for promo in PromotionCode.objects.filter_codes(
+                key[len(PROMO_KEY_PREFIX):] for key in missing
+            )
+        }
+        product_ids = {promo_id: set() for promo_id in promos}
+        for promo_id, product_id in PromotionCode.products.through.objects.filter(
+            promotioncode_id__in=promos
+        ).values_list('promotioncode_id', 'product_id'):
+            product_ids[promo_id].add(product_id)
+
+        for promo in promos.values():
+            promo.product_ids = frozenset(product_ids[promo.id])
+            key = _promo_key(promo.code)
+            cache.set(key, promo, _shared_timeout(promo))
+            _remember_locally(key, promo)
+            found[key] = promo
+
+    return {
+        code: found[_promo_key(code)]
+        for code in codes
+        if _promo_key(code) in found
+    }
+
+
+def get_promotion(code):
+    return get_promotions([code]).get(code)
+
+
+def _drop_promotions(keys):
+    for key in keys:
+        _local_promos.delete(key)
+    cache.delete_many(keys)
+
+
+def invalidate_promotions(codes):
+    """
+    Drop the cached snapshots of ``codes``. Inside a transaction they are
+    dropped again on commit, since other connections may have cached the
+    old row in between.
+    """
+    keys = [_promo_key(code) for code in codes]
+    if not keys:
+        return
+    _drop_promotions(keys)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _drop_promotions(keys))
+
+
+_local_products = LocalLRU(getattr(settings, 'PRODUCT_CACHE_LOCAL_SIZE', 10000))
+
+
+def _product_version_key(product_id):
+    return f"{PRODUCT_VERSION_KEY_PREFIX}{product_id}"
+
+
+def _product_key(product_id, version):
+    return f"{PRODUCT_KEY_PREFIX}{product_id}:{version}"
+
+
+def _count_product_lookups(result, amount):
+    if amount:
+        registry.inc('api_product_cache_lookups_total', (('result', result),), amount)
+
+
+def get_products(product_ids):
+    """
+    Return ``{product_id: ProductSnapshot}`` for the given ids, looked up
+    in the per-process LRU, then the shared cache, then the database in
+    one query. Unknown ids are left out of the result.
+
+    Shared entries are keyed by product id plus a version token stored
+    under its own key. Invalidation deletes the token, so a snapshot read
+    from the database before a change can only land under the old,
+    unreachable key. ``quantity_in_stock`` is only a hint; stock
+    decisions must go to the database.
+    """
+    from .models import Product
+
+    product_ids = set(product_ids)
+    found = {}
+    for product_id in product_ids:
+        snapshot = _local_products.get(product_id)
+        if snapshot is not None:
+            found[product_id] = snapshot
+    _count_product_lookups('local', len(found))
+
+    missing = product_ids - found.keys()
+    if not missing:
+        return found
+
+    versions = {
+        int(key[len(PRODUCT_VERSION_KEY_PREFIX):]): version
+        for key, version in cache.get_many([_product_version_key(product_id) for product_id in missing]).items()
+    }
+    # 版本須在讀資料庫之前寫入，讀取期間的失效才會讓這次的快照作廢
+    new_versions = {product_id: secrets.token_hex(8) for product_id in missing - versions.keys()}
+    timeout = getattr(settings, 'PRODUCT_CACHE_TIMEOUT', 300)
+    if new_versions:
+        cache.set_many(
+            {_product_version_key(product_id): version for product_id, version in new_versions.items()},
+            timeout,
+        )
+        versions.update(new_versions)
+
+    local_expires_at = time.time() + getattr(settings, 'PRODUCT_CACHE_LOCAL_TTL', 1)
+    keys = {_product_key(product_id, versions[product_id]): product_id for product_id in missing}
+    shared = 0
+    for key, snapshot in cache.get_many(list(keys)).items():
+        product_id = keys[key]
+        missing.discard(product_id)
+        found[product_id] = snapshot
+        _local_products.set(product_id, snapshot, local_expires_at)
+        shared += 1
+    _count_product_lookups('shared', shared)
+    _count_product_lookups('miss', len(missing))
+
+    if missing:
+        snapshots = {
+            row[0]: ProductSnapshot(*row)
+            for row in Product.objects.filter(id__in=missing).values_list(*ProductSnapshot._fields)
+        }
+        cache.set_many(
+            {_product_key(product_id, versions[product_id]): snapshot for product_id, snapshot in snapshots.items()},
+            timeout,
+        )
+        for product_id, snapshot in snapshots.items():
+            _local_products.set(product_id, snapshot, local_expires_at)
+        found.update(snapshots)
+    return found
+
+
+def get_product(product_id):
+    return get_products([product_id]).get(product_id)
+
+
+def _drop_products(product_ids):
+    for product_id in product_ids:
+        _local_products.delete(product_id)
+    cache.delete_many([_product_version_key(product_id) for product_id in product_ids])
+
+
+def invalidate_products(product_ids):
+    """
+    Drop the cached snapshots of ``product_ids``. Inside a transaction
+    they are dropped again on commit, since other connections may have
+    cached the old row in between.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    _drop_products(product_ids)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _drop_products(product_ids))
+
+
+_token_lock = threading.Lock()
+_token_hashes = (frozenset(), 0.0)
+
+
+def active_token_hashes():
+    """
+    Digests of all unrevoked ApiTokens, reloaded from the database at most
+    every API_TOKEN_CACHE_TTL seconds per process.
+    """
+    global _token_hashes
+    hashes, expires_at = _token_hashes
+    if expires_at > time.time():
+        return hashes
+
+    from .models import ApiToken
+
+    with _token_lock:
+        hashes, expires_at = _token_hashes
+        if expires_at <= time.time():
+            hashes = frozenset(
+                ApiToken.objects.filter(revoked_at__isnull=True).values_list('key_hash', flat=True)
+            )
+            ttl = getattr(settings, 'API_TOKEN_CACHE_TTL', 30)
+            _token_hashes = (hashes, time.time() + ttl)
+        return hashes
+
+
+def invalidate_api_tokens():
+    global _token_hashes
+    with _token_lock:
+        _token_hashes = (frozenset(), 0.0)
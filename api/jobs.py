@@ -0,0 +1,160 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OrderImportJob
+from .services import import_orders_retrying, parse_order
+
+logger = logging.getLogger(__name__)
+
+# 佇列模式只做不需查資料庫的格式檢查就寫入工作表，
+# 計價、扣庫存等重工作交給 run_order_workers 批次處理。
+
+
+def enqueue_order(payload):
+    """
+    Validate ``payload`` without touching products or promotions and store
+    it as a pending OrderImportJob. A repeated idempotency key returns the
+    job that was queued first. Raises OrderImportError on a malformed
+    payload.
+    """
+    parsed = parse_order(payload)
+    if parsed.idempotency_key:
+        job = OrderImportJob.objects.filter(idempotency_key=parsed.idempotency_key).first()
+        if job is not None:
+            return job
+    try:
+        with transaction.atomic():
+            return OrderImportJob.objects.create(
+                payload=payload, idempotency_key=parsed.idempotency_key
+            )
+    except IntegrityError:
+        job = OrderImportJob.objects.filter(idempotency_key=parsed.idempotency_key).first()
+        if job is None:
+            raise
+        return job
+
+
+def claim_jobs(batch_size):
+    """
+    Mark up to ``batch_size`` jobs as processing and return them. Pending
+    jobs are taken in id order, together with jobs whose worker has held
+    them longer than ORDER_JOB_CLAIM_TIMEOUT seconds. Rows locked by other
+    workers are skipped rather than waited on.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'ORDER_JOB_CLAIM_TIMEOUT', 300))
+    with transaction.atomic():
+        jobs = list(
+            OrderImportJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=OrderImportJob.PENDING)
+                | Q(status=OrderImportJob.PROCESSING, claimed_at__lt=stale)
+            )
+            .order_by('id')[:batch_size]
+        )
+        if jobs:
+            OrderImportJob.objects.filter(id__in=[job.id for job in jobs]).update(
+                status=OrderImportJob.PROCESSING, claimed_at=now, attempts=F('attempts') + 1
+            )
+    for job in jobs:
+        job.status, job.claimed_at, job.attempts = OrderImportJob.PROCESSING, now, job.attempts + 1
+    return jobs
+
+
+def process_jobs(batch_size=100):
+    """
+    Claim one batch of jobs and import their orders. The orders and the
+    job results are committed together; a batch that raises is put back
+    to pending, and one whose worker dies midway is reclaimed after
+    ORDER_JOB_CLAIM_TIMEOUT. A batch that fails for any other reason is
+    retried one job at a time, and the jobs that still fail are marked
+    failed. Returns the number of jobs handled.
+    """
+    jobs = claim_jobs(batch_size)
+    if not jobs:
+        return 0
+
+    max_attempts = getattr(settings, 'ORDER_JOB_MAX_ATTEMPTS', 3)
+    runnable = []
+    for job in jobs:
+        if job.attempts > max_attempts:
+            job.status = OrderImportJob.FAILED
+            job.result = _failed_result(job, "Too many attempts")
+        else:
+            runnable.append(job)
+
+    try:
+        _import_jobs(jobs, runnable)
+    except DatabaseError:
+        _release(jobs)
+        raise
+    except Exception:
+        # 多半是某筆 payload 格式異常；逐筆重跑，只讓出錯的工作失敗，worker 繼續運作
+        logger.exception("Order import batch failed, importing its jobs one at a time")
+        _import_jobs([job for job in jobs if job not in runnable], [])
+        for position, job in enumerate(runnable):
+            try:
+                _import_jobs([job], [job])
+            except DatabaseError:
+                _release(runnable[position:])
+                raise
+            except Exception as exc:
+                logger.exception("Order import job %s failed", job.id)
+                job.status = OrderImportJob.FAILED
+                job.result = _failed_result(job, f"Malformed payload: {exc.__class__.__name__}")
+                job.finished_at = timezone.now()
+                job.save(update_fields=['status', 'result', 'finished_at'])
+
+    return len(jobs)
+
+
+def _release(jobs):
+    # 釋放領取，讓其他 worker 立即重試；釋放失敗時仍會在逾時後被重新領取
+    OrderImportJob.objects.filter(id__in=[job.id for job in jobs]).update(
+        status=OrderImportJob.PENDING, claimed_at=None
+    )
+
+
+def _order_number(job):
+    return job.payload.get('order_number') if isinstance(job.payload, dict) else None
+
+
+def _failed_result(job, detail):
+    return {
+        "order_number": _order_number(job),
+        "status": "error",
+        "detail": detail,
+        "final_price": None,
+    }
+
+
+def _import_jobs(jobs, runnable):
+    with transaction.atomic():
+        payloads = [job.payload for job in runnable]
+        results = []
+        if payloads:
+            results = import_orders_retrying(payloads)
+
+        finished_at = timezone.now()
+        for job, result in zip(runnable, results):
+            job.status = OrderImportJob.DONE if result['status'] == 'created' else OrderImportJob.FAILED
+            job.result = result
+        for job in jobs:
+            job.finished_at = finished_at
+        OrderImportJob.objects.bulk_update(jobs, ['status', 'result', 'finished_at'])
+
+
+def job_status(job):
+    result = job.result or {}
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "order_number": _order_number(job),
+        "detail": result.get('detail'),
+        "final_price": result.get('final_price'),
+    }
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import re
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+async def _request(host, port, method, path, body, headers):
+    """
+    Send one HTTP/1.1 request and return ``(status_code, queries)``, where
+    ``queries`` is read from the Server-Timing header when present.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {host}:{port}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        queries = None
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'server-timing':
+                match = SERVER_TIMING_QUERIES.search(value)
+                if match:
+                    queries = int(match.group(1))
+        await reader.read()
+        return int(status_line.split()[1]), queries
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors, status_codes=None, queries=None):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "status_codes": dict(sorted((status_codes or {}).items())),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "queries_per_request": round(statistics.fmean(queries), 2) if queries else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+            "p50": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            "p95": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        },
+    }
+
+
+async def run_load(url, payloads, concurrency, headers=None):
+    """
+    POST every payload to ``url`` with ``concurrency`` concurrent clients
+    and return a latency/throughput summary. Every response counts towards
+    the latency figures and is tallied by status code; connection failures
+    count as errors.
+    """
+    parts = urlsplit(url)
+    base_url = f"{parts.scheme}://{parts.netloc}"
+    path = parts.path + (f"?{parts.query}" if parts.query else '')
+    return await run_requests(
+        base_url, [('POST', path, payload) for payload in payloads], concurrency, headers
+    )
+
+
+async def run_requests(base_url, requests, concurrency, headers=None):
+    """
+    Like run_load, for ``(method, path, payload)`` requests against
+    ``base_url``; ``payload`` is None for requests without a body.
+    """
+    parts = urlsplit(base_url)
+    host, port = parts.hostname, parts.port or 80
+    headers = headers or {}
+
+    queue = asyncio.Queue()
+    for method, path, payload in requests:
+        queue.put_nowait((method, path, json.dumps(payload).encode() if payload is not None else b''))
+
+    latencies = []
+    status_codes = {}
+    queries = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        while True:
+            try:
+                method, path, body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                status_code, query_count = await _request(host, port, method, path, body, headers)
+            except (OSError, IndexError, ValueError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            status_codes[status_code] = status_codes.get(status_code, 0) + 1
+            if query_count is not None:
+                queries.append(query_count)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors, status_codes, queries)
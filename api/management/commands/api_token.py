@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = "Issue, revoke or list API access tokens."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        subparsers.add_parser('create').add_argument('name')
+        subparsers.add_parser('revoke').add_argument('name')
+        subparsers.add_parser('list')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'create':
+            if ApiToken.objects.filter(name=options['name']).exists():
+                raise CommandError(f"Token {options['name']} already exists")
+            # 只會顯示這一次，資料庫只保存雜湊值
+            self.stdout.write(ApiToken.issue(options['name']))
+        elif options['action'] == 'revoke':
+            try:
+                token = ApiToken.objects.get(name=options['name'], revoked_at__isnull=True)
+            except ApiToken.DoesNotExist:
+                raise CommandError(f"No active token named {options['name']}")
+            token.revoke()
+            self.stdout.write(self.style.SUCCESS(f"Revoked {token.name}"))
+        else:
+            for token in ApiToken.objects.order_by('name'):
+                state = f"revoked {token.revoked_at:%Y-%m-%d %H:%M}" if token.revoked_at else "active"
+                self.stdout.write(f"{token.name}\t{state}")
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import archive
+
+
+def _parse_datetime(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid datetime: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Move orders created before a date out of the order tables, into the "
+        "archive table or a compressed NDJSON or Parquet file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help="ISO date or datetime (exclusive).")
+        parser.add_argument('--format', choices=archive.FORMATS, default='table')
+        parser.add_argument('--output', help="File to write for the ndjson (.ndjson.gz) and parquet formats.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        before = _parse_datetime(options['before'])
+        if before > timezone.now():
+            raise CommandError("--before must not be in the future")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        try:
+            archived, dropped = archive.archive(
+                before, options['format'], options['output'], options['batch_size']
+            )
+        except archive.ArchiveError as exc:
+            raise CommandError(str(exc))
+
+        destination = options['output'] or 'the archive table'
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} orders created before {before:%Y-%m-%d %H:%M} to {destination}"
+        ))
+        if dropped:
+            self.stdout.write(f"Dropped partitions: {', '.join(dropped)}")
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api import bench
+from api.loadtest import run_requests
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed benchmark data and measure the api endpoints through the Django "
+        "test client and, with --base-url, a running server with concurrent "
+        "clients. Prints a JSON report that can be compared across commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help="Create or top up the bench data first.")
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--promos', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--lines', type=int, default=3, help="Line items per order.")
+        parser.add_argument('--batch', type=int, default=50, help="Orders or items per bulk request.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario and client.")
+        parser.add_argument('--scenario', action='append', help="Only run these scenarios (repeatable).")
+        parser.add_argument(
+            '--client', choices=['test', 'server', 'both'], default='test',
+            help="Drive the Django test client, a running server (--base-url), or both.",
+        )
+        parser.add_argument('--base-url', default='http://127.0.0.1:8008')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--token', default='omni_pretest_token')
+        parser.add_argument(
+            '--connections', action='store_true',
+            help="Also compare per-request database connections with persistent ones.",
+        )
+        parser.add_argument(
+            '--contention', type=int, metavar='BUYERS',
+            help="Also time BUYERS concurrent buyers of one product, unsharded and sharded.",
+        )
+        parser.add_argument('--shards', type=int, default=16, help="Shards for --contention.")
+        parser.add_argument(
+            '--product-cache', action='store_true',
+            help="Also time product price lookups from the database and from the product cache.",
+        )
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+        parser.add_argument('--baseline', help="Earlier report to compare against; regressions fail the command.")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p95 growth against --baseline.")
+
+    def handle(self, *args, **options):
+        if min(options['requests'], options['concurrency'], options['lines'], options['batch']) < 1:
+            raise CommandError("--requests, --concurrency, --lines and --batch must be positive")
+
+        if options['seed']:
+            bench.seed(options['products'], options['promos'], options['orders'], lines=options['lines'])
+
+        scenarios = bench.scenarios(lines=options['lines'], batch=options['batch'])
+        if not scenarios:
+            raise CommandError("No bench data; run with --seed first")
+        if options['scenario']:
+            unknown = set(options['scenario']) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f"Unknown scenario: {', '.join(sorted(unknown))}")
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['scenario']]
+
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "started_at": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "requests": options['requests'],
+                "concurrency": options['concurrency'],
+                "lines": options['lines'],
+                "batch": options['batch'],
+            },
+            "scenarios": {},
+        }
+        lookups = bench.product_cache_lookups()
+        for scenario in scenarios:
+            results = report['scenarios'][scenario.name] = {}
+            if options['client'] in ('test', 'both'):
+                results['test_client'] = bench.run_in_process(scenario, options['requests'], options['token'])
+            if options['client'] in ('server', 'both'):
+                requests = [
+                    (scenario.method, *scenario.build(i)) for i in range(options['requests'])
+                ]
+                results['server'] = asyncio.run(run_requests(
+                    options['base_url'], requests, options['concurrency'],
+                    headers={'X-Access-Token': options['token']},
+                ))
+
+        # 只統計本行程（測試 client）的查詢；伺服器模式的快取數據見其 /metrics
+        report['product_cache'] = bench.hit_ratio(lookups, bench.product_cache_lookups())
+        if options['product_cache']:
+            report['product_cache']['lookup_latency'] = bench.product_cache(options['requests'])
+
+        if options['connections']:
+            report['connections'] = bench.connection_overhead(options['requests'])
+        if options['contention']:
+            report['contention'] = bench.stock_contention(options['contention'], options['shards'])
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = bench.compare(json.load(f), report, options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against baseline:\n" + "\n".join(regressions))
+            self.stderr.write("No regressions against baseline")
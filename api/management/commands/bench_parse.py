@@ -0,0 +1,94 @@
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.parsers import loads, orjson
+from api.services import parse_order
+
+
+def build_payload(lines, products, seed=0):
+    """
+    Return the JSON body of one ``import_order`` request with ``lines``
+    line items over ``products`` distinct products, so most products
+    appear on several lines.
+    """
+    rng = random.Random(seed)
+    return json.dumps({
+        "order_number": "BENCH-PARSE",
+        "products": [
+            {"product_id": rng.randint(1, products), "quantity": rng.randint(1, 5)}
+            for _ in range(lines)
+        ],
+    }).encode()
+
+
+def parse_baseline(body):
+    # 改版前的做法：標準函式庫解碼，逐行轉成 tuple，不合併也不檢查 product_id
+    data = json.loads(body)
+    lines = []
+    for item in data['products']:
+        product_id = item.get('product_id')
+        try:
+            quantity = int(item.get('quantity', 1))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity < 1:
+            raise ValueError(product_id)
+        lines.append((product_id, quantity))
+    return lines
+
+
+def parse_fast(body):
+    return parse_order(loads(body)).lines
+
+
+def measure(parse, body, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(body)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        result = parse(body)
+        # retained 是解析完成後仍留在匯入流程中的行項目大小
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "lines_out": len(result),
+        "best_ms": round(min(timings) * 1000, 2),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 2),
+        "peak_kib": round(peak / 1024, 1),
+        "retained_kib": round(retained / 1024, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Time decoding and validating one large import_order body with the "
+        "previous stdlib path and with the fast parser and Cart, and print a "
+        "JSON summary including peak memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if min(options['lines'], options['products'], options['repeat']) < 1:
+            raise CommandError("--lines, --products and --repeat must be positive")
+        body = build_payload(options['lines'], options['products'])
+        self.stdout.write(json.dumps({
+            "lines": options['lines'],
+            "products": options['products'],
+            "body_kib": round(len(body) / 1024, 1),
+            "orjson": orjson is not None,
+            "baseline": measure(parse_baseline, body, options['repeat']),
+            "fast": measure(parse_fast, body, options['repeat']),
+        }, indent=2))
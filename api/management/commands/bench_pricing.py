@@ -0,0 +1,75 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.pricing import APPLIES_TO_ITEMS, APPLIES_TO_ORDER, Rule, price_order
+
+
+def build_case(lines, promos, products, promo_size, seed=0):
+    """
+    Build a synthetic cart of ``lines`` line items and ``promos`` active
+    rules over ``products`` distinct products, without touching the
+    database.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    prices = {product_id: Decimal(rng.randint(10, 5000)) for product_id in range(1, products + 1)}
+    cart = [(rng.randint(1, products), rng.randint(1, 5)) for _ in range(lines)]
+    rules = [
+        Rule(
+            code=f"BENCH{i}",
+            discount_type=rng.choice(['percent', 'fixed']),
+            value=Decimal(rng.randint(1, 30)),
+            product_ids=frozenset(rng.sample(range(1, products + 1), promo_size)),
+            applies_to=APPLIES_TO_ORDER if i % 10 == 0 else APPLIES_TO_ITEMS,
+            tiers=((Decimal('1000'), Decimal('5')), (Decimal('5000'), Decimal('10'))) if i % 4 == 0 else (),
+            stackable=i % 3 == 0,
+            start_date=now - timedelta(days=1),
+            end_date=now + timedelta(days=1),
+        )
+        for i in range(promos)
+    ]
+    return cart, prices, rules, now
+
+
+class Command(BaseCommand):
+    help = "Time pricing.price_order on one large synthetic cart and print a JSON summary."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10000)
+        parser.add_argument('--promos', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--promo-size', type=int, default=100, help="Products per promotion.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if min(options['lines'], options['products'], options['repeat']) < 1:
+            raise CommandError("--lines, --products and --repeat must be positive")
+        promo_size = min(options['promo_size'], options['products'])
+        cart, prices, rules, now = build_case(
+            options['lines'], options['promos'], options['products'], promo_size
+        )
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            priced = price_order(cart, prices, rules, now)
+            timings.append(time.perf_counter() - started)
+
+        self.stdout.write(json.dumps({
+            "lines": options['lines'],
+            "promos": options['promos'],
+            "products": options['products'],
+            "promo_size": promo_size,
+            "repeat": options['repeat'],
+            "applied_codes": len(priced.applied_codes),
+            "best_ms": round(min(timings) * 1000, 2),
+            "mean_ms": round(statistics.fmean(timings) * 1000, 2),
+            "orders_per_s": round(1 / min(timings), 1),
+        }, indent=2))
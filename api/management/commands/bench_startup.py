@@ -0,0 +1,102 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+# (名稱, WSGI 入口模組, settings 模組)
+PROFILES = [
+    ('full', 'pretest.wsgi', 'pretest.settings'),
+    ('api', 'pretest.wsgi_api', 'pretest.settings_api'),
+]
+
+# 在全新的直譯器中匯入入口模組並送出第一個請求，印出 JSON 結果
+STARTUP_SCRIPT = """
+import importlib, io, json, resource, sys, time
+started = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+statuses = []
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[2], 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+    'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+}
+b''.join(module.application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+finished = time.perf_counter()
+from django.apps import apps
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (finished - imported) * 1000,
+    "status": int(statuses[0].split()[0]),
+    "modules": len(sys.modules),
+    "apps": [config.name for config in apps.get_app_configs()],
+    "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def run_once(entry, settings_module, path):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, PYTHONPATH=os.pathsep.join(sys.path))
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT, entry, path],
+        env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if completed.returncode:
+        raise CommandError(f"Starting {entry} with {settings_module} failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_ms'] = elapsed * 1000
+    return result
+
+
+def measure(entry, settings_module, path, repeat):
+    """
+    Start ``entry`` in ``repeat`` fresh interpreters and return the median
+    import time, time to the first response and whole process time, with
+    the module count, installed apps and peak RSS of the last run.
+    """
+    runs = [run_once(entry, settings_module, path) for _ in range(repeat)]
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 1)
+        for key in ('import_ms', 'first_request_ms', 'process_ms')
+    }
+    last = runs[-1]
+    summary.update(
+        status=last['status'], modules=last['modules'], apps=last['apps'], max_rss_kib=last['max_rss_kib']
+    )
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Time worker start-up for each settings profile: importing the WSGI "
+        "entry point and serving the first request, each in a fresh "
+        "interpreter. Prints a JSON summary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile', nargs=3, action='append', metavar=('NAME', 'ENTRY', 'SETTINGS'),
+            help="Profile to time (repeatable); defaults to the full and api profiles.",
+        )
+        parser.add_argument('--path', default='/metrics', help="Path of the first request.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be positive")
+        profiles = options['profile'] or PROFILES
+        self.stdout.write(json.dumps({
+            "python": sys.version.split()[0],
+            "path": options['path'],
+            "repeat": options['repeat'],
+            "profiles": {
+                name: measure(entry, settings_module, options['path'], options['repeat'])
+                for name, entry, settings_module in profiles
+            },
+        }, indent=2))
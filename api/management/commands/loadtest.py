@@ -0,0 +1,72 @@
+import asyncio
+import json
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtest import run_load
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive import_order or restock against a running server with many "
+        "concurrent clients, e.g. runserver/gunicorn (WSGI) vs uvicorn "
+        "pretest.asgi:application (ASGI), and print a JSON summary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8008')
+        parser.add_argument('--target', choices=['import', 'restock'], default='import')
+        parser.add_argument(
+            '--async', dest='use_async', action='store_true',
+            help="Use the /api/async/ variants of the endpoints.",
+        )
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--token', default='omni_pretest_token')
+        parser.add_argument(
+            '--lines', type=int, default=1,
+            help="Line items per imported order, to test large payloads.",
+        )
+        parser.add_argument(
+            '--unauthenticated', action='store_true',
+            help="Send an invalid token to measure how fast requests are rejected.",
+        )
+
+    def handle(self, *args, **options):
+        # 伺服器需連到同一個資料庫，才能取得可下單的商品
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:100])
+        if not product_ids:
+            raise CommandError("No products in the database to order or restock")
+
+        prefix = '/api/async' if options['use_async'] else '/api'
+        run_id = uuid.uuid4().hex[:8]
+        if options['target'] == 'import':
+            # 每筆訂單每個品項扣 1 件庫存，請先確保庫存足夠
+            url = f"{options['base_url']}{prefix}/import-order/"
+            payloads = [
+                {
+                    "order_number": f"LOAD-{run_id}-{i}",
+                    "products": [
+                        {"product_id": product_ids[(i + line) % len(product_ids)], "quantity": 1}
+                        for line in range(options['lines'])
+                    ],
+                }
+                for i in range(options['requests'])
+            ]
+        else:
+            # restock 只有單一商品路徑，固定打第一個商品
+            url = f"{options['base_url']}{prefix}/products/{product_ids[0]}/restock/"
+            payloads = [{"quantity": 1}] * options['requests']
+
+        token = 'invalid' if options['unauthenticated'] else options['token']
+        summary = asyncio.run(run_load(
+            url, payloads, options['concurrency'], headers={'X-Access-Token': token}
+        ))
+        summary.update({
+            "url": url,
+            "target": options['target'],
+            "concurrency": options['concurrency'],
+        })
+        self.stdout.write(json.dumps(summary, indent=2))
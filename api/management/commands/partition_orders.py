@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Switch orders and order items to monthly partitions on PostgreSQL, "
+        "create upcoming partitions, or list them."
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        subparsers.add_parser('enable').add_argument('--months-ahead', type=int, default=3)
+        subparsers.add_parser('create').add_argument('--months-ahead', type=int, default=3)
+        subparsers.add_parser('status')
+
+    def handle(self, *args, **options):
+        if options.get('months_ahead', 0) < 0:
+            raise CommandError("--months-ahead must not be negative")
+        try:
+            if options['action'] == 'enable':
+                partitions.enable(options['months_ahead'])
+                self.stdout.write(self.style.SUCCESS(
+                    "Orders partitioned by month; restart the app servers to pick up the new layout"
+                ))
+            elif options['action'] == 'create':
+                created = partitions.create_partitions(options['months_ahead'])
+                self.stdout.write(self.style.SUCCESS(
+                    f"Created {len(created)} partitions" + (f": {', '.join(created)}" if created else "")
+                ))
+            else:
+                self._status()
+        except partitions.PartitioningError as exc:
+            raise CommandError(str(exc))
+
+    def _status(self):
+        if not partitions.is_partitioned():
+            self.stdout.write("Orders are not partitioned")
+            return
+        for model in partitions.PARTITIONED_MODELS:
+            for name, upper in partitions.partitions(model):
+                self.stdout.write(f"{name}\tbefore {upper:%Y-%m-%d}")
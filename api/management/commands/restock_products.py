@@ -0,0 +1,55 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import MAX_PRODUCT_ID, chunked, restock_products, sum_quantities
+
+
+def read_receipt(path):
+    """
+    Yield ``(product_id, quantity)`` from a warehouse receipt CSV with
+    ``product_id`` and ``quantity`` columns.
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                product_id, quantity = int(row['product_id']), int(row['quantity'])
+            except (KeyError, TypeError, ValueError):
+                raise CommandError(f"{path}:{line_number}: invalid row {row}")
+            if not 0 < product_id <= MAX_PRODUCT_ID:
+                raise CommandError(f"{path}:{line_number}: invalid product_id {product_id}")
+            if quantity <= 0:
+                raise CommandError(f"{path}:{line_number}: quantity must be positive")
+            yield product_id, quantity
+
+
+class Command(BaseCommand):
+    help = "Apply a warehouse receipt CSV (product_id, quantity) as bulk restocks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        # 各批分別提交，先完整檢查一遍檔案，避免寫到一半才遇到錯誤的列
+        for _ in read_receipt(path):
+            pass
+
+        restocked = 0
+        missing = []
+        for chunk in chunked(read_receipt(path), options['chunk_size']):
+            deltas = sum_quantities(chunk)
+            chunk_missing = restock_products(deltas)
+            restocked += len(deltas) - len(chunk_missing)
+            missing.extend(chunk_missing)
+
+        if missing:
+            self.stderr.write(f"Unknown product ids: {', '.join(map(str, missing))}")
+        self.stdout.write(self.style.SUCCESS(f"Restocked {restocked} products"))
@@ -0,0 +1,92 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api import jobs, rollups
+
+logger = logging.getLogger(__name__)
+
+
+def _work(batch_size, poll_interval, once, stop):
+    while not stop.is_set():
+        try:
+            handled = jobs.process_jobs(batch_size)
+        except Exception:
+            # 整批回滾；領取失敗的工作仍是 pending，處理失敗的則等逾時後重新領取。
+            # 任何例外都只記錄下來，不讓 worker 行程結束
+            logger.exception("Order import batch failed")
+            connections.close_all()
+            stop.wait(poll_interval)
+            continue
+        if not handled:
+            if once:
+                break
+            stop.wait(poll_interval)
+    rollups.flush()
+
+
+def _worker_process(batch_size, poll_interval, once, stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        _work(batch_size, poll_interval, once, stop)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Process orders queued by import_order (mode=queued) with a pool of "
+        "worker processes that claim jobs in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once the queue is drained instead of polling.",
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        args = (options['batch_size'], options['poll_interval'], options['once'], stop)
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        started = time.perf_counter()
+        if options['workers'] == 1:
+            try:
+                _work(*args)
+            except KeyboardInterrupt:
+                stop.set()
+        else:
+            # 子行程不能沿用父行程的資料庫連線
+            connections.close_all()
+            processes = [
+                context.Process(target=_worker_process, args=args)
+                for _ in range(options['workers'])
+            ]
+            for process in processes:
+                process.start()
+            try:
+                for process in processes:
+                    process.join()
+            except KeyboardInterrupt:
+                stop.set()
+                for process in processes:
+                    process.join()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Workers stopped after {time.perf_counter() - started:.1f}s"
+        ))
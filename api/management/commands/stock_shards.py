@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.models import Product, StockShard
+
+
+class Command(BaseCommand):
+    help = "Shard hot products' stock across counter rows, fold it back, or consolidate the shards."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        enable = subparsers.add_parser('enable')
+        enable.add_argument('product_id', type=int)
+        enable.add_argument('--shards', type=int, default=16)
+        subparsers.add_parser('disable').add_argument('product_id', type=int)
+        consolidate = subparsers.add_parser('consolidate')
+        consolidate.add_argument(
+            '--interval', type=float,
+            help="Keep consolidating every INTERVAL seconds instead of once.",
+        )
+
+    def handle(self, *args, **options):
+        if options['action'] == 'consolidate':
+            self._consolidate(options['interval'])
+            return
+
+        try:
+            product = Product.objects.get(id=options['product_id'])
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product_id']} not found")
+
+        if options['action'] == 'enable':
+            if options['shards'] < 1:
+                raise CommandError("--shards must be positive")
+            product.enable_sharding(options['shards'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{product.name}: {product.quantity_in_stock} in stock across {options['shards']} shards"
+            ))
+        else:
+            product.disable_sharding()
+            self.stdout.write(self.style.SUCCESS(
+                f"{product.name}: {product.quantity_in_stock} in stock, unsharded"
+            ))
+
+    def _consolidate(self, interval):
+        while True:
+            count = StockShard.objects.consolidate()
+            self.stdout.write(f"Consolidated {count} sharded products")
+            if interval is None:
+                return
+            # 兩次彙總之間不佔用資料庫連線
+            connection.close()
+            time.sleep(interval)
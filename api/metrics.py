@@ -0,0 +1,216 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+logger = logging.getLogger('api.performance')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'api_requests_total': ('counter', "Requests handled, by view, method and status."),
+    'api_request_duration_seconds': ('histogram', "Wall time per request, by view."),
+    'api_db_queries_total': ('counter', "Database queries executed, by view."),
+    'api_db_duration_seconds_total': ('counter', "Time spent in database queries, by view."),
+    'api_phase_duration_seconds_total': ('counter', "Time spent in each request phase, by view."),
+    'api_product_cache_lookups_total': ('counter', "Product snapshot lookups, by cache layer that answered."),
+}
+
+
+class Registry:
+    """
+    Per-process Prometheus counters and histograms. Each worker process
+    exposes its own values; Prometheus sums them across scrape targets.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(DURATION_BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def value(self, name, labels=()):
+        with self._lock:
+            return self._counters.get((name, labels), 0)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS + ('+Inf',), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels
+    ) + '}'
+
+
+registry = Registry()
+
+_current = ContextVar('api_request_timing', default=None)
+
+
+class RequestTiming:
+    """
+    Wall time, database queries and named phase durations for one request.
+    Instances are installed as a ``connection.execute_wrapper``.
+    """
+    __slots__ = ('started', 'queries', 'db_time', 'phases')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+
+@contextmanager
+def phase(name):
+    """
+    Add the time spent in the block (or decorated function) to phase
+    ``name`` of the current request. Does nothing outside an instrumented
+    request.
+    """
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add_phase(name, time.perf_counter() - started)
+
+
+def measure(request, handler):
+    """
+    Run ``handler(request)`` with timing and query counting, then add a
+    Server-Timing header, record metrics and log slow requests. Nested
+    calls (middleware plus decorator) are measured once, by the outer one.
+    """
+    if _current.get() is not None:
+        return handler(request)
+
+    timing = RequestTiming()
+    token = _current.set(timing)
+    try:
+        with connection.execute_wrapper(timing):
+            response = handler(request)
+    finally:
+        _current.reset(token)
+    return _record(request, response, timing)
+
+
+async def measure_async(request, handler):
+    """
+    Async counterpart of ``measure`` for ASGI, awaiting ``handler(request)``
+    on the event loop instead of in a worker thread.
+    """
+    if _current.get() is not None:
+        return await handler(request)
+
+    timing = RequestTiming()
+    token = _current.set(timing)
+    try:
+        with connection.execute_wrapper(timing):
+            response = await handler(request)
+    finally:
+        _current.reset(token)
+    return _record(request, response, timing)
+
+
+def _record(request, response, timing):
+    elapsed = time.perf_counter() - timing.started
+
+    response['Server-Timing'] = ', '.join([
+        f"app;dur={elapsed * 1000:.2f}",
+        f'db;dur={timing.db_time * 1000:.2f};desc="{timing.queries} queries"',
+        *(f"{name};dur={duration * 1000:.2f}" for name, duration in timing.phases.items()),
+    ])
+
+    match = getattr(request, 'resolver_match', None)
+    view = (match.url_name or match.view_name) if match else 'unmatched'
+    view_label = (('view', view),)
+    registry.inc('api_requests_total', view_label + (
+        ('method', request.method), ('status', response.status_code)
+    ))
+    registry.observe('api_request_duration_seconds', view_label, elapsed)
+    registry.inc('api_db_queries_total', view_label, timing.queries)
+    registry.inc('api_db_duration_seconds_total', view_label, timing.db_time)
+    for name, duration in timing.phases.items():
+        registry.inc('api_phase_duration_seconds_total', view_label + (('phase', name),), duration)
+
+    if elapsed * 1000 >= getattr(settings, 'SLOW_REQUEST_MS', 500):
+        logger.warning(json.dumps({
+            "event": "slow_request",
+            "view": view,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(elapsed * 1000, 2),
+            "db_ms": round(timing.db_time * 1000, 2),
+            "queries": timing.queries,
+            "phases_ms": {name: round(duration * 1000, 2) for name, duration in timing.phases.items()},
+        }))
+    return response
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
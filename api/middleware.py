@@ -0,0 +1,28 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import measure, measure_async
+
+
+class PerformanceMiddleware:
+    """
+    Time every request, count its database queries and expose the result
+    as a Server-Timing header, Prometheus metrics and slow-request logs.
+    Runs natively in both WSGI and ASGI handlers.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # ASGI 下直接 await 後續的 handler，不佔用 sync_to_async 的執行緒
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return measure(request, self.get_response)
+
+    async def __acall__(self, request):
+        return await measure_async(request, self.get_response)
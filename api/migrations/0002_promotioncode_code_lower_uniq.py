@@ -0,0 +1,42 @@
+# Generated by Django 4.2.8 on 2026-10-17 06:23
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.functions.text
+
+
+def check_case_insensitive_duplicates(apps, schema_editor):
+    # 大小寫不同的重複代碼會讓唯一索引建立失敗，先給出明確訊息
+    PromotionCode = apps.get_model('api', 'PromotionCode')
+    duplicates = list(
+        PromotionCode.objects
+        .values(code_lower=django.db.models.functions.text.Lower('code'))
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .values_list('code_lower', flat=True)
+    )
+    if duplicates:
+        raise RuntimeError(
+            "Promotion codes differ only by case and must be renamed first: "
+            + ", ".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_insensitive_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='promotioncode',
+            name='code',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='promotioncode',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('code'), name='promotioncode_code_lower_uniq'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.8 on 2026-10-17 06:26
+
+import hashlib
+
+from django.db import migrations, models
+
+# 原本寫死在 decorators.py 的 token，保留給既有的呼叫端使用，可用 api_token revoke 停用
+LEGACY_TOKEN = 'omni_pretest_token'
+
+
+def create_legacy_token(apps, schema_editor):
+    ApiToken = apps.get_model('api', 'ApiToken')
+    ApiToken.objects.get_or_create(
+        name='legacy',
+        defaults={'key_hash': hashlib.sha256(LEGACY_TOKEN.encode()).hexdigest()},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('key_hash', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('revoked_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(create_legacy_token, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.8 on 2026-10-17 06:30
+
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 2000
+
+
+def backfill_price_snapshot(apps, schema_editor):
+    # 舊資料沒有下單當時的價格，只能以目前的商品價格為準，再依訂單總額分攤折扣
+    Order = apps.get_model('api', 'Order')
+    OrderProduct = apps.get_model('api', 'OrderProduct')
+    cent = Decimal('0.01')
+
+    last_id = 0
+    while True:
+        totals = dict(
+            Order.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'total_price')[:BATCH_SIZE]
+        )
+        if not totals:
+            return
+        last_id = max(totals)
+
+        items = list(
+            OrderProduct.objects.filter(order_id__in=totals)
+            .select_related('product')
+            .only('id', 'order_id', 'quantity', 'product__price')
+            .order_by('order_id', 'id')
+        )
+        for order_id, lines in groupby(items, key=lambda item: item.order_id):
+            lines = list(lines)
+            subtotal = sum(item.product.price * item.quantity for item in lines)
+            remaining = totals[order_id]
+            for item in lines:
+                item.unit_price = item.product.price
+                if item is lines[-1]:
+                    item.line_total = remaining
+                elif subtotal:
+                    item.line_total = (item.unit_price * item.quantity * totals[order_id] / subtotal).quantize(cent)
+                    remaining -= item.line_total
+        with transaction.atomic(using=schema_editor.connection.alias):
+            OrderProduct.objects.bulk_update(items, ['unit_price', 'line_total'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    # 不包在單一交易中，每批回填各自提交，不會把整張表的鎖保留到最後
+    atomic = False
+
+    dependencies = [
+        ('api', '0006_order_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_price_snapshot, migrations.RunPython.noop),
+    ]
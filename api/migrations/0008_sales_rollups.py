@@ -0,0 +1,42 @@
+# Generated by Django 4.2.8 on 2026-10-17 06:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_orderproduct_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromoSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('order_count', models.PositiveBigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('promo_code', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.promotioncode')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('quantity', models.PositiveBigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='promosalesrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'promo_code'), name='promosalesrollup_hour_promo_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='productsalesrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'product'), name='productsalesrollup_hour_product_uniq'),
+        ),
+    ]
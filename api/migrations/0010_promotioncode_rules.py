@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-17 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_orderimportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promotioncode',
+            name='applies_to',
+            field=models.CharField(choices=[('order', 'Whole order, when every product is eligible'), ('items', 'Eligible items only')], default='order', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='promotioncode',
+            name='stackable',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='promotioncode',
+            name='tiers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.8 on 2026-10-17 06:50
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.indexes import PostgresIndex
+from django.db import migrations, models
+
+
+def create_trigram_extension(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+class AddIndexOnline(migrations.AddIndex):
+    """
+    AddIndex that builds the index with CREATE INDEX CONCURRENTLY on
+    PostgreSQL, so a large product table stays writable meanwhile.
+    PostgreSQL-only index types are skipped on other databases.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(model, self.index, concurrently=True)
+        elif not isinstance(self.index, PostgresIndex):
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        elif not isinstance(self.index, PostgresIndex):
+            schema_editor.remove_index(model, self.index)
+
+
+class Migration(migrations.Migration):
+
+    # CONCURRENTLY 不能在交易中執行
+    atomic = False
+
+    dependencies = [
+        ('api', '0011_stock_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_extension, migrations.RunPython.noop),
+        AddIndexOnline(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+        ),
+        AddIndexOnline(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ),
+        AddIndexOnline(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('name', 'description', config='simple'), name='product_search_gin'),
+        ),
+        AddIndexOnline(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='product_name_trgm_gin', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.8 on 2026-10-17 07:01
+
+import django.core.serializers.json
+from django.db import migrations, models, transaction
+import django.utils.timezone
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_item_created_at(apps, schema_editor):
+    # 品項沿用所屬訂單的建立時間，依 id 分批更新避免長時間鎖住整張表
+    Order = apps.get_model('api', 'Order')
+    OrderProduct = apps.get_model('api', 'OrderProduct')
+    order_created_at = Subquery(Order.objects.filter(id=OuterRef('order_id')).values('created_at')[:1])
+
+    last_id = 0
+    while True:
+        ids = list(
+            OrderProduct.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            return
+        last_id = ids[-1]
+        with transaction.atomic(using=schema_editor.connection.alias):
+            OrderProduct.objects.filter(id__gte=ids[0], id__lte=last_id).update(created_at=order_created_at)
+
+
+class Migration(migrations.Migration):
+    # 不包在單一交易中，每批更新各自提交，鎖只保留到該批結束；
+    # 中途失敗時已完成的批次仍在，重跑回填會覆寫成相同的值
+    atomic = False
+
+    dependencies = [
+        ('api', '0012_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_number', models.CharField(db_index=True, max_length=100)),
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('promo_code', models.CharField(blank=True, max_length=100, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('items', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_item_created_at, migrations.RunPython.noop),
+    ]
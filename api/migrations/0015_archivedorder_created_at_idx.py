@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_order_archive_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='created_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -1,85 +1,432 @@
-from django.db import models
+import hashlib
+import random
+import secrets
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Lower
 from django.utils import timezone
+
+from .caches import get_products, invalidate_products
+from .pricing import APPLIES_TO_ITEMS, APPLIES_TO_ORDER, Rule, parse_tiers, price_order
+
+
+# 商品搜尋使用不做詞幹處理的 simple 設定，中英文名稱都能以原字比對
+PRODUCT_SEARCH_CONFIG = 'simple'
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+class ProductManager(models.Manager):
+    # 不經 save() 的批次寫入不會觸發 signal，需自行讓商品快取失效
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        invalidate_products(obj.pk for obj in objs if obj.pk is not None)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        updated = super().bulk_update(objs, fields, *args, **kwargs)
+        invalidate_products(obj.pk for obj in objs)
+        return updated
+
+    def reserve_stock(self, quantities, shard_counts=None):
+        """
+        Decrement stock for every ``{product_id: quantity}`` pair in a single
+        conditional UPDATE. Raises InsufficientStock and changes nothing if
+        any product cannot cover its quantity.
+
+        Sharded products are reserved from their StockShard rows instead,
+        without locking the product row. ``shard_counts`` maps sharded
+        product ids to their shard count; it is looked up when omitted.
+        """
+        if not quantities:
+            return
+        if shard_counts is None:
+            shard_counts = dict(
+                self.filter(id__in=quantities, shard_count__gt=0).values_list('id', 'shard_count')
+            )
+        shard_counts = {product_id: count for product_id, count in shard_counts.items() if count}
+        plain = {
+            product_id: quantity for product_id, quantity in quantities.items()
+            if product_id not in shard_counts
+        }
+        with transaction.atomic():
+            short_ids = []
+            if plain:
+                short_ids = self._reserve_rows(plain)
+            if not short_ids:
+                short_ids = [
+                    product_id for product_id in sorted(shard_counts)
+                    if product_id in quantities and not StockShard.objects.reserve(
+                        product_id, quantities[product_id], shard_counts[product_id]
+                    )
+                ]
+            if short_ids:
+                raise InsufficientStock(
+                    f"Insufficient stock for product {', '.join(map(str, short_ids))}"
+                )
+
+    def _reserve_rows(self, quantities):
+        # 依 id 順序鎖定，避免並行訂單互相死結
+        list(
+            self.select_for_update()
+            .filter(id__in=quantities)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        reserved = Case(
+            *[
+                When(id=product_id, then=Value(quantity))
+                for product_id, quantity in quantities.items()
+            ],
+            output_field=models.PositiveIntegerField(),
+        )
+        updated = self.filter(
+            id__in=quantities, quantity_in_stock__gte=reserved
+        ).update(quantity_in_stock=F('quantity_in_stock') - reserved)
+        if updated == len(quantities):
+            return []
+        in_stock = dict(
+            self.filter(id__in=quantities).values_list('id', 'quantity_in_stock')
+        )
+        return sorted(
+            product_id for product_id, quantity in quantities.items()
+            if in_stock.get(product_id, 0) < quantity
+        )
+
+    def add_stock(self, deltas, batch_size=5000):
+        """
+        Add ``{product_id: quantity}`` to stock by joining the table against
+        a VALUES list, one UPDATE per ``batch_size`` products. Sharded
+        products also get the quantity spread over their shards. Returns
+        the ids of the products that exist and were updated.
+        """
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        updated_ids = []
+        items = list(deltas.items())
+        with transaction.atomic(), connection.cursor() as cursor:
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                # PostgreSQL 與 SQLite 3.35+ 都支援 UPDATE ... FROM 與 RETURNING
+                cursor.execute(
+                    f"WITH deltas (id, quantity) AS (VALUES {', '.join(['(%s, %s)'] * len(batch))}) "
+                    f"UPDATE {table} SET quantity_in_stock = {table}.quantity_in_stock + deltas.quantity "
+                    f"FROM deltas WHERE {table}.id = deltas.id "
+                    f"RETURNING {table}.id, {table}.shard_count",
+                    [value for item in batch for value in item],
+                )
+                for product_id, shard_count in cursor.fetchall():
+                    updated_ids.append(product_id)
+                    if shard_count:
+                        StockShard.objects.add(product_id, deltas[product_id], shard_count)
+        invalidate_products(updated_ids)
+        return updated_ids
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=0)
     quantity_in_stock = models.PositiveIntegerField(default=0)
-    
+    # 大於 0 時庫存分散在 StockShard，quantity_in_stock 為定期彙總的總數
+    shard_count = models.PositiveSmallIntegerField(default=0)
+
+    objects = ProductManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            # 以下兩個 GIN 索引只在 PostgreSQL 建立，見 0012 migration
+            GinIndex(
+                SearchVector('name', 'description', config=PRODUCT_SEARCH_CONFIG),
+                name='product_search_gin',
+            ),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_gin'),
+        ]
+
     def __str__(self):
         return self.name
 
     def adjust_stock(self, quantity):
-        self.quantity_in_stock = max(0, self.quantity_in_stock - quantity)
-        self.save()
+        if self.shard_count:
+            with transaction.atomic():
+                StockShard.objects.take(self.pk, quantity, partial=True)
+                self._store_shard_total()
+            return
+        Product.objects.filter(pk=self.pk).update(
+            quantity_in_stock=Greatest(F('quantity_in_stock') - quantity, 0)
+        )
+        invalidate_products([self.pk])
+        self.refresh_from_db(fields=['quantity_in_stock'])
 
     def restock(self, quantity):
         if quantity > 0:
-            self.quantity_in_stock += quantity
-            self.save()
+            with transaction.atomic():
+                if self.shard_count:
+                    StockShard.objects.add(self.pk, quantity, self.shard_count)
+                    self._store_shard_total()
+                else:
+                    Product.objects.filter(pk=self.pk).update(
+                        quantity_in_stock=F('quantity_in_stock') + quantity
+                    )
+                    invalidate_products([self.pk])
+                StockMovement.objects.create(
+                    product=self, quantity=quantity, reason=StockMovement.RESTOCK
+                )
+            self.refresh_from_db(fields=['quantity_in_stock'])
+
+    def enable_sharding(self, shard_count):
+        """
+        Split this product's stock evenly across ``shard_count`` StockShard
+        rows, so concurrent orders lock different rows.
+        """
+        if shard_count < 1:
+            raise ValueError("shard_count must be positive")
+        with transaction.atomic():
+            self.disable_sharding()
+            self.shard_count = shard_count
+            StockShard.objects.bulk_create([
+                StockShard(product=self, shard=shard, quantity=quantity)
+                for shard, quantity in enumerate(_split(self.quantity_in_stock, shard_count))
+            ])
+            self.save(update_fields=['shard_count'])
+
+    def disable_sharding(self):
+        """
+        Fold the shards back into ``quantity_in_stock`` and delete them.
+        """
+        with transaction.atomic():
+            product = Product.objects.select_for_update().get(pk=self.pk)
+            if product.shard_count:
+                self.quantity_in_stock = StockShard.objects.lock(self.pk).aggregate(
+                    total=Coalesce(Sum('quantity'), 0)
+                )['total']
+                StockShard.objects.filter(product_id=self.pk).delete()
+            else:
+                self.quantity_in_stock = product.quantity_in_stock
+            self.shard_count = 0
+            self.save(update_fields=['quantity_in_stock', 'shard_count'])
+
+    def _store_shard_total(self):
+        self.quantity_in_stock = StockShard.objects.filter(product_id=self.pk).aggregate(
+            total=Coalesce(Sum('quantity'), 0)
+        )['total']
+        Product.objects.filter(pk=self.pk).update(quantity_in_stock=self.quantity_in_stock)
+        invalidate_products([self.pk])
+
+
+def _split(quantity, parts):
+    base, extra = divmod(quantity, parts)
+    return [base + 1 if part < extra else base for part in range(parts)]
+
+
+class StockShardManager(models.Manager):
+    def lock(self, product_id):
+        return self.select_for_update().filter(product_id=product_id).order_by('shard')
+
+    def reserve(self, product_id, quantity, shard_count):
+        """
+        Take ``quantity`` from one shard, starting at a random one and
+        trying the others in turn. When no single shard can cover it, the
+        quantity is taken across shards under lock. Returns False and
+        changes nothing if the shards together hold too little.
+        """
+        start = random.randrange(shard_count)
+        for offset in range(shard_count):
+            if self.filter(
+                product_id=product_id, shard=(start + offset) % shard_count, quantity__gte=quantity
+            ).update(quantity=F('quantity') - quantity):
+                return True
+        return self.take(product_id, quantity) == quantity
+
+    def take(self, product_id, quantity, partial=False):
+        """
+        Take up to ``quantity`` across all shards of a product, largest
+        shards first, and return the amount taken. Unless ``partial``,
+        nothing is taken when the shards hold less than ``quantity``.
+        """
+        with transaction.atomic():
+            shards = list(self.lock(product_id))
+            if not partial and sum(shard.quantity for shard in shards) < quantity:
+                return 0
+            remaining = quantity
+            for shard in sorted(shards, key=lambda shard: -shard.quantity):
+                taken = min(shard.quantity, remaining)
+                shard.quantity -= taken
+                remaining -= taken
+            self.bulk_update(shards, ['quantity'])
+            return quantity - remaining
+
+    def add(self, product_id, quantity, shard_count):
+        base, extra = divmod(quantity, shard_count)
+        self.filter(product_id=product_id).update(quantity=F('quantity') + Case(
+            When(shard__lt=extra, then=Value(base + 1)),
+            default=Value(base),
+            output_field=models.PositiveIntegerField(),
+        ))
+
+    def consolidate(self, product_ids=None):
+        """
+        Even out the shards of each sharded product and store their sum in
+        ``Product.quantity_in_stock``. Returns the number of products
+        consolidated.
+        """
+        products = Product.objects.filter(shard_count__gt=0)
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+        consolidated = 0
+        for product_id in products.values_list('id', flat=True):
+            with transaction.atomic():
+                shards = list(self.lock(product_id))
+                total = sum(shard.quantity for shard in shards)
+                for shard, quantity in zip(shards, _split(total, len(shards))):
+                    shard.quantity = quantity
+                self.bulk_update(shards, ['quantity'])
+                Product.objects.filter(pk=product_id).update(quantity_in_stock=total)
+                invalidate_products([product_id])
+            consolidated += 1
+        return consolidated
 
 
 class Order(models.Model):
     order_number = models.CharField(max_length=100, unique=True)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, unique=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # 建構時即有值，品項可直接沿用；補匯歷史訂單時可帶入原始時間
+    created_at = models.DateTimeField(default=timezone.now)
 
     products = models.ManyToManyField(Product, through='OrderProduct')
     promo_code = models.ForeignKey('PromotionCode', null=True, blank=True, on_delete=models.SET_NULL)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_at_id_idx'),
+        ]
+
     def __str__(self):
         return self.order_number
 
     def update_stock(self):
-        for order_product in self.orderproduct_set.all():
-            order_product.product.adjust_stock(order_product.quantity)
+        quantities = {}
+        for product_id, quantity in self.orderproduct_set.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        Product.objects.reserve_stock(quantities)
 
-    def calculate_total(self):
-        subtotal = sum([
-            item.product.price * item.quantity
-            for item in self.orderproduct_set.all()
-        ])
+    def calculate_total(self, save=True):
+        lines = list(self.orderproduct_set.values_list('product_id', 'quantity'))
+        prices = {
+            product_id: snapshot.price
+            for product_id, snapshot in get_products(product_id for product_id, _ in lines).items()
+        }
 
+        rules = []
         if self.promo_code and self.promo_code.is_valid(self.promo_code.code):
-            applicable_products = self.promo_code.products.all()
-            if all(p in applicable_products for p in self.products.all()):
-                subtotal = self.promo_code.apply_discount(subtotal)
+            rules.append(self.promo_code.pricing_rule(
+                self.promo_code.products.filter(id__in=prices).values_list('id', flat=True)
+            ))
 
-        self.total_price = subtotal
-        self.save()
-        return subtotal
+        self.total_price = price_order(lines, prices, rules).total
+        if save:
+            self.save(update_fields=['total_price'])
+        return self.total_price
 
 
 class OrderProduct(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # 下單當時的單價與折扣後小計，報表不需再回頭關聯 Product 的現價
+    unit_price = models.DecimalField(max_digits=10, decimal_places=0, default=0)
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # 訂單的 created_at，分區版面中作為分區鍵，讓品項與訂單落在同一個月份
+    created_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
     
 
 
+class ArchivedOrder(models.Model):
+    """
+    Compact copy of an order moved out by ``manage.py archive_orders``:
+    one row per order, keeping the original id, with its line items packed
+    as ``[product_id, quantity, unit_price, line_total]`` lists. Orders
+    exported to a file keep a row here too, with no items and the file in
+    ``archive_file``, so their order number and idempotency key stay used.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    order_number = models.CharField(max_length=100, db_index=True)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    promo_code = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+    items = models.JSONField(encoder=DjangoJSONEncoder)
+    archive_file = models.CharField(max_length=255, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.order_number
+
+
+class PromotionCodeManager(models.Manager):
+    def filter_codes(self, codes):
+        """
+        Case-insensitive lookup of many codes, matched against LOWER(code)
+        so it is served by the ``promotioncode_code_lower_uniq`` index.
+        """
+        return self.alias(code_lower=Lower('code')).filter(
+            code_lower__in={code.lower() for code in codes}
+        )
+
+
 class PromotionCode(models.Model):
     DISCOUNT_CHOICES = [
         ('percent', 'Percent'),
         ('fixed', 'Fixed'),
     ]
+    APPLIES_TO_CHOICES = [
+        (APPLIES_TO_ORDER, 'Whole order, when every product is eligible'),
+        (APPLIES_TO_ITEMS, 'Eligible items only'),
+    ]
 
     name = models.CharField(max_length=100)
-    code = models.CharField(max_length=100, unique=True)
+    code = models.CharField(max_length=100)
     discount_type = models.CharField(max_length=20, choices=DISCOUNT_CHOICES)
     value = models.DecimalField(max_digits=10, decimal_places=2)
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
     products = models.ManyToManyField('Product', related_name='promotions')
+    applies_to = models.CharField(max_length=10, choices=APPLIES_TO_CHOICES, default=APPLIES_TO_ORDER)
+    stackable = models.BooleanField(default=False)
+    # [{"min_subtotal": "1000", "value": "5"}, ...]，達到門檻時以該級的 value 取代 value
+    tiers = models.JSONField(default=list, blank=True)
+
+    objects = PromotionCodeManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(Lower('code'), name='promotioncode_code_lower_uniq'),
+        ]
+
+    def clean(self):
+        try:
+            parse_tiers(self.tiers)
+        except ValueError as exc:
+            raise ValidationError({'tiers': str(exc)})
 
     def is_active(self):
         now = timezone.now()
         return self.start_date <= now <= self.end_date
 
-    def is_valid(self, input_code):
-        now = timezone.now()
+    def is_valid(self, input_code, at=None):
+        now = at or timezone.now()
         return (
             self.start_date <= now <= self.end_date and
             self.code.lower() == input_code.lower()
@@ -92,5 +439,155 @@ class PromotionCode(models.Model):
             return max(0, price - self.value)
         return price
 
+    def pricing_rule(self, product_ids=None):
+        """
+        Return the ``pricing.Rule`` for this code. ``product_ids`` defaults
+        to the ``product_ids`` carried by promo cache snapshots.
+        """
+        if product_ids is None:
+            product_ids = self.product_ids
+        return Rule(
+            code=self.code,
+            discount_type=self.discount_type,
+            value=self.value,
+            product_ids=frozenset(product_ids),
+            applies_to=self.applies_to,
+            tiers=parse_tiers(self.tiers),
+            stackable=self.stackable,
+            start_date=self.start_date,
+            end_date=self.end_date,
+        )
+
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of stock changes. Rows are only ever inserted, so
+    writing history never contends with the product row locks.
+    """
+    RESTOCK = 'restock'
+    REASON_CHOICES = [
+        (RESTOCK, 'Restock'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    quantity = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.product_id} {self.quantity:+d} ({self.reason})"
+
+
+class StockShard(models.Model):
+    """
+    One of ``Product.shard_count`` stock counters for a hot product.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    objects = StockShardManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='stockshard_product_shard_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}#{self.shard}: {self.quantity}"
+
+
+class ProductSalesRollup(models.Model):
+    """
+    Units and revenue per product per hour, maintained incrementally by
+    ``api.rollups`` and rebuilt with ``manage.py rebuild_rollups``.
+    """
+    hour = models.DateTimeField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'product'], name='productsalesrollup_hour_product_uniq'),
+        ]
+
+
+class PromoSalesRollup(models.Model):
+    """
+    Orders and revenue per promotion code per hour.
+    """
+    hour = models.DateTimeField()
+    promo_code = models.ForeignKey(PromotionCode, on_delete=models.CASCADE)
+    order_count = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'promo_code'], name='promosalesrollup_hour_promo_uniq'),
+        ]
+
+
+class ApiToken(models.Model):
+    """
+    Access token for the token-authenticated endpoints. Only the SHA-256
+    digest of the key is stored.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, name):
+        key = secrets.token_urlsafe(32)
+        cls.objects.create(name=name, key_hash=cls.hash_key(key))
+        return key
+
+    def revoke(self):
+        self.revoked_at = timezone.now()
+        self.save(update_fields=['revoked_at'])
+
+    def __str__(self):
+        return self.name
+
+
+class OrderImportJob(models.Model):
+    """
+    Queued ``import_order`` payload, claimed and processed in batches by
+    ``manage.py run_order_workers``.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    payload = models.JSONField()
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='orderimportjob_status_id_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.name} ({self.code})"
\ No newline at end of file
+        return f"Job {self.id} ({self.status})"
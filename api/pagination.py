@@ -0,0 +1,77 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder 會把時間截到毫秒，游標需要完整精度
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise InvalidCursor("Invalid cursor")
+    # 游標固定為 [排序值, 流水號] 兩個純量，其他形狀一律視為無效
+    if not isinstance(values, list) or len(values) != 2 or not all(
+        isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values
+    ):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def _value(item, field):
+    return item[field] if isinstance(item, dict) else getattr(item, field)
+
+
+def keyset_page(queryset, fields, cursor=None, page_size=50, descending=True):
+    """
+    Return ``(items, next_cursor)`` for one page of ``queryset`` ordered by
+    the ``(field, tiebreaker)`` pair in ``fields``. Pages continue from the
+    last row of the previous page instead of using OFFSET, so deep pages
+    cost the same as the first one given an index on both fields.
+    """
+    field, tiebreaker = fields
+    if cursor:
+        try:
+            value, last = decode_cursor(cursor)
+            model_fields = queryset.model._meta
+            value = model_fields.get_field(field).to_python(value)
+            last = model_fields.get_field(tiebreaker).to_python(last)
+        except (TypeError, ValueError, ValidationError):
+            raise InvalidCursor("Invalid cursor")
+        # 以單欄範圍條件走索引，再排除同值中已回傳過的資料列
+        if descending:
+            queryset = queryset.filter(**{f'{field}__lte': value}).exclude(
+                **{field: value, f'{tiebreaker}__gte': last}
+            )
+        else:
+            queryset = queryset.filter(**{f'{field}__gte': value}).exclude(
+                **{field: value, f'{tiebreaker}__lte': last}
+            )
+
+    prefix = '-' if descending else ''
+    items = list(queryset.order_by(f'{prefix}{field}', f'{prefix}{tiebreaker}')[:page_size + 1])
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor([_value(items[-1], field), _value(items[-1], tiebreaker)])
+    return items, next_cursor
@@ -0,0 +1,265 @@
+import re
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+
+from .models import Order, OrderProduct
+
+# 選用的 PostgreSQL 月分區版面：api_order 與 api_orderproduct 依 created_at
+# (UTC 月份) 分區。分區表無法對 order_number 建立全域唯一索引，改由
+# api_order_number 與 api_order_idempotency_key 兩張登記表以主鍵保證唯一，
+# 由觸發器在寫入訂單時同步登記。封存後登記仍保留，單號永不重複使用。
+
+PARTITIONED_MODELS = (Order, OrderProduct)
+ORDER_NUMBER_TABLE = 'api_order_number'
+IDEMPOTENCY_KEY_TABLE = 'api_order_idempotency_key'
+
+_PARTITION_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+_REGISTER_KEYS = f"""
+CREATE FUNCTION api_order_register_keys() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.order_number IS DISTINCT FROM OLD.order_number THEN
+        INSERT INTO {ORDER_NUMBER_TABLE} (order_number, order_id) VALUES (NEW.order_number, NEW.id);
+    END IF;
+    IF NEW.idempotency_key IS NOT NULL
+            AND (TG_OP = 'INSERT' OR NEW.idempotency_key IS DISTINCT FROM OLD.idempotency_key) THEN
+        INSERT INTO {IDEMPOTENCY_KEY_TABLE} (idempotency_key, order_id) VALUES (NEW.idempotency_key, NEW.id);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+class PartitioningError(Exception):
+    pass
+
+
+_enabled = None
+
+
+def is_partitioned():
+    """
+    Return whether ``api_order`` uses the partitioned layout. Looked up
+    once per process; restart workers after ``partition_orders enable``.
+    """
+    global _enabled
+    if _enabled is None:
+        _enabled = connection.vendor == 'postgresql' and _is_partitioned_table(Order._meta.db_table)
+    return _enabled
+
+
+def _is_partitioned_table(table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+            [table],
+        )
+        return cursor.fetchone()[0]
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(moment):
+    if moment.month == 12:
+        return datetime(moment.year + 1, 1, 1, tzinfo=timezone.utc)
+    return datetime(moment.year, moment.month + 1, 1, tzinfo=timezone.utc)
+
+
+def existing_keys(order_numbers, idempotency_keys):
+    """
+    Return ``(order_numbers, idempotency_keys)`` already registered,
+    including those of archived orders, with one primary-key query.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT 'n', order_number FROM {ORDER_NUMBER_TABLE} WHERE order_number = ANY(%s) "
+            f"UNION ALL SELECT 'i', idempotency_key FROM {IDEMPOTENCY_KEY_TABLE} WHERE idempotency_key = ANY(%s)",
+            [list(order_numbers), list(idempotency_keys)],
+        )
+        rows = cursor.fetchall()
+    return {key for kind, key in rows if kind == 'n'}, {key for kind, key in rows if kind == 'i'}
+
+
+def enable(months_ahead=3):
+    """
+    Convert ``api_order`` and ``api_orderproduct`` into tables partitioned
+    by month on ``created_at``. The existing tables are attached unchanged
+    as the partition for everything before the current month, so no rows
+    are copied; a default partition catches rows outside the monthly
+    ranges. Takes an exclusive lock on both tables while it runs.
+    """
+    if connection.vendor != 'postgresql':
+        raise PartitioningError("Partitioning needs PostgreSQL")
+    if _is_partitioned_table(Order._meta.db_table):
+        raise PartitioningError("Orders are already partitioned")
+
+    boundary = month_start(datetime.now(timezone.utc))
+    qn = connection.ops.quote_name
+    tables = [model._meta.db_table for model in PARTITIONED_MODELS]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {', '.join(map(qn, tables))} IN ACCESS EXCLUSIVE MODE")
+        # 參照分區表的外鍵需要只含 id 的唯一索引，分區表無法提供
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = to_regclass(%s)",
+            [Order._meta.db_table],
+        )
+        for table, constraint in cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {qn(constraint)}")
+
+        for table in tables:
+            _partition_table(cursor, table, boundary)
+
+        cursor.execute(
+            f"CREATE TABLE {ORDER_NUMBER_TABLE} (order_number varchar(100) PRIMARY KEY, order_id bigint NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE TABLE {IDEMPOTENCY_KEY_TABLE} "
+            f"(idempotency_key varchar(255) PRIMARY KEY, order_id bigint NOT NULL)"
+        )
+        legacy = qn(f"{Order._meta.db_table}_legacy")
+        cursor.execute(f"INSERT INTO {ORDER_NUMBER_TABLE} SELECT order_number, id FROM {legacy}")
+        cursor.execute(
+            f"INSERT INTO {IDEMPOTENCY_KEY_TABLE} SELECT idempotency_key, id FROM {legacy} "
+            f"WHERE idempotency_key IS NOT NULL"
+        )
+        cursor.execute(_REGISTER_KEYS)
+        cursor.execute(
+            f"CREATE TRIGGER api_order_register_keys AFTER INSERT OR UPDATE ON {qn(Order._meta.db_table)} "
+            f"FOR EACH ROW EXECUTE FUNCTION api_order_register_keys()"
+        )
+    create_partitions(months_ahead)
+    global _enabled
+    _enabled = True
+
+
+def _partition_table(cursor, table, boundary):
+    qn = connection.ops.quote_name
+    legacy = f"{table}_legacy"
+    sequence = f"{table}_id_part_seq"
+
+    cursor.execute(f"CREATE SEQUENCE {qn(sequence)}")
+    cursor.execute(
+        f"SELECT setval(%s, COALESCE((SELECT max(id) FROM {qn(table)}), 0) + 1, false)", [sequence]
+    )
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE contype = 'f' AND conrelid = to_regclass(%s)",
+        [table],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        "SELECT i.relname, pg_get_indexdef(x.indexrelid) FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid "
+        "WHERE x.indrelid = to_regclass(%s) AND NOT x.indisunique",
+        [table],
+    )
+    indexes = cursor.fetchall()
+
+    cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}")
+    # 分區不能有 identity 欄位；id 改由父表的序列產生
+    cursor.execute(f"ALTER TABLE {qn(legacy)} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    cursor.execute(f"ALTER TABLE {qn(legacy)} ALTER COLUMN id DROP DEFAULT")
+    cursor.execute(
+        f"CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        f"PARTITION BY RANGE (created_at)"
+    )
+    cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval(%s)", [sequence])
+    cursor.execute(f"ALTER SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id")
+    cursor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, created_at)")
+    cursor.execute(
+        f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(legacy)} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+    )
+
+    # 原有的一般索引改名留在舊分區，父表以原名建立同樣的索引再掛上，
+    # 之後新建的月分區會自動帶有這些索引
+    for name, definition in indexes:
+        legacy_name = f"{legacy}_{name}"[:63]
+        cursor.execute(f"ALTER INDEX {qn(name)} RENAME TO {qn(legacy_name)}")
+        cursor.execute(
+            f"CREATE INDEX {qn(name)} ON ONLY {qn(table)} USING {definition.split(' USING ', 1)[1]}"
+        )
+        cursor.execute(f"ALTER INDEX {qn(name)} ATTACH PARTITION {qn(legacy_name)}")
+    # 唯一索引無法建在分區表上，查詢用的單號索引改為一般索引
+    for column in ('order_number', 'idempotency_key'):
+        if any(field.column == column for field in _model(table)._meta.fields):
+            cursor.execute(f"CREATE INDEX {qn(f'{table}_{column}_idx')} ON {qn(table)} ({qn(column)})")
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}")
+
+    cursor.execute(f"CREATE TABLE {qn(f'{table}_default')} PARTITION OF {qn(table)} DEFAULT")
+
+
+def _model(table):
+    return next(model for model in PARTITIONED_MODELS if model._meta.db_table == table)
+
+
+def create_partitions(months_ahead=3):
+    """
+    Create the monthly partitions from the current month through
+    ``months_ahead`` months ahead, skipping those that exist. Run it
+    regularly (e.g. daily from cron) so inserts never reach the default
+    partition. Returns the names of the partitions created.
+    """
+    if not is_partitioned():
+        raise PartitioningError("Orders are not partitioned; run partition_orders enable first")
+    qn = connection.ops.quote_name
+    created = []
+    start = month_start(datetime.now(timezone.utc))
+    with connection.cursor() as cursor:
+        for _ in range(months_ahead + 1):
+            end = next_month(start)
+            for model in PARTITIONED_MODELS:
+                table = model._meta.db_table
+                name = f"{table}_p{start:%Y%m}"
+                cursor.execute("SELECT to_regclass(%s) IS NULL", [name])
+                if cursor.fetchone()[0]:
+                    cursor.execute(
+                        f"CREATE TABLE {qn(name)} PARTITION OF {qn(table)} "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    )
+                    created.append(name)
+            start = end
+    return created
+
+
+def partitions(model):
+    """
+    Return ``[(name, upper_bound)]`` for the range partitions of
+    ``model``'s table, oldest first. The default partition is left out.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+            [model._meta.db_table],
+        )
+        rows = cursor.fetchall()
+    bounds = []
+    for name, bound in rows:
+        match = _PARTITION_BOUND.search(bound)
+        if match:
+            bounds.append((name, datetime.fromisoformat(match.group(1))))
+    return sorted(bounds, key=lambda row: row[1])
+
+
+def drop_partitions_before(before):
+    """
+    Detach and drop every order and order item partition whose range
+    ends on or before ``before``. Returns the names dropped.
+    """
+    qn = connection.ops.quote_name
+    dropped = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in PARTITIONED_MODELS:
+            for name, upper in partitions(model):
+                if upper <= before:
+                    cursor.execute(f"ALTER TABLE {qn(model._meta.db_table)} DETACH PARTITION {qn(name)}")
+                    cursor.execute(f"DROP TABLE {qn(name)}")
+                    dropped.append(name)
+    return dropped
@@ -0,0 +1,149 @@
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0')
+ONE = Decimal('1')
+
+APPLIES_TO_ORDER = 'order'
+APPLIES_TO_ITEMS = 'items'
+
+Rule = namedtuple(
+    'Rule',
+    ['code', 'discount_type', 'value', 'product_ids', 'applies_to', 'tiers', 'stackable',
+     'start_date', 'end_date'],
+)
+PricedOrder = namedtuple('PricedOrder', ['subtotal', 'total', 'line_totals', 'applied_codes'])
+
+
+def parse_tiers(tiers):
+    """
+    Return ``[{"min_subtotal": ..., "value": ...}]`` tier JSON as a sorted
+    tuple of ``(min_subtotal, value)`` Decimals. Raises ValueError when
+    the JSON is not a list of such objects with non-negative numbers.
+    """
+    if not isinstance(tiers, list):
+        raise ValueError("Tiers must be a list")
+    parsed = []
+    for tier in tiers:
+        if not isinstance(tier, dict) or set(tier) != {'min_subtotal', 'value'}:
+            raise ValueError('Each tier needs exactly "min_subtotal" and "value"')
+        try:
+            numbers = tuple(Decimal(str(tier[key])) for key in ('min_subtotal', 'value'))
+        except InvalidOperation:
+            numbers = None
+        if (
+            numbers is None or any(isinstance(tier[key], bool) for key in tier)
+            or not all(number.is_finite() and number >= 0 for number in numbers)
+        ):
+            raise ValueError(f"Invalid tier: {tier}")
+        parsed.append(numbers)
+    return tuple(sorted(parsed))
+
+
+def price_order(lines, prices, rules=(), now=None):
+    """
+    Price ``(product_id, quantity)`` lines from a ``{product_id: price}``
+    mapping against every promotion ``Rule`` in ``rules``.
+
+    Lines are folded into per-product subtotals once, so each rule only
+    touches the products it shares with the order. Every discount is kept
+    as a per-product scale factor and nothing is rounded until the end,
+    where the total and the per-line totals are quantized to cents (the
+    last line takes the rounding remainder).
+
+    The best single non-stackable rule competes with all stackable rules
+    applied in order; whichever gives the larger discount is used.
+    """
+    now = now or timezone.now()
+    amounts = [prices[product_id] * quantity for product_id, quantity in lines]
+    subtotals = {}
+    for (product_id, _), amount in zip(lines, amounts):
+        subtotals[product_id] = subtotals.get(product_id, ZERO) + amount
+    subtotal = sum(amounts, ZERO)
+
+    exclusive = (ZERO, None)
+    stacked = []
+    for rule in rules:
+        if not rule.start_date <= now <= rule.end_date:
+            continue
+        eligible = _eligible_products(rule, subtotals)
+        if not eligible:
+            continue
+        base = sum((subtotals[product_id] for product_id in eligible), ZERO)
+        value = _rule_value(rule, base)
+        if value is None:
+            continue
+        if rule.stackable:
+            stacked.append((rule, eligible, value))
+        else:
+            discount = base - base * _factor(rule.discount_type, value, base)
+            if discount > exclusive[0]:
+                exclusive = (discount, (rule, eligible, value))
+
+    factors = {}
+    applied = []
+    stacked_amounts = dict(subtotals)
+    for rule, eligible, value in stacked:
+        current = sum((stacked_amounts[product_id] for product_id in eligible), ZERO)
+        factor = _factor(rule.discount_type, value, current)
+        for product_id in eligible:
+            stacked_amounts[product_id] *= factor
+            factors[product_id] = factors.get(product_id, ONE) * factor
+        applied.append(rule.code)
+
+    if exclusive[1] and exclusive[0] >= subtotal - sum(stacked_amounts.values(), ZERO):
+        rule, eligible, value = exclusive[1]
+        factor = _factor(rule.discount_type, value, sum((subtotals[p] for p in eligible), ZERO))
+        factors = dict.fromkeys(eligible, factor)
+        applied = [rule.code]
+
+    line_totals = [
+        amount * factors.get(product_id, ONE)
+        for (product_id, _), amount in zip(lines, amounts)
+    ]
+    total = sum(line_totals, ZERO).quantize(CENT)
+    return PricedOrder(subtotal, total, _round_lines(line_totals, total), applied)
+
+
+def _eligible_products(rule, subtotals):
+    if rule.applies_to == APPLIES_TO_ORDER:
+        # 整筆訂單的商品都在活動範圍內才適用
+        if len(subtotals) > len(rule.product_ids):
+            return None
+        if all(product_id in rule.product_ids for product_id in subtotals):
+            return list(subtotals)
+        return None
+    if len(rule.product_ids) < len(subtotals):
+        return [product_id for product_id in rule.product_ids if product_id in subtotals]
+    return [product_id for product_id in subtotals if product_id in rule.product_ids]
+
+
+def _rule_value(rule, base):
+    if not rule.tiers:
+        return rule.value
+    value = None
+    for min_subtotal, tier_value in rule.tiers:
+        if base >= min_subtotal:
+            value = tier_value
+    return value
+
+
+def _factor(discount_type, value, base):
+    if discount_type == 'percent':
+        return max(ZERO, ONE - value / 100)
+    if discount_type == 'fixed':
+        if not base:
+            return ONE
+        return (base - min(value, base)) / base
+    return ONE
+
+
+def _round_lines(line_totals, total):
+    if not line_totals:
+        return []
+    rounded = [line_total.quantize(CENT) for line_total in line_totals[:-1]]
+    rounded.append((total - sum(rounded, ZERO)).quantize(CENT))
+    return rounded
@@ -0,0 +1,216 @@
+import atexit
+import logging
+import threading
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderProduct, ProductSalesRollup, PromoSalesRollup
+
+# 匯入成功後先把增量累積在記憶體，由計時器批次寫入彙總表，
+# 避免每筆訂單都去更新同一批熱門的彙總資料列。
+# 行程異常結束時尚未寫入的增量會遺失，可用 rebuild_rollups 重算。
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_product_deltas = {}
+_promo_deltas = {}
+_timer = None
+
+
+def _hour(value):
+    # 先換成 UTC 再截斷，與 rebuild 的 TruncHour 一致；+05:30 等時區才不會產生 :30 的時段
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def record_orders(orders):
+    """
+    Buffer rollup deltas for ``(order, line_items)`` pairs that were just
+    committed. The buffer is flushed every ROLLUP_FLUSH_INTERVAL seconds,
+    or immediately once it holds ROLLUP_FLUSH_MAX_KEYS keys.
+    """
+    with _lock:
+        for order, items in orders:
+            hour = _hour(order.created_at)
+            for item in items:
+                quantity, revenue = _product_deltas.get((hour, item.product_id), (0, 0))
+                _product_deltas[(hour, item.product_id)] = (
+                    quantity + item.quantity, revenue + item.line_total
+                )
+            if order.promo_code_id:
+                count, revenue = _promo_deltas.get((hour, order.promo_code_id), (0, 0))
+                _promo_deltas[(hour, order.promo_code_id)] = (count + 1, revenue + order.total_price)
+
+        pending = len(_product_deltas) + len(_promo_deltas)
+        flush_now = pending >= getattr(settings, 'ROLLUP_FLUSH_MAX_KEYS', 5000)
+        if not flush_now:
+            _schedule()
+
+    if flush_now:
+        flush()
+
+
+def _schedule():
+    # 呼叫端需持有 _lock
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(flush_interval(), _flush_on_timer)
+        _timer.daemon = True
+        _timer.start()
+
+
+def flush_interval():
+    return getattr(settings, 'ROLLUP_FLUSH_INTERVAL', 5)
+
+
+def _flush_on_timer():
+    global _timer
+    with _lock:
+        _timer = None
+    try:
+        flush()
+    except Exception:
+        # 增量已放回緩衝，由下一次計時器重試
+        logger.exception("Rollup flush failed; deltas re-queued")
+    finally:
+        # 計時器執行緒有自己的資料庫連線，用完即關閉
+        connection.close()
+
+
+def flush():
+    """
+    Add every buffered delta to the rollup tables with one upsert per
+    table, incrementing existing rows in place. If the upsert fails the
+    deltas are put back into the buffer, a retry is scheduled and the
+    error is raised.
+    """
+    global _product_deltas, _promo_deltas
+    with _lock:
+        product_deltas, _product_deltas = _product_deltas, {}
+        promo_deltas, _promo_deltas = _promo_deltas, {}
+    if not product_deltas and not promo_deltas:
+        return
+
+    try:
+        with transaction.atomic():
+            _upsert(ProductSalesRollup, 'product_id', ('quantity', 'revenue'), product_deltas)
+            _upsert(PromoSalesRollup, 'promo_code_id', ('order_count', 'revenue'), promo_deltas)
+    except Exception:
+        _requeue(product_deltas, promo_deltas)
+        raise
+
+
+def _requeue(product_deltas, promo_deltas):
+    with _lock:
+        for buffer, deltas in ((_product_deltas, product_deltas), (_promo_deltas, promo_deltas)):
+            for key, (first, second) in deltas.items():
+                current = buffer.get(key, (0, 0))
+                buffer[key] = (current[0] + first, current[1] + second)
+        _schedule()
+
+
+def _upsert(model, key_column, value_columns, deltas, batch_size=1000):
+    if not deltas:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ('hour', key_column) + value_columns
+    increments = ', '.join(
+        f"{column} = {table}.{column} + excluded.{column}" for column in value_columns
+    )
+    rows = [(hour, key, *values) for (hour, key), values in sorted(deltas.items())]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(batch))
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders} "
+                f"ON CONFLICT (hour, {key_column}) DO UPDATE SET {increments}",
+                [
+                    connection.ops.adapt_datetimefield_value(value) if index == 0 else value
+                    for row in batch
+                    for index, value in enumerate(row)
+                ],
+            )
+
+
+def settled_until():
+    """
+    Return the latest hour boundary before which every process has had
+    ROLLUP_FLUSH_INTERVAL seconds to flush its buffered deltas. Hours
+    after it may still receive increments from running processes, so
+    rebuilding them would count those orders twice.
+    """
+    return _hour(timezone.now() - timedelta(seconds=flush_interval()))
+
+
+def archived_until():
+    """
+    Return the hour boundary after the newest archived order, or None when
+    nothing is archived. Archived orders are no longer in the order tables,
+    so rebuilding hours before it would wipe their sales from the rollups.
+    """
+    latest = ArchivedOrder.objects.aggregate(latest=Max('created_at'))['latest']
+    if latest is None:
+        return None
+    return _hour(latest) + timedelta(hours=1)
+
+
+def rebuild(start, end):
+    """
+    Recompute both rollup tables for orders created in ``[start, end)``.
+    ``start`` and ``end`` should fall on hour boundaries, ``start`` should
+    not be before ``archived_until()`` and ``end`` should not be after
+    ``settled_until()``.
+    """
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end)
+    product_rows = (
+        OrderProduct.objects
+        .filter(order__created_at__gte=start, order__created_at__lt=end)
+        .annotate(hour=TruncHour('order__created_at'))
+        .values('hour', 'product_id')
+        .annotate(total_quantity=Sum('quantity'), total_revenue=Sum('line_total'))
+        .order_by()
+    )
+    promo_rows = (
+        orders.filter(promo_code__isnull=False)
+        .annotate(hour=TruncHour('created_at'))
+        .values('hour', 'promo_code_id')
+        .annotate(total_orders=Count('id'), total_revenue=Sum('total_price'))
+        .order_by()
+    )
+
+    with transaction.atomic():
+        ProductSalesRollup.objects.filter(hour__gte=start, hour__lt=end).delete()
+        PromoSalesRollup.objects.filter(hour__gte=start, hour__lt=end).delete()
+        ProductSalesRollup.objects.bulk_create(
+            [
+                ProductSalesRollup(
+                    hour=row['hour'],
+                    product_id=row['product_id'],
+                    quantity=row['total_quantity'],
+                    revenue=row['total_revenue'],
+                )
+                for row in product_rows.iterator()
+            ],
+            batch_size=1000,
+        )
+        PromoSalesRollup.objects.bulk_create(
+            [
+                PromoSalesRollup(
+                    hour=row['hour'],
+                    promo_code_id=row['promo_code_id'],
+                    order_count=row['total_orders'],
+                    revenue=row['total_revenue'],
+                )
+                for row in promo_rows.iterator()
+            ],
+            batch_size=1000,
+        )
+
+
+atexit.register(flush)
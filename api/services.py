@@ -0,0 +1,526 @@
+import re
+from array import array
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import partitions, rollups
+from .caches import get_products, get_promotions
+from .metrics import phase
+from .models import (
+    PRODUCT_SEARCH_CONFIG, ArchivedOrder, InsufficientStock, Order, OrderProduct, Product, StockMovement,
+)
+from .pricing import price_order
+
+
+class OrderImportError(Exception):
+    pass
+
+
+class RestockError(Exception):
+    pass
+
+
+ParsedOrder = namedtuple(
+    'ParsedOrder', ['order_number', 'promo_code', 'lines', 'idempotency_key', 'created_at'],
+    defaults=[None],
+)
+
+ImportedOrder = namedtuple(
+    'ImportedOrder', ['order_number', 'idempotency_key', 'total_price']
+)
+
+
+# 與 BigAutoField 及 PositiveIntegerField 在各資料庫的上限一致
+MAX_PRODUCT_ID = 2 ** 63 - 1
+MAX_LINE_QUANTITY = 2 ** 31 - 1
+# 並行匯入搶到相同單號時，整批重跑的次數上限
+IMPORT_CONFLICT_ATTEMPTS = 3
+ORDER_NUMBER_MAX_LENGTH = Order._meta.get_field('order_number').max_length
+IDEMPOTENCY_KEY_MAX_LENGTH = Order._meta.get_field('idempotency_key').max_length
+
+
+class Cart:
+    """
+    Validated line items of one order, with repeated products merged into
+    one line. Product ids and quantities are kept in two parallel
+    ``array('q')`` columns; iterating yields ``(product_id, quantity)``
+    tuples in the order products first appeared.
+    """
+    __slots__ = ('product_ids', 'quantities')
+
+    def __init__(self, product_ids=(), quantities=()):
+        self.product_ids = array('q', product_ids)
+        self.quantities = array('q', quantities)
+
+    @classmethod
+    def parse(cls, products_data):
+        """
+        Build a Cart from ``[{"product_id": ..., "quantity": ...}]`` in one
+        pass. Raises OrderImportError on the first malformed line, before
+        anything is looked up or written.
+        """
+        if not isinstance(products_data, list):
+            raise OrderImportError("Invalid products")
+        merged = {}
+        merged_get = merged.get
+        for item in products_data:
+            if type(item) is not dict:
+                raise OrderImportError("Invalid line item")
+            product_id = item.get('product_id')
+            quantity = item.get('quantity', 1)
+            if type(product_id) is not int:
+                product_id = _product_id(product_id)
+            if product_id < 1 or product_id > MAX_PRODUCT_ID:
+                raise OrderImportError(f"Invalid product_id {item.get('product_id')}")
+            if type(quantity) is not int:
+                quantity = _line_quantity(quantity)
+            if quantity < 1:
+                raise OrderImportError(f"Invalid quantity for product {product_id}")
+            merged[product_id] = merged_get(product_id, 0) + quantity
+        for product_id, quantity in merged.items():
+            if quantity > MAX_LINE_QUANTITY:
+                raise OrderImportError(f"Invalid quantity for product {product_id}")
+        return cls(merged.keys(), merged.values())
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def __iter__(self):
+        return zip(self.product_ids, self.quantities)
+
+    def __eq__(self, other):
+        if not isinstance(other, Cart):
+            return NotImplemented
+        return self.product_ids == other.product_ids and self.quantities == other.quantities
+
+    def __repr__(self):
+        return f"Cart({list(self)!r})"
+
+
+def _product_id(value):
+    # 舊版接受數字字串形式的 product_id，這裡照舊轉成整數；其他型別視為無效
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return 0
+
+
+def _line_quantity(value):
+    # 整數字串沿用舊行為接受；布林與非整數的小數一律視為無效
+    if type(value) is int:
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return 0
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return 0
+
+
+def parse_order(data, backfill=False):
+    """
+    Validate one ``import_order`` payload and return a ParsedOrder whose
+    ``lines`` is a Cart. With ``backfill`` the payload may also carry the
+    order's original ``created_at`` as an ISO datetime.
+    """
+    if not isinstance(data, dict):
+        raise OrderImportError("Missing required fields")
+
+    order_number = data.get('order_number')
+    promo_code_str = data.get('promo_code')
+    products_data = data.get('products', [])
+
+    if not order_number or not products_data:
+        raise OrderImportError("Missing required fields")
+    if isinstance(order_number, (int, float)):
+        # 舊版把數字單號存成字串，這裡照舊轉換；陣列、物件等仍視為無效
+        order_number = str(order_number)
+    if not isinstance(order_number, str) or len(order_number) > ORDER_NUMBER_MAX_LENGTH:
+        raise OrderImportError("Invalid order_number")
+    idempotency_key = data.get('idempotency_key') or None
+    if idempotency_key is not None and (
+        not isinstance(idempotency_key, str) or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH
+    ):
+        raise OrderImportError("Invalid idempotency_key")
+    if promo_code_str and not isinstance(promo_code_str, str):
+        # 與舊版相同，非字串的優惠碼視為找不到
+        raise OrderImportError("Promo code not found")
+    promo_code_str = promo_code_str or None
+    created_at = _created_at(data.get('created_at')) if backfill else None
+
+    return ParsedOrder(order_number, promo_code_str, Cart.parse(products_data), idempotency_key, created_at)
+
+
+def _created_at(value):
+    if value is None or value == '':
+        return None
+    try:
+        parsed = datetime.fromisoformat(value) if isinstance(value, str) else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise OrderImportError("Invalid created_at")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    if parsed > timezone.now():
+        raise OrderImportError("Invalid created_at")
+    return parsed
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def sum_quantities(lines):
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def import_orders(orders_data, backfill=False, reserve_stock=True):
+    """
+    Import a batch of ``import_order`` payloads.
+
+    ``backfill`` accepts each payload's original ``created_at`` and checks
+    promo codes as of that time; ``reserve_stock=False`` writes the orders
+    without checking or decrementing stock.
+
+    Existing order numbers and idempotency keys, and products, are each
+    resolved with one query for the whole batch, promo codes come from the promo cache, and
+    accepted orders are written with bulk_create in a single transaction.
+    Returns one result dict per payload, in input order.
+    """
+    results = [None] * len(orders_data)
+    parsed = []
+    with phase('parse'):
+        for index, data in enumerate(orders_data):
+            try:
+                parsed.append((index, parse_order(data, backfill)))
+            except OrderImportError as exc:
+                results[index] = _error(data, exc)
+
+    with phase('products'):
+        order_numbers = [order.order_number for _, order in parsed]
+        idempotency_keys = [order.idempotency_key for _, order in parsed if order.idempotency_key]
+        if partitions.is_partitioned():
+            # 分區版面改查登記表，已封存訂單的單號也算已使用
+            existing_numbers, existing_keys = partitions.existing_keys(order_numbers, idempotency_keys)
+        else:
+            # 已封存的訂單不在訂單表中，同一個查詢一併查封存表
+            lookup = Q(order_number__in=order_numbers) | Q(idempotency_key__in=idempotency_keys)
+            existing_numbers = set()
+            existing_keys = set()
+            for order_number, idempotency_key in Order.objects.filter(lookup).values_list(
+                'order_number', 'idempotency_key'
+            ).union(
+                ArchivedOrder.objects.filter(lookup).values_list('order_number', 'idempotency_key'),
+                all=True,
+            ):
+                existing_numbers.add(order_number)
+                existing_keys.add(idempotency_key)
+
+        # 價格取自商品快照快取；庫存與分片判斷仍以下方鎖定的資料列為準
+        products = get_products(
+            {product_id for _, order in parsed for product_id in order.lines.product_ids}
+        )
+        promos = get_promotions(
+            {order.promo_code for _, order in parsed if order.promo_code}
+        )
+
+    candidates = []
+    for index, order in parsed:
+        try:
+            if order.order_number in existing_numbers:
+                raise OrderImportError("Order number already exists")
+            if order.idempotency_key and order.idempotency_key in existing_keys:
+                raise OrderImportError("Idempotency key already used")
+
+            missing_ids = [
+                str(product_id) for product_id in order.lines.product_ids
+                if product_id not in products
+            ]
+            if missing_ids:
+                raise OrderImportError(
+                    f"Product with id {', '.join(missing_ids)} not found"
+                )
+
+            promo = None
+            rules = ()
+            if order.promo_code:
+                promo = promos.get(order.promo_code)
+                if promo is None:
+                    raise OrderImportError("Promo code not found")
+                if not promo.is_valid(order.promo_code, order.created_at):
+                    raise OrderImportError("Invalid or expired promo code")
+                try:
+                    rules = [promo.pricing_rule()]
+                except ValueError:
+                    # 繞過 clean() 寫入的階梯格式錯誤，只讓使用此優惠碼的訂單失敗
+                    raise OrderImportError("Invalid or expired promo code")
+        except OrderImportError as exc:
+            results[index] = _error(orders_data[index], exc)
+            continue
+
+        existing_numbers.add(order.order_number)
+        if order.idempotency_key:
+            existing_keys.add(order.idempotency_key)
+        candidates.append((index, order, promo, rules))
+
+    with transaction.atomic():
+        # 鎖定批次內所有商品後，依序分配庫存；分片商品不鎖商品列，改在各訂單預留分片
+        in_stock = {}
+        if reserve_stock:
+            with phase('stock'):
+                in_stock = dict(
+                    Product.objects.select_for_update()
+                    .filter(
+                        id__in={product_id for _, order, _, _ in candidates for product_id in order.lines.product_ids},
+                        shard_count=0,
+                    )
+                    .order_by('id')
+                    .values_list('id', 'quantity_in_stock')
+                )
+        reserved = {}
+        accepted = []
+        for index, order, promo, rules in candidates:
+            # Cart 已合併重複商品，每個商品只有一行；不扣庫存時沒有要預留的數量
+            quantities = dict(order.lines) if reserve_stock else {}
+            short_ids = sorted(
+                product_id for product_id, quantity in quantities.items()
+                if product_id in in_stock and in_stock[product_id] - reserved.get(product_id, 0) < quantity
+            )
+            if short_ids:
+                results[index] = _error(
+                    orders_data[index],
+                    f"Insufficient stock for product {', '.join(map(str, short_ids))}"
+                )
+                continue
+            shard_counts = {
+                product_id: products[product_id].shard_count
+                for product_id in quantities if product_id not in in_stock
+            }
+            if shard_counts:
+                # 快照若還不知道商品已分片，交給 reserve_stock 從資料庫查分片數
+                if not all(shard_counts.values()):
+                    shard_counts = None
+                try:
+                    with phase('stock'), transaction.atomic():
+                        Product.objects.reserve_stock(
+                            {product_id: quantities[product_id] for product_id in quantities
+                             if product_id not in in_stock},
+                            shard_counts,
+                        )
+                except InsufficientStock as exc:
+                    results[index] = _error(orders_data[index], str(exc))
+                    continue
+            for product_id, quantity in quantities.items():
+                if product_id in in_stock:
+                    reserved[product_id] = reserved.get(product_id, 0) + quantity
+
+            prices = {product_id: products[product_id].price for product_id in order.lines.product_ids}
+            with phase('pricing'):
+                priced = price_order(order.lines, prices, rules, now=order.created_at)
+            new_order = Order(
+                order_number=order.order_number,
+                idempotency_key=order.idempotency_key,
+                promo_code=promo,
+                total_price=priced.total,
+                created_at=order.created_at or timezone.now(),
+            )
+            accepted.append((index, new_order, [
+                OrderProduct(
+                    order=new_order,
+                    created_at=new_order.created_at,
+                    product_id=product_id,
+                    quantity=quantity,
+                    unit_price=prices[product_id],
+                    line_total=line_total,
+                )
+                for (product_id, quantity), line_total in zip(order.lines, priced.line_totals)
+            ]))
+
+        with phase('stock'):
+            Product.objects.reserve_stock(reserved, shard_counts={})
+        with phase('write'):
+            Order.objects.bulk_create([order for _, order, _ in accepted])
+            OrderProduct.objects.bulk_create([
+                item for _, _, items in accepted for item in items
+            ])
+        transaction.on_commit(
+            lambda: rollups.record_orders([(order, items) for _, order, items in accepted])
+        )
+
+    for index, order, _ in accepted:
+        results[index] = {
+            "order_number": order.order_number,
+            "status": "created",
+            "detail": "Order created successfully",
+            "final_price": order.total_price,
+        }
+    return results
+
+
+def parse_restock_items(items_data):
+    """
+    Validate ``[{"product_id": ..., "quantity": ...}]`` and return
+    ``{product_id: quantity}`` with repeated products summed.
+    """
+    lines = []
+    for item in items_data:
+        if not isinstance(item, dict):
+            raise RestockError("Missing required fields")
+        product_id = item.get('product_id')
+        quantity = item.get('quantity')
+        if type(product_id) is not int or not 0 < product_id <= MAX_PRODUCT_ID:
+            raise RestockError(f"Invalid product_id {product_id}")
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise RestockError(f"Invalid quantity for product {product_id}")
+        lines.append((product_id, quantity))
+    return sum_quantities(lines)
+
+
+def restock_products(deltas, batch_size=5000):
+    """
+    Add ``{product_id: quantity}`` to stock with set-based UPDATEs and
+    append one StockMovement per restocked product, all in one transaction.
+    Unknown product ids are skipped and returned.
+    """
+    with transaction.atomic():
+        restocked_ids = Product.objects.add_stock(deltas, batch_size=batch_size)
+        StockMovement.objects.bulk_create(
+            [
+                StockMovement(product_id=product_id, quantity=deltas[product_id], reason=StockMovement.RESTOCK)
+                for product_id in restocked_ids
+            ],
+            batch_size=batch_size,
+        )
+
+    restocked_ids = set(restocked_ids)
+    return sorted(product_id for product_id in deltas if product_id not in restocked_ids)
+
+
+def sales_by_product_day(start, end):
+    """
+    Revenue and units per product per day for orders created in
+    ``[start, end)``, aggregated in one query over the line-item price
+    snapshots.
+    """
+    return (
+        OrderProduct.objects
+        .filter(order__created_at__gte=start, order__created_at__lt=end)
+        .annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('line_total'))
+        .order_by('day', 'product_id')
+    )
+
+
+PRODUCT_LIST_FIELDS = ('id', 'name', 'price', 'quantity_in_stock')
+
+
+def search_products(query=None, price_min=None, price_max=None, in_stock=None):
+    """
+    Queryset of catalog rows (``PRODUCT_LIST_FIELDS`` only) matching the
+    optional search text, price range and stock filter.
+
+    On PostgreSQL every word of ``query`` must prefix-match a word of the
+    name or description through the full-text GIN index, or the whole
+    query must be trigram word-similar to the name (typos) through the
+    trigram GIN index. Other databases fall back to substring matching of
+    every word.
+    """
+    queryset = Product.objects.all()
+    if query:
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return queryset.none().values(*PRODUCT_LIST_FIELDS)
+        if connection.vendor == 'postgresql':
+            # 詞已限制為 \w+，組成 raw tsquery 不會有語法字元
+            tsquery = ' & '.join(f"{term}:*" for term in terms)
+            queryset = queryset.annotate(
+                search=SearchVector('name', 'description', config=PRODUCT_SEARCH_CONFIG)
+            ).filter(
+                Q(search=SearchQuery(tsquery, config=PRODUCT_SEARCH_CONFIG, search_type='raw'))
+                | Q(TrigramWordSimilar(F('name'), Value(query)))
+            )
+        else:
+            for term in terms:
+                queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term))
+    if price_min is not None:
+        queryset = queryset.filter(price__gte=price_min)
+    if price_max is not None:
+        queryset = queryset.filter(price__lte=price_max)
+    if in_stock is not None:
+        queryset = queryset.filter(quantity_in_stock__gt=0) if in_stock else queryset.filter(quantity_in_stock=0)
+    return queryset.values(*PRODUCT_LIST_FIELDS)
+
+
+def import_orders_retrying(orders_data, attempts=IMPORT_CONFLICT_ATTEMPTS):
+    """
+    Run ``import_orders``, re-running the batch when a concurrent import
+    inserted one of its order numbers or idempotency keys first; the next
+    run's dedupe lookup then reports those orders as already existing.
+    Nothing is written by a run that conflicts, so if conflicts persist
+    for ``attempts`` runs every order is reported as an error.
+    """
+    for _ in range(attempts):
+        try:
+            return import_orders(orders_data)
+        except IntegrityError:
+            continue
+    return [_error(data, "Conflicting concurrent import, please retry") for data in orders_data]
+
+
+def imported_orders(order_number, idempotency_key=None):
+    """
+    Queryset of ``(order_number, idempotency_key, total_price)`` rows of
+    already imported orders, live or archived, matching ``idempotency_key``
+    or ``order_number``. Both tables are indexed on both columns, so this
+    is a single query of indexed lookups. It is ordered, so ``first()`` and
+    ``afirst()`` can be used on it directly.
+    """
+    lookup = Q(order_number=order_number)
+    if idempotency_key:
+        lookup |= Q(idempotency_key=idempotency_key)
+    fields = ('order_number', 'idempotency_key', 'total_price')
+    return Order.objects.filter(lookup).values_list(*fields).union(
+        ArchivedOrder.objects.filter(lookup).values_list(*fields), all=True
+    ).order_by('order_number')
+
+
+def find_imported_order(order_number, idempotency_key=None):
+    """
+    Return the already imported order matching ``idempotency_key`` or
+    ``order_number`` as an ImportedOrder, or None.
+    """
+    row = imported_orders(order_number, idempotency_key).first()
+    return ImportedOrder(*row) if row else None
+
+
+async def afind_imported_order(order_number, idempotency_key=None):
+    """Async version of find_imported_order, using the async ORM."""
+    row = await imported_orders(order_number, idempotency_key).afirst()
+    return ImportedOrder(*row) if row else None
+
+
+def _error(data, detail):
+    return {
+        "order_number": data.get('order_number') if isinstance(data, dict) else None,
+        "status": "error",
+        "detail": str(detail),
+    }
@@ -0,0 +1,44 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .caches import invalidate_api_tokens, invalidate_products, invalidate_promotions
+from .models import ApiToken, Product, PromotionCode
+
+
+@receiver(pre_save, sender=PromotionCode)
+def invalidate_renamed_promotion(sender, instance, **kwargs):
+    if instance.pk:
+        old_code = sender.objects.filter(pk=instance.pk).values_list('code', flat=True).first()
+        if old_code and old_code != instance.code:
+            invalidate_promotions([old_code])
+
+
+@receiver(post_save, sender=PromotionCode)
+@receiver(post_delete, sender=PromotionCode)
+def invalidate_promotion(sender, instance, **kwargs):
+    invalidate_promotions([instance.code])
+
+
+@receiver(m2m_changed, sender=PromotionCode.products.through)
+def invalidate_promotion_products(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_promotions([instance.code])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_promotions(
+            PromotionCode.objects.filter(pk__in=pk_set).values_list('code', flat=True)
+        )
+    elif action == 'pre_clear':
+        invalidate_promotions(instance.promotions.values_list('code', flat=True))
+
+
+@receiver(post_save, sender=ApiToken)
+@receiver(post_delete, sender=ApiToken)
+def invalidate_api_token(sender, instance, **kwargs):
+    invalidate_api_tokens()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
@@ -0,0 +1,22 @@
+from django.urls import get_resolver
+from rest_framework.settings import api_settings
+
+
+def warm_up():
+    """
+    Do the work the first request would otherwise pay for: import every
+    view through the URL resolver, build its reverse lookup tables and
+    load the DRF parser, renderer and negotiation classes. Touches no
+    database connection, so it is safe to call before forking.
+    """
+    # 讀取 reverse_dict 會匯入所有 urlconf 與 view，並編譯 URL 樣式
+    get_resolver().reverse_dict
+    for name in (
+        'DEFAULT_PARSER_CLASSES',
+        'DEFAULT_RENDERER_CLASSES',
+        'DEFAULT_AUTHENTICATION_CLASSES',
+        'DEFAULT_PERMISSION_CLASSES',
+        'DEFAULT_THROTTLE_CLASSES',
+        'DEFAULT_CONTENT_NEGOTIATION_CLASS',
+    ):
+        getattr(api_settings, name)
@@ -1,15 +1,54 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import Product, Order, OrderProduct, PromotionCode
+from rest_framework.decorators import api_view
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, APITestCase
+from . import partitions, rollups
+from .bench import connection_overhead
+from .caches import _local_products, get_product, get_products, get_promotion, invalidate_products
+from .decorators import instrument_view, validate_access_token
+from .jobs import enqueue_order, process_jobs
+from .metrics import registry
+from .pagination import encode_cursor
+from .pricing import Rule, parse_tiers, price_order
+from .renderers import FastJSONRenderer
+from .services import Cart, OrderImportError, import_orders, restock_products
+from .views import import_order
+from .models import (
+    ApiToken, ArchivedOrder, InsufficientStock, Product, Order, OrderImportJob, OrderProduct, PromotionCode, StockMovement,
+    ProductSalesRollup, PromoSalesRollup, StockShard,
+)
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
 class OrderTestCase(APITestCase):
     ACCEPTED_TOKEN = 'omni_pretest_token'
 
     def setUp(self):
         self.url = reverse('import_order')
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
         self.invalid_token = "invalid_token"
 
         self.product = Product.objects.create(
@@ -31,6 +70,7 @@ class OrderTestCase(APITestCase):
         self.promo.products.add(self.product)
 
     def test_missing_access_token(self):
+        self.client.credentials()
         data = {
             'order_number': '12345',
             'products': [{"product_id": self.product.id, "quantity": 1}]
@@ -40,8 +80,8 @@ class OrderTestCase(APITestCase):
         self.assertIn("Invalid or missing access token", response.data['detail'])
 
     def test_invalid_access_token(self):
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.invalid_token)
         data = {
-            'access_token': self.invalid_token,
             'order_number': '12345',
             'products': [{"product_id": self.product.id, "quantity": 1}]
         }
@@ -51,16 +91,36 @@ class OrderTestCase(APITestCase):
 
     def test_missing_required_fields(self):
         data = {
-            'access_token': self.ACCEPTED_TOKEN,
             'order_number': '12345'
         }
         response = self.client.post(self.url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("Missing required fields", response.data['detail'])
 
+    def test_non_string_order_number_or_idempotency_key(self):
+        products = [{"product_id": self.product.id, "quantity": 1}]
+        for data, detail in (
+            ({'order_number': ["a"], 'products': products}, "Invalid order_number"),
+            ({'order_number': "ORDKEY", 'idempotency_key': ["x"], 'products': products}, "Invalid idempotency_key"),
+        ):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(detail, response.data['detail'])
+        self.assertFalse(Order.objects.exists())
+
+    def test_numeric_order_number_is_stored_as_string(self):
+        data = {'order_number': 12345, 'products': [{"product_id": self.product.id, "quantity": 1}]}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Order.objects.filter(order_number="12345").exists())
+
+        # 以字串重送同一單號，視為重複匯入
+        retry = self.client.post(self.url, {**data, 'order_number': "12345"}, format='json')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
     def test_successful_order_creation(self):
         data = {
-            "access_token": self.ACCEPTED_TOKEN,
             "order_number": "ORD123",
             "products": [
                 {"product_id": self.product.id, "quantity": 2}
@@ -76,7 +136,6 @@ class OrderTestCase(APITestCase):
     def test_stock_updated_after_order(self):
         initial_stock = self.product.quantity_in_stock
         data = {
-            "access_token": self.ACCEPTED_TOKEN,
             "order_number": "ORD999",
             "products": [
                 {"product_id": self.product.id, "quantity": 3}
@@ -91,7 +150,6 @@ class OrderTestCase(APITestCase):
 
     def test_successful_order_without_promo_code(self):
         data = {
-            "access_token": self.ACCEPTED_TOKEN,
             "order_number": "ORD_NO_PROMO",
             "products": [
                 {"product_id": self.product.id, "quantity": 2}
@@ -103,7 +161,6 @@ class OrderTestCase(APITestCase):
 
     def test_successful_order_with_valid_promo_code(self):
         data = {
-            "access_token": self.ACCEPTED_TOKEN,
             "order_number": "ORD_WITH_PROMO",
             "promo_code": "BF2025",
             "products": [
@@ -114,9 +171,20 @@ class OrderTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['final_price'], 80)  # 原價 100，折扣 20% → 80
 
+    def test_promo_code_lookup_is_case_insensitive(self):
+        data = {
+            "order_number": "ORD_LOWER_PROMO",
+            "promo_code": "bf2025",
+            "products": [
+                {"product_id": self.product.id, "quantity": 2}
+            ]
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['final_price'], 80)
+
     def test_order_with_invalid_promo_code(self):
         data = {
-            "access_token": self.ACCEPTED_TOKEN,
             "order_number": "ORD_INVALID_PROMO",
             "promo_code": "WRONGCODE",
             "products": [
@@ -127,6 +195,17 @@ class OrderTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("Promo code not found", response.data['detail'])
 
+    def test_order_with_non_string_promo_code(self):
+        for index, promo_code in enumerate((123, ["x"])):
+            data = {
+                "order_number": f"ORD_BAD_PROMO{index}",
+                "promo_code": promo_code,
+                "products": [{"product_id": self.product.id, "quantity": 1}]
+            }
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("Promo code not found", response.data['detail'])
+
     def test_order_with_expired_promo_code(self):
         expired_promo = PromotionCode.objects.create(
             name="Expired Sale",
@@ -139,7 +218,6 @@ class OrderTestCase(APITestCase):
         expired_promo.products.add(self.product)
 
         data = {
-            "access_token": self.ACCEPTED_TOKEN,
             "order_number": "ORD_EXPIRED_PROMO",
             "promo_code": "OLD2020",
             "products": [
@@ -150,6 +228,1759 @@ class OrderTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("Invalid or expired promo code", response.data['detail'])
 
+    def test_replayed_order_returns_original_response(self):
+        data = {
+            "order_number": "ORD_REPLAY",
+            "promo_code": "BF2025",
+            "products": [
+                {"product_id": self.product.id, "quantity": 2}
+            ]
+        }
+        first = self.client.post(self.url, data, format='json')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with self.assertNumQueries(1):
+            replay = self.client.post(self.url, data, format='json')
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay.data, first.data)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 8)
+        self.assertEqual(Order.objects.filter(order_number="ORD_REPLAY").count(), 1)
+
+    def test_replay_by_idempotency_key(self):
+        data = {
+            "order_number": "ORD_KEYED",
+            "products": [
+                {"product_id": self.product.id, "quantity": 1}
+            ]
+        }
+        first = self.client.post(self.url, data, format='json', HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        retry = self.client.post(
+            self.url,
+            {**data, "order_number": "ORD_KEYED_RETRY"},
+            format='json',
+            HTTP_IDEMPOTENCY_KEY="key-1"
+        )
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data['final_price'], first.data['final_price'])
+        self.assertFalse(Order.objects.filter(order_number="ORD_KEYED_RETRY").exists())
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 9)
+
+    def test_replay_by_idempotency_key_in_body(self):
+        data = {
+            "order_number": "ORD_BODY_KEY",
+            "idempotency_key": "body-key",
+            "products": [{"product_id": self.product.id, "quantity": 1}]
+        }
+        first = self.client.post(self.url, data, format='json')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        retry = self.client.post(self.url, {**data, "order_number": "ORD_BODY_KEY_RETRY"}, format='json')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(Order.objects.filter(order_number="ORD_BODY_KEY_RETRY").exists())
+
+    def test_order_exceeding_stock_is_rejected(self):
+        data = {
+            "order_number": "ORD_OVERSELL",
+            "products": [
+                {"product_id": self.product.id, "quantity": 11}
+            ]
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Insufficient stock", response.data['detail'])
+
+        # 庫存不足時整筆訂單應回滾
+        self.assertFalse(Order.objects.filter(order_number="ORD_OVERSELL").exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 10)
+
+class ImportOrderQueryCountTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.url = reverse('import_order')
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.products = [
+            Product.objects.create(
+                name=f"Product {i}",
+                price=10,
+                quantity_in_stock=100
+            )
+            for i in range(20)
+        ]
+
+    def _import(self, order_number, products):
+        data = {
+            "order_number": order_number,
+            "products": [
+                {"product_id": product.id, "quantity": 1}
+                for product in products
+            ]
+        }
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return [query['sql'] for query in ctx.captured_queries]
+
+    def test_line_items_do_not_add_queries_per_item(self):
+        single = self._import("ORD_SINGLE", self.products[:1])
+        many = self._import("ORD_MANY", self.products)
+
+        # 查詢次數不應隨品項數增加
+        self.assertEqual(len(single), len(many))
+        self.assertEqual(sum(1 for sql in many if 'INSERT INTO "api_orderproduct"' in sql), 1)
+        self.assertEqual(OrderProduct.objects.filter(order__order_number="ORD_MANY").count(), 20)
+
+    def test_calculate_total_uses_constant_queries(self):
+        promo = PromotionCode.objects.create(
+            name="Half Off",
+            code="HALF",
+            discount_type="percent",
+            value=50,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        promo.products.add(*self.products)
+
+        totals = []
+        query_counts = []
+        for order_number, products in (("CALC_ONE", self.products[:1]), ("CALC_ALL", self.products)):
+            order = Order.objects.create(order_number=order_number, promo_code=promo)
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=product, quantity=2)
+                for product in products
+            ])
+            order = Order.objects.get(pk=order.pk)
+            with CaptureQueriesContext(connection) as ctx:
+                totals.append(order.calculate_total())
+            query_counts.append(len(ctx.captured_queries))
+
+        self.assertEqual(totals, [10, 200])
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(Order.objects.get(order_number="CALC_ALL").total_price, 200)
+
+    def test_all_missing_products_reported_together(self):
+        data = {
+            "order_number": "ORD_MISSING",
+            "products": [
+                {"product_id": self.products[0].id, "quantity": 1},
+                {"product_id": 99998, "quantity": 1},
+                {"product_id": 99999, "quantity": 1}
+            ]
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("99998, 99999", response.data['detail'])
+        self.assertFalse(Order.objects.filter(order_number="ORD_MISSING").exists())
+
+class CartParsingTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def test_repeated_products_are_merged_in_first_seen_order(self):
+        cart = Cart.parse([
+            {"product_id": 7, "quantity": 2},
+            {"product_id": 3},
+            {"product_id": 7, "quantity": "3"},
+            {"product_id": "3", "quantity": 4.0},
+        ])
+        self.assertEqual(list(cart), [(7, 5), (3, 5)])
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart, Cart([7, 3], [5, 5]))
+
+    def test_malformed_lines_are_rejected(self):
+        cases = [
+            ({"products": "7"}, "Invalid products"),
+            ([7], "Invalid line item"),
+            ([{"product_id": "7a", "quantity": 1}], "Invalid product_id 7a"),
+            ([{"product_id": "-7", "quantity": 1}], "Invalid product_id -7"),
+            ([{"product_id": 7.0, "quantity": 1}], "Invalid product_id 7.0"),
+            ([{"product_id": True, "quantity": 1}], "Invalid product_id True"),
+            ([{"product_id": 0, "quantity": 1}], "Invalid product_id 0"),
+            ([{"product_id": 7, "quantity": 2.5}], "Invalid quantity for product 7"),
+            ([{"product_id": 7, "quantity": True}], "Invalid quantity for product 7"),
+            ([{"product_id": 7, "quantity": 2 ** 31 - 1}, {"product_id": 7, "quantity": 1}],
+             "Invalid quantity for product 7"),
+        ]
+        for products_data, message in cases:
+            with self.assertRaisesMessage(OrderImportError, message):
+                Cart.parse(products_data)
+
+    def test_import_order_stores_merged_line_and_rejects_bad_body(self):
+        product = Product.objects.create(name="Merged", price=10, quantity_in_stock=10)
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        response = self.client.post(reverse('import_order'), {
+            "order_number": "MERGED",
+            "products": [{"product_id": product.id, "quantity": 1}, {"product_id": product.id, "quantity": 2}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['final_price'], 30.0)
+        self.assertEqual(
+            list(OrderProduct.objects.filter(order__order_number="MERGED").values_list('quantity', flat=True)), [3]
+        )
+
+        for body in ('{"order_number": ', '[1, 2]'):
+            response = self.client.post(reverse('import_order'), body, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_fast_renderer_matches_drf_renderer(self):
+        data = {
+            "price": Decimal('12.50'),
+            "created_at": timezone.make_aware(datetime(2026, 10, 17, 8, 30, 0, 123456)),
+            "day": date(2026, 10, 17),
+            "counts": {1: "one"},
+            "name": "咖啡杯",
+        }
+        self.assertEqual(
+            json.loads(FastJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+class BenchCommandTestCase(TestCase):
+    def test_bench_reports_each_scenario_and_compares_with_baseline(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, "bench.json")
+            options = {
+                "products": 5, "promos": 1, "orders": 5, "requests": 3, "batch": 2,
+                "scenario": ["import_order", "order_detail"], "stdout": StringIO(), "stderr": StringIO()
+            }
+            call_command('bench', seed=True, output=output, **options)
+            with open(output) as f:
+                report = json.load(f)
+
+            summary = report['scenarios']['import_order']['test_client']
+            self.assertEqual(summary['status_codes'], {'201': 3})
+            self.assertGreater(summary['queries_per_request'], 0)
+            self.assertEqual(report['scenarios']['order_detail']['test_client']['queries_per_request'], 2)
+            self.assertEqual(sum(report['product_cache']['lookups'].values()), 3 * 3)
+
+            call_command('bench', baseline=output, tolerance=100, **options)
+
+    def test_connection_overhead_reports_both_modes(self):
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        results = connection_overhead(3)
+        self.assertEqual(set(results), {'per_request', 'persistent'})
+        self.assertEqual(results['persistent']['requests'], 3)
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], conn_max_age)
+
+class StartupBenchmarkTestCase(TestCase):
+    # 寬鬆的上限，只用來發現啟動時間的重大退步
+    STARTUP_BUDGET_MS = 10000
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        # 子行程沿用 sys.path；兩種 profile 都改用 SQLite，第一個請求不查詢資料庫
+        for name, base in (('startup_full_settings', 'pretest.settings'), ('startup_api_settings', 'pretest.settings_api')):
+            with open(os.path.join(tmpdir.name, f"{name}.py"), 'w') as f:
+                f.write(
+                    f"from {base} import *  # noqa\n"
+                    "DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}\n"
+                )
+        sys.path.insert(0, tmpdir.name)
+        self.addCleanup(sys.path.remove, tmpdir.name)
+        self.settings_dir = tmpdir.name
+
+    def test_api_profile_starts_leaner_than_full_profile(self):
+        out = StringIO()
+        call_command(
+            'bench_startup',
+            profile=[
+                ['full', 'pretest.wsgi', 'startup_full_settings'],
+                ['api', 'pretest.wsgi_api', 'startup_api_settings'],
+            ],
+            repeat=1,
+            stdout=out,
+        )
+        profiles = json.loads(out.getvalue())['profiles']
+        full, lean = profiles['full'], profiles['api']
+
+        self.assertEqual((full['status'], lean['status']), (200, 200))
+        self.assertEqual(lean['apps'], ['api'])
+        self.assertIn('django.contrib.sessions', full['apps'])
+        self.assertLess(lean['modules'], full['modules'])
+        # 精簡入口在匯入時預熱，第一個請求不必再載入 view 與 URL 設定
+        self.assertLess(lean['first_request_ms'], full['first_request_ms'])
+        self.assertLess(lean['process_ms'], self.STARTUP_BUDGET_MS)
+
+    def test_asgi_entry_points_do_not_keep_connections(self):
+        # 保留 settings 依環境變數算出的 CONN_MAX_AGE，只把資料庫換成 SQLite
+        with open(os.path.join(self.settings_dir, "startup_conn_settings.py"), 'w') as f:
+            f.write(
+                "from pretest.settings_api import *  # noqa\n"
+                "DATABASES['default'].update(ENGINE='django.db.backends.sqlite3', NAME=':memory:')\n"
+            )
+        env = {key: value for key, value in os.environ.items() if key != 'DB_CONN_MAX_AGE'}
+        env.update(PYTHONPATH=os.pathsep.join(sys.path), DJANGO_SETTINGS_MODULE='startup_conn_settings')
+        script = (
+            "import importlib, sys; importlib.import_module(sys.argv[1]); "
+            "from django.conf import settings; print(settings.DATABASES['default']['CONN_MAX_AGE'])"
+        )
+        for entry, expected in (('pretest.asgi', '0'), ('pretest.asgi_api', '0'), ('pretest.wsgi_api', '60')):
+            with self.subTest(entry=entry):
+                completed = subprocess.run(
+                    [sys.executable, '-c', script, entry], env=env, capture_output=True, text=True, check=True
+                )
+                self.assertEqual(completed.stdout.strip(), expected)
+
+class BulkImportOrderTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.url = reverse('import_orders_bulk')
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.product = Product.objects.create(
+            name="Bulk Product",
+            price=50,
+            quantity_in_stock=5
+        )
+        self.promo = PromotionCode.objects.create(
+            name="Bulk Sale",
+            code="BULK10",
+            discount_type="fixed",
+            value=10,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        self.promo.products.add(self.product)
+        Order.objects.create(order_number="EXISTING")
+
+    def _order(self, order_number, quantity=1, **extra):
+        return {
+            "order_number": order_number,
+            "products": [{"product_id": self.product.id, "quantity": quantity}],
+            **extra
+        }
+
+    def test_bulk_import_reports_per_order_results(self):
+        data = {
+            "orders": [
+                self._order("BULK1", 2),
+                self._order("BULK2", 1, promo_code="BULK10"),
+                self._order("EXISTING"),
+                self._order("BULK1"),
+                self._order("BULK3", 3),
+                {"order_number": "BULK4"}
+            ]
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 4)
+
+        results = response.data['results']
+        self.assertEqual(results[0]['final_price'], 100)
+        self.assertEqual(results[1]['final_price'], 40)
+        self.assertIn("already exists", results[2]['detail'])
+        self.assertIn("already exists", results[3]['detail'])
+        self.assertIn("Insufficient stock", results[4]['detail'])
+        self.assertIn("Missing required fields", results[5]['detail'])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 2)
+        self.assertEqual(OrderProduct.objects.filter(order__order_number__startswith="BULK").count(), 2)
+
+    def test_malformed_order_fails_alone(self):
+        data = {
+            "orders": [
+                self._order(["a"]),
+                self._order("BULKKEY", idempotency_key=["x"]),
+                self._order("BULK5"),
+            ]
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 2))
+        results = response.data['results']
+        self.assertIn("Invalid order_number", results[0]['detail'])
+        self.assertIn("Invalid idempotency_key", results[1]['detail'])
+
+    def test_concurrent_conflicts_are_retried_then_reported(self):
+        data = {"orders": [self._order("RACE1"), self._order("RACE2")]}
+        with mock.patch('api.services.import_orders', side_effect=IntegrityError("duplicate")) as run:
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual((response.data['created'], response.data['failed']), (0, 2))
+        self.assertIn("Conflicting concurrent import", response.data['results'][0]['detail'])
+
+        # 衝突消失後的重跑照常匯入
+        with mock.patch('api.services.import_orders', side_effect=[IntegrityError("duplicate"), [{"status": "created"}]]):
+            response = self.client.post(self.url, {"orders": [self._order("RACE3")]}, format='json')
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 0))
+
+    def test_bulk_import_query_count_is_constant(self):
+        orders = [self._order(f"CONST{i}", promo_code="BULK10") for i in range(5)]
+        data = {"orders": orders}
+        self.product.quantity_in_stock = 100
+        self.product.save()
+        get_promotion("BULK10")
+        get_product(self.product.id)
+
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.url, {**data, "orders": orders[:1]}, format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(self.url, {**data, "orders": orders[1:]}, format='json')
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_bulk_import_accepts_ndjson(self):
+        body = "\n".join(json.dumps(self._order(f"ND{i}")) for i in range(2))
+        response = self.client.post(
+            self.url,
+            body,
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+
+    def test_bulk_import_requires_access_token(self):
+        self.client.credentials()
+        response = self.client.post(self.url, [self._order("NOAUTH")], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.filter(order_number="NOAUTH").exists())
+
+class QueuedImportOrderTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.url = reverse('import_order')
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.product = Product.objects.create(
+            name="Queued Product",
+            price=30,
+            quantity_in_stock=3
+        )
+
+    def _order(self, order_number, quantity=1):
+        return {
+            "order_number": order_number,
+            "products": [{"product_id": self.product.id, "quantity": quantity}]
+        }
+
+    def test_queued_order_is_imported_by_worker(self):
+        response = self.client.post(f"{self.url}?mode=queued", self._order("QUEUED1", 2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], OrderImportJob.PENDING)
+        self.assertFalse(Order.objects.filter(order_number="QUEUED1").exists())
+
+        call_command('run_order_workers', workers=1, once=True, stdout=StringIO())
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], OrderImportJob.DONE)
+        self.assertEqual(response.data['final_price'], '60.00')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 1)
+
+    def test_failed_order_is_reported_on_job(self):
+        response = self.client.post(
+            self.url, self._order("QUEUED2", 5), format='json', HTTP_PREFER='respond-async'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        self.assertEqual(process_jobs(), 1)
+        job = OrderImportJob.objects.get(id=response.data['job_id'])
+        self.assertEqual(job.status, OrderImportJob.FAILED)
+        self.assertIn("Insufficient stock", job.result['detail'])
+        self.assertEqual(job.attempts, 1)
+
+    def test_malformed_payload_is_rejected_before_queueing(self):
+        response = self.client.post(f"{self.url}?mode=queued", {"order_number": "QUEUED3"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(OrderImportJob.objects.exists())
+
+    def test_idempotency_key_returns_same_job(self):
+        first = self.client.post(
+            f"{self.url}?mode=queued", self._order("QUEUED4"), format='json', HTTP_IDEMPOTENCY_KEY="job-key"
+        )
+        second = self.client.post(
+            f"{self.url}?mode=queued", self._order("QUEUED4"), format='json', HTTP_IDEMPOTENCY_KEY="job-key"
+        )
+        self.assertEqual(first.data['job_id'], second.data['job_id'])
+
+    def test_stale_claims_are_retried_then_failed(self):
+        job = enqueue_order(self._order("QUEUED5"))
+        stale = timezone.now() - timedelta(hours=1)
+        OrderImportJob.objects.filter(id=job.id).update(
+            status=OrderImportJob.PROCESSING, claimed_at=stale, attempts=3
+        )
+
+        self.assertEqual(process_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, OrderImportJob.FAILED)
+        self.assertEqual(job.result['detail'], "Too many attempts")
+        self.assertFalse(Order.objects.filter(order_number="QUEUED5").exists())
+
+    def test_malformed_job_fails_alone_and_worker_keeps_running(self):
+        good = enqueue_order(self._order("QUEUED6"))
+        bad = OrderImportJob.objects.create(payload=self._order("QUEUED7"))
+        # 舊版寫入、已達重試上限的非物件 payload
+        legacy = OrderImportJob.objects.create(payload=["QUEUED8"], attempts=3)
+
+        def flaky_import(payloads):
+            if any(payload['order_number'] == "QUEUED7" for payload in payloads):
+                raise TypeError("unexpected payload")
+            return import_orders(payloads)
+
+        with mock.patch('api.jobs.import_orders_retrying', side_effect=flaky_import), \
+                self.assertLogs('api.jobs', 'ERROR'):
+            call_command('run_order_workers', workers=1, once=True, stdout=StringIO())
+
+        statuses = dict(OrderImportJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[good.id], OrderImportJob.DONE)
+        self.assertEqual(statuses[bad.id], OrderImportJob.FAILED)
+        self.assertEqual(statuses[legacy.id], OrderImportJob.FAILED)
+        self.assertEqual(OrderImportJob.objects.get(id=bad.id).result['detail'], "Malformed payload: TypeError")
+        self.assertTrue(Order.objects.filter(order_number="QUEUED6").exists())
+
+        response = self.client.get(reverse('import_job_detail', args=[legacy.id]))
+        self.assertEqual(response.data['order_number'], None)
+        self.assertEqual(response.data['detail'], "Too many attempts")
+
+    def test_job_detail_not_found(self):
+        response = self.client.get(reverse('import_job_detail', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class PerformanceInstrumentationTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        registry.clear()
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.product = Product.objects.create(name="Timed Product", price=10, quantity_in_stock=10)
+        self.data = {
+            "order_number": "TIMED1",
+            "products": [{"product_id": self.product.id, "quantity": 1}]
+        }
+
+    def test_server_timing_reports_db_and_phases(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('import_order'), self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(queries.captured_queries)} queries"', timing)
+        for name in ('app', 'db', 'parse', 'auth', 'products', 'pricing', 'stock', 'write'):
+            self.assertIn(f"{name};dur=", timing)
+
+    def test_metrics_endpoint_exposes_request_counters(self):
+        self.client.post(reverse('import_order'), self.data, format='json')
+        response = self.client.get(reverse('metrics'))
+        body = response.content.decode()
+        self.assertIn('api_requests_total{view="import_order",method="POST",status="201"} 1', body)
+        self.assertIn('api_request_duration_seconds_count{view="import_order"} 1', body)
+        self.assertIn('api_phase_duration_seconds_total{view="import_order",phase="pricing"}', body)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_as_json(self):
+        with self.assertLogs('api.performance', level='WARNING') as logs:
+            self.client.post(reverse('import_order'), self.data, format='json')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'import_order')
+        self.assertIn('pricing', record['phases_ms'])
+
+    @override_settings(MIDDLEWARE=[])
+    def test_instrument_view_without_middleware(self):
+        @instrument_view
+        @api_view(['GET'])
+        @validate_access_token
+        def ping(request):
+            return Response({"detail": "pong"})
+
+        request = APIRequestFactory().get('/ping/', HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        response = ping(request)
+        self.assertIn("auth;dur=", response['Server-Timing'])
+        self.assertIn('api_requests_total{view="unmatched",method="GET",status="200"} 1', registry.render())
+
+    def test_middleware_is_not_adapted_under_asgi(self):
+        with mock.patch.object(
+            ASGIHandler, 'adapt_method_mode', autospec=True, side_effect=BaseHandler.adapt_method_mode
+        ) as adapt:
+            ASGIHandler()
+        # 中介層的呼叫為 (self, is_async, handler, handler_is_async, name=...)，兩種模式不同時才會轉換
+        adapted = [
+            call.kwargs['name'] for call in adapt.call_args_list
+            if 'name' in call.kwargs and call.args[1] != call.args[3]
+        ]
+        self.assertNotIn('middleware api.middleware.PerformanceMiddleware', adapted)
+
+        async def get_metrics():
+            return await AsyncClient().get(reverse('metrics'))
+
+        response = async_to_sync(get_metrics)()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("app;dur=", response['Server-Timing'])
+
+class OrderReadApiTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.products = Product.objects.bulk_create([
+            Product(name=f"Read Product {i}", price=10, quantity_in_stock=0)
+            for i in range(3)
+        ])
+        self.promo = PromotionCode.objects.create(
+            name="Read Sale",
+            code="READ5",
+            discount_type="fixed",
+            value=5,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        # bulk_create 讓多筆訂單共用相近的 created_at，用來驗證 id 作為次排序
+        self.orders = Order.objects.bulk_create([
+            Order(order_number=f"READ{i}", total_price=i, promo_code=self.promo if i % 2 else None)
+            for i in range(7)
+        ])
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=order, product=product, quantity=2)
+            for order in self.orders
+            for product in self.products
+        ])
+
+    def test_keyset_pages_cover_all_orders_with_constant_queries(self):
+        self.client.get(reverse('list_orders'))
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"page_size": 3}
+            if cursor:
+                params["cursor"] = cursor
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('list_orders'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(order['order_number'] for order in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+
+        expected = list(
+            Order.objects.order_by('-created_at', '-id').values_list('order_number', flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 7)
+
+    def test_order_detail_includes_items_and_promo(self):
+        response = self.client.get(reverse('order_detail', args=["READ1"]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['promo_code'], {"code": "READ5", "name": "Read Sale"})
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['items'][0]['quantity'], 2)
+
+        response = self.client.get(reverse('order_detail', args=["MISSING"]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('list_orders'), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_well_formed_cursor_with_wrong_shape(self):
+        for url in (reverse('list_orders'), reverse('list_products')):
+            for values in ([[1], 2], [None, None], [1], [True, 1], {"a": 1}):
+                response = self.client.get(url, {"cursor": encode_cursor(values)})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (url, values))
+                self.assertEqual(response.data['detail'], "Invalid cursor")
+
+class ProductCatalogTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.products = Product.objects.bulk_create([
+            Product(name="Blue Mug", description="Ceramic coffee mug", price=300, quantity_in_stock=5),
+            Product(name="Red Mug", description="Enamel camping mug", price=250, quantity_in_stock=0),
+            Product(name="Coffee Beans", description="Single origin, 1kg", price=900, quantity_in_stock=12),
+            Product(name="Teapot", description="Glass teapot", price=600, quantity_in_stock=3),
+        ])
+
+    def _names(self, params):
+        response = self.client.get(reverse('list_products'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['name'] for product in response.data['results']]
+
+    def test_search_matches_name_and_description_words(self):
+        self.assertEqual(self._names({"q": "mug"}), ["Blue Mug", "Red Mug"])
+        self.assertEqual(self._names({"q": "coffee"}), ["Blue Mug", "Coffee Beans"])
+        self.assertEqual(self._names({"q": "coffee mug"}), ["Blue Mug"])
+        self.assertEqual(self._names({"q": "tea"}), ["Teapot"])
+        self.assertEqual(self._names({"q": "!!"}), [])
+
+    def test_filters_and_only_listed_columns(self):
+        self.assertEqual(self._names({"price_min": 300, "price_max": 600}), ["Blue Mug", "Teapot"])
+        self.assertEqual(self._names({"q": "mug", "in_stock": "true"}), ["Blue Mug"])
+        self.assertEqual(self._names({"in_stock": "0"}), ["Red Mug"])
+
+        response = self.client.get(reverse('list_products'), {"q": "teapot"})
+        self.assertEqual(response.data['results'], [{
+            "id": self.products[3].id, "name": "Teapot", "price": Decimal('600'), "quantity_in_stock": 3,
+        }])
+
+    def test_keyset_pages_by_price_in_one_query(self):
+        self.client.get(reverse('list_products'))
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"page_size": 3, "sort": "price"}
+            if cursor:
+                params["cursor"] = cursor
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('list_products'), params)
+            seen.extend(product['name'] for product in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, ["Red Mug", "Blue Mug", "Teapot", "Coffee Beans"])
+
+    def test_invalid_parameters(self):
+        for params in ({"sort": "description"}, {"price_min": "abc"}, {"price_max": "-1"},
+                       {"in_stock": "maybe"}, {"page_size": 0}, {"cursor": "not-a-cursor"},
+                       {"q": "x" * 201}):
+            response = self.client.get(reverse('list_products'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+        self.client.credentials(HTTP_X_ACCESS_TOKEN="invalid")
+        response = self.client.get(reverse('list_products'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class PricingEngineTestCase(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.prices = {1: Decimal('100'), 2: Decimal('50'), 3: Decimal('30')}
+        self.lines = [(1, 2), (2, 1), (3, 1)]
+
+    def _rule(self, code, discount_type, value, product_ids, **extra):
+        fields = {
+            "applies_to": 'items',
+            "tiers": (),
+            "stackable": False,
+            "start_date": self.now - timedelta(days=1),
+            "end_date": self.now + timedelta(days=1),
+            **extra
+        }
+        return Rule(code, discount_type, Decimal(value), frozenset(product_ids), **fields)
+
+    def test_item_rule_discounts_only_eligible_lines(self):
+        priced = price_order(self.lines, self.prices, [self._rule("HALF", 'percent', 50, {2})], self.now)
+        self.assertEqual(priced.subtotal, 280)
+        self.assertEqual(priced.total, Decimal('255.00'))
+        self.assertEqual(priced.line_totals, [Decimal('200.00'), Decimal('25.00'), Decimal('30.00')])
+
+    def test_order_rule_requires_every_product(self):
+        rule = self._rule("ALL", 'fixed', 10, {1, 2}, applies_to='order')
+        self.assertEqual(price_order(self.lines, self.prices, [rule], self.now).applied_codes, [])
+
+        rule = self._rule("ALL", 'fixed', 10, {1, 2, 3}, applies_to='order')
+        priced = price_order(self.lines, self.prices, [rule], self.now)
+        self.assertEqual(priced.total, Decimal('270.00'))
+        self.assertEqual(sum(priced.line_totals), priced.total)
+
+    def test_tier_is_picked_by_eligible_subtotal(self):
+        tiers = ((Decimal('100'), Decimal('5')), (Decimal('200'), Decimal('10')))
+        rule = self._rule("TIER", 'percent', 0, {1}, tiers=tiers)
+        self.assertEqual(price_order(self.lines, self.prices, [rule], self.now).total, Decimal('260.00'))
+        self.assertEqual(price_order([(1, 1)], self.prices, [rule], self.now).total, Decimal('95.00'))
+        self.assertEqual(price_order([(2, 1)], self.prices, [rule], self.now).applied_codes, [])
+
+    def test_stackable_rules_compete_with_best_exclusive_rule(self):
+        exclusive = self._rule("BIG", 'fixed', 60, {1, 2, 3})
+        stacked = [
+            self._rule("A", 'percent', 10, {1, 2, 3}, stackable=True),
+            self._rule("B", 'fixed', 20, {1}, stackable=True),
+        ]
+        priced = price_order(self.lines, self.prices, [exclusive, *stacked], self.now)
+        self.assertEqual(priced.applied_codes, ["BIG"])
+        self.assertEqual(priced.total, Decimal('220.00'))
+
+        stacked[1] = self._rule("B", 'fixed', 50, {1}, stackable=True)
+        priced = price_order(self.lines, self.prices, [exclusive, *stacked], self.now)
+        self.assertEqual(priced.applied_codes, ["A", "B"])
+        self.assertEqual(priced.total, Decimal('202.00'))
+        self.assertEqual(priced.line_totals[0], Decimal('130.00'))
+
+    def test_expired_rules_are_ignored(self):
+        rule = self._rule("OLD", 'percent', 50, {1}, end_date=self.now - timedelta(seconds=1))
+        self.assertEqual(price_order(self.lines, self.prices, [rule], self.now).total, Decimal('280.00'))
+
+    def test_item_promo_through_import_order(self):
+        product = Product.objects.create(name="Eligible", price=100, quantity_in_stock=5)
+        other = Product.objects.create(name="Other", price=40, quantity_in_stock=5)
+        promo = PromotionCode.objects.create(
+            name="Item Sale",
+            code="ITEM20",
+            discount_type="percent",
+            value=20,
+            applies_to='items',
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        promo.products.add(product)
+
+        results = import_orders([{
+            "order_number": "ITEM1",
+            "promo_code": "ITEM20",
+            "products": [
+                {"product_id": product.id, "quantity": 1},
+                {"product_id": other.id, "quantity": 1}
+            ]
+        }])
+        self.assertEqual(results[0]['final_price'], Decimal('120.00'))
+        order = Order.objects.get(order_number="ITEM1")
+        self.assertEqual(order.calculate_total(save=False), Decimal('120.00'))
+
+    def test_malformed_tiers_are_rejected(self):
+        self.assertEqual(
+            parse_tiers([{"min_subtotal": 200, "value": "10"}, {"min_subtotal": "100", "value": 5}]),
+            ((Decimal('100'), Decimal('5')), (Decimal('200'), Decimal('10')))
+        )
+        for tiers in ({}, [{"min_subtotal": "100"}], [{"min_quantity": 1, "percent": 5}],
+                      [{"min_subtotal": "x", "value": "5"}], [{"min_subtotal": None, "value": "5"}],
+                      [{"min_subtotal": "100", "value": "-5"}], [{"min_subtotal": "NaN", "value": "5"}]):
+            with self.assertRaises(ValueError):
+                parse_tiers(tiers)
+
+        promo = PromotionCode(
+            name="Tier Sale", code="TIERBAD", discount_type="percent", value=0,
+            tiers=[{"min_subtotal": "100"}],
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        with self.assertRaises(ValidationError) as raised:
+            promo.full_clean()
+        self.assertIn('tiers', raised.exception.message_dict)
+
+    def test_malformed_tiers_only_fail_their_orders(self):
+        product = Product.objects.create(name="Eligible", price=100, quantity_in_stock=5)
+        promo = PromotionCode.objects.create(
+            name="Tier Sale",
+            code="TIERBAD",
+            discount_type="percent",
+            value=0,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        promo.products.add(product)
+        # 直接寫入資料庫，繞過 clean() 的檢查
+        PromotionCode.objects.filter(pk=promo.pk).update(tiers=[{"min_subtotal": "x", "value": 5}])
+        cache.clear()
+
+        results = import_orders([
+            {"order_number": "TIER1", "promo_code": "TIERBAD", "products": [{"product_id": product.id, "quantity": 1}]},
+            {"order_number": "TIER2", "products": [{"product_id": product.id, "quantity": 1}]},
+        ])
+        self.assertEqual([result['status'] for result in results], ['error', 'created'])
+        self.assertIn("Invalid or expired promo code", results[0]['detail'])
+        self.assertEqual(results[1]['final_price'], Decimal('100.00'))
+        self.assertEqual(Product.objects.get(pk=product.pk).quantity_in_stock, 4)
+
+    def test_bench_pricing_command(self):
+        out = StringIO()
+        call_command('bench_pricing', lines=200, promos=20, repeat=1, stdout=out)
+        self.assertIn("orders_per_s", json.loads(out.getvalue()))
+
+class PriceSnapshotTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.cheap = Product.objects.create(name="Cheap", price=30, quantity_in_stock=10)
+        self.pricey = Product.objects.create(name="Pricey", price=70, quantity_in_stock=10)
+        promo = PromotionCode.objects.create(
+            name="Snapshot Sale",
+            code="SNAP10",
+            discount_type="percent",
+            value=10,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        promo.products.add(self.cheap, self.pricey)
+
+    def _import(self, order_number, **extra):
+        data = {
+            "order_number": order_number,
+            "products": [
+                {"product_id": self.cheap.id, "quantity": 1},
+                {"product_id": self.pricey.id, "quantity": 2}
+            ],
+            **extra
+        }
+        response = self.client.post(reverse('import_order'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_line_items_snapshot_price_and_discounted_total(self):
+        self._import("SNAP1", promo_code="SNAP10")
+        lines = list(
+            OrderProduct.objects.filter(order__order_number="SNAP1")
+            .order_by('id').values_list('unit_price', 'line_total')
+        )
+        self.assertEqual(lines, [(30, Decimal('27.00')), (70, Decimal('126.00'))])
+
+        # 之後調價不影響歷史訂單
+        Product.objects.filter(pk=self.pricey.pk).update(price=1000)
+        response = self.client.get(reverse('order_detail', args=["SNAP1"]))
+        self.assertEqual(response.data['items'][1]['unit_price'], 70)
+
+    def test_sales_report_is_one_aggregate_query(self):
+        self._import("SNAP2")
+        self._import("SNAP3", promo_code="SNAP10")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('sales_report'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        revenue = {row['product_id']: row['revenue'] for row in response.data['results']}
+        quantity = {row['product_id']: row['quantity'] for row in response.data['results']}
+        self.assertEqual(revenue[self.cheap.id], Decimal('57.00'))
+        self.assertEqual(revenue[self.pricey.id], Decimal('266.00'))
+        self.assertEqual(quantity[self.pricey.id], 4)
+
+    def test_sales_report_rejects_bad_dates(self):
+        response = self.client.get(reverse('sales_report'), {"start": "2025-02-30"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class SalesRollupTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.product = Product.objects.create(name="Rollup Product", price=40, quantity_in_stock=100)
+        self.promo = PromotionCode.objects.create(
+            name="Rollup Sale",
+            code="ROLL25",
+            discount_type="percent",
+            value=25,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        self.promo.products.add(self.product)
+
+    def _import(self, order_number, quantity, **extra):
+        data = {
+            "order_number": order_number,
+            "products": [{"product_id": self.product.id, "quantity": quantity}],
+            **extra
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('import_order'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_imports_are_buffered_then_flushed_incrementally(self):
+        self._import("ROLL1", 1)
+        self._import("ROLL2", 2, promo_code="ROLL25")
+        self.assertFalse(ProductSalesRollup.objects.exists())
+
+        rollups.flush()
+        self._import("ROLL3", 1)
+        rollups.flush()
+
+        rollup = ProductSalesRollup.objects.get(product=self.product)
+        self.assertEqual(rollup.quantity, 4)
+        self.assertEqual(rollup.revenue, 140)
+        promo_rollup = PromoSalesRollup.objects.get(promo_code=self.promo)
+        self.assertEqual((promo_rollup.order_count, promo_rollup.revenue), (1, 60))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('hourly_product_sales'), {"product_id": self.product.id})
+        self.assertEqual(response.data['results'][0]['quantity'], 4)
+
+        response = self.client.get(reverse('hourly_promo_sales'), {"promo_code": "roll25"})
+        self.assertEqual(response.data['results'][0]['order_count'], 1)
+
+    def test_rebuild_rollups_matches_orders(self):
+        self._import("ROLL4", 3, promo_code="ROLL25")
+        rollups.flush()
+        # 只能重算已結束的時段，把訂單與彙總移到兩天前
+        two_days_ago = timezone.now() - timedelta(days=2)
+        hour = two_days_ago.replace(minute=0, second=0, microsecond=0)
+        Order.objects.filter(order_number="ROLL4").update(created_at=two_days_ago)
+        ProductSalesRollup.objects.update(hour=hour, quantity=999)
+        PromoSalesRollup.objects.update(hour=hour)
+
+        now = timezone.now()
+        call_command(
+            'rebuild_rollups',
+            start=(now - timedelta(days=3)).isoformat(),
+            end=(now - timedelta(days=1)).isoformat(),
+            chunk_hours=6,
+            workers=1,
+            stdout=StringIO()
+        )
+        rollup = ProductSalesRollup.objects.get(product=self.product)
+        self.assertEqual((rollup.hour, rollup.quantity, rollup.revenue), (hour, 3, 90))
+        self.assertEqual(PromoSalesRollup.objects.get(promo_code=self.promo).order_count, 1)
+
+    def test_hourly_product_sales_rejects_invalid_product_id(self):
+        for product_id in ('abc', '0', '1.5'):
+            response = self.client.get(reverse('hourly_product_sales'), {"product_id": product_id})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['detail'], "Invalid product_id")
+
+    def test_rebuild_rejects_hours_that_may_still_be_buffered(self):
+        with self.assertRaisesMessage(CommandError, "--end must not be after"):
+            call_command(
+                'rebuild_rollups',
+                start=(timezone.now() - timedelta(days=1)).isoformat(),
+                end=(timezone.now() + timedelta(hours=1)).isoformat(),
+                stdout=StringIO()
+            )
+
+    def test_rebuild_rejects_hours_with_archived_orders(self):
+        self._import("ROLL6", 2)
+        rollups.flush()
+        cold_at = timezone.now() - timedelta(days=10)
+        Order.objects.filter(order_number="ROLL6").update(created_at=cold_at)
+        OrderProduct.objects.filter(order__order_number="ROLL6").update(created_at=cold_at)
+        ProductSalesRollup.objects.update(hour=cold_at.replace(minute=0, second=0, microsecond=0))
+        call_command('archive_orders', before=(cold_at + timedelta(days=1)).isoformat(), stdout=StringIO())
+
+        with self.assertRaisesMessage(CommandError, "--start must not be before"):
+            call_command(
+                'rebuild_rollups',
+                start=(cold_at - timedelta(days=1)).isoformat(),
+                end=(timezone.now() - timedelta(days=1)).isoformat(),
+                stdout=StringIO()
+            )
+        self.assertEqual(ProductSalesRollup.objects.get(product=self.product).quantity, 2)
+
+        # 最新封存訂單之後的時段仍可重算
+        call_command(
+            'rebuild_rollups',
+            start=(cold_at + timedelta(hours=1)).isoformat(),
+            end=(timezone.now() - timedelta(days=1)).isoformat(),
+            workers=1,
+            stdout=StringIO()
+        )
+        self.assertEqual(ProductSalesRollup.objects.get(product=self.product).quantity, 2)
+
+    def test_rollup_hours_are_utc(self):
+        ordered_at = (timezone.now() - timedelta(days=3)).replace(minute=45, second=0, microsecond=0)
+        local = ordered_at.astimezone(timezone.get_fixed_timezone(330))
+        with self.captureOnCommitCallbacks(execute=True):
+            results = import_orders([{
+                "order_number": "ROLL7", "created_at": local.isoformat(),
+                "products": [{"product_id": self.product.id, "quantity": 1}],
+            }], backfill=True)
+        self.assertEqual(results[0]['status'], "created")
+        rollups.flush()
+
+        self.assertEqual(
+            ProductSalesRollup.objects.get(product=self.product).hour,
+            ordered_at.replace(minute=0)
+        )
+
+    def test_failed_flush_requeues_deltas(self):
+        self._import("ROLL5", 2)
+        with mock.patch.object(rollups, '_upsert', side_effect=IntegrityError("boom")):
+            with self.assertRaises(IntegrityError):
+                rollups.flush()
+        self.assertFalse(ProductSalesRollup.objects.exists())
+
+        rollups.flush()
+        self.assertEqual(ProductSalesRollup.objects.get(product=self.product).quantity, 2)
+
+class ImportOrdersCommandTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Backfill Product",
+            price=20,
+            quantity_in_stock=100
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_ndjson_in_chunks(self):
+        path = self._write("orders.ndjson", "\n".join(
+            json.dumps({
+                "order_number": f"NDJ{i}",
+                "products": [{"product_id": self.product.id, "quantity": 1}]
+            })
+            for i in range(5)
+        ))
+        call_command('import_orders', path, chunk_size=2, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(Order.objects.filter(order_number__startswith="NDJ").count(), 5)
+        with open(f"{path}.checkpoint") as f:
+            self.assertEqual(f.read(), f"5 {os.path.getsize(path)}")
+
+    def test_import_csv_groups_rows_by_order(self):
+        path = self._write("orders.csv", (
+            "order_number,product_id,quantity,promo_code\n"
+            f"CSV1,{self.product.id},2,\n"
+            f"CSV1,{self.product.id},1,\n"
+            f"CSV2,{self.product.id},1,\n"
+        ))
+        call_command('import_orders', path, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(Order.objects.get(order_number="CSV1").total_price, 60)
+        # 同一商品的多列合併為一個品項
+        self.assertEqual(
+            list(OrderProduct.objects.filter(order__order_number="CSV1").values_list('quantity', flat=True)), [3]
+        )
+        self.assertTrue(Order.objects.filter(order_number="CSV2").exists())
+
+    def test_backfill_keeps_original_created_at(self):
+        ordered_at = timezone.now() - timedelta(days=200)
+        # 優惠碼只在下單當時有效
+        promo = PromotionCode.objects.create(
+            name="Old Sale", code="OLD10", discount_type="percent", value=10,
+            start_date=ordered_at - timedelta(days=1), end_date=ordered_at + timedelta(days=1),
+        )
+        promo.products.add(self.product)
+        path = self._write("orders.csv", (
+            "order_number,product_id,quantity,promo_code,created_at\n"
+            f"HIST1,{self.product.id},5,OLD10,{ordered_at.isoformat()}\n"
+            f"HIST2,{self.product.id},1,,2999-01-01T00:00:00\n"
+        ))
+        err = StringIO()
+        call_command('import_orders', path, no_stock=True, stdout=StringIO(), stderr=err)
+
+        order = Order.objects.get(order_number="HIST1")
+        self.assertEqual(order.created_at, ordered_at)
+        self.assertEqual(order.total_price, 90)
+        self.assertEqual(
+            list(OrderProduct.objects.filter(order=order).values_list('created_at', flat=True)), [ordered_at]
+        )
+        self.assertIn("HIST2: Invalid created_at", err.getvalue())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 100)
+
+        # 線上匯入不接受自訂的 created_at
+        import_orders([{
+            "order_number": "LIVE1", "created_at": ordered_at.isoformat(),
+            "products": [{"product_id": self.product.id, "quantity": 1}],
+        }])
+        self.assertGreater(Order.objects.get(order_number="LIVE1").created_at, ordered_at)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 99)
+
+    def test_resume_from_checkpoint(self):
+        path = self._write("orders.ndjson", "\n".join(
+            json.dumps({
+                "order_number": f"RES{i}",
+                "products": [{"product_id": self.product.id, "quantity": 1}]
+            })
+            for i in range(3)
+        ))
+        # 舊版只記筆數的檢查點
+        self._write("orders.ndjson.checkpoint", "2")
+        call_command('import_orders', path, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(
+            list(Order.objects.filter(order_number__startswith="RES").values_list('order_number', flat=True)),
+            ["RES2"]
+        )
+
+    def test_resume_seeks_to_checkpoint_offset(self):
+        # 檢查點之前的內容不會再被讀取或解析
+        skipped = "not json\n"
+        path = self._write("orders.ndjson", skipped + json.dumps({
+            "order_number": "SEEK1", "products": [{"product_id": self.product.id, "quantity": 1}]
+        }) + "\n")
+        self._write("orders.ndjson.checkpoint", f"1 {len(skipped)}")
+        call_command('import_orders', path, stdout=StringIO(), stderr=StringIO())
+
+        self.assertTrue(Order.objects.filter(order_number="SEEK1").exists())
+        with open(f"{path}.checkpoint") as f:
+            self.assertEqual(f.read(), f"2 {os.path.getsize(path)}")
+
+    def test_resume_csv_after_appended_rows(self):
+        rows = (
+            "order_number,product_id,quantity,promo_code\n"
+            f"APP1,{self.product.id},1,\n"
+            f"APP1,{self.product.id},1,\n"
+            f"APP2,{self.product.id},1,\n"
+        )
+        path = self._write("orders.csv", rows)
+        call_command('import_orders', path, chunk_size=1, stdout=StringIO(), stderr=StringIO())
+        self._write("orders.csv", rows + f"APP3,{self.product.id},2,\n")
+
+        err = StringIO()
+        call_command('import_orders', path, stdout=StringIO(), stderr=err)
+        self.assertEqual(err.getvalue(), "")
+        self.assertEqual(
+            list(
+                Order.objects.filter(order_number__startswith="APP").order_by('id')
+                .values_list('order_number', 'total_price')
+            ),
+            [("APP1", 40), ("APP2", 20), ("APP3", 40)]
+        )
+
+class ArchiveOrdersCommandTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Archive Product", price=20, quantity_in_stock=100)
+        self.cold_at = timezone.now() - timedelta(days=400)
+        self.cold = []
+        for i in range(3):
+            order = Order.objects.create(order_number=f"COLD{i}", total_price=40)
+            OrderProduct.objects.create(
+                order=order, product=self.product, quantity=2, unit_price=20, line_total=40
+            )
+            self.cold.append(order)
+        Order.objects.filter(order_number__startswith="COLD").update(created_at=self.cold_at)
+        OrderProduct.objects.filter(order__in=self.cold).update(created_at=self.cold_at)
+        self.hot = Order.objects.create(order_number="HOT1", total_price=20)
+        OrderProduct.objects.create(order=self.hot, product=self.product, quantity=1, unit_price=20, line_total=20)
+        self.before = (timezone.now() - timedelta(days=30)).isoformat()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _assert_only_hot_orders_remain(self):
+        self.assertEqual(list(Order.objects.values_list('order_number', flat=True)), ["HOT1"])
+        self.assertEqual(list(OrderProduct.objects.values_list('order_id', flat=True)), [self.hot.id])
+
+    def test_archive_to_table(self):
+        out = StringIO()
+        call_command('archive_orders', before=self.before, batch_size=2, stdout=out)
+
+        self.assertIn("Archived 3 orders", out.getvalue())
+        self._assert_only_hot_orders_remain()
+        archived = ArchivedOrder.objects.get(id=self.cold[0].id)
+        self.assertEqual(archived.order_number, "COLD0")
+        self.assertEqual(archived.total_price, 40)
+        self.assertEqual(archived.created_at, self.cold_at)
+        self.assertEqual(archived.items, [[self.product.id, 2, "20", "40.00"]])
+
+        # 重跑不會重複封存
+        call_command('archive_orders', before=self.before, stdout=StringIO())
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+
+    def test_archive_to_ndjson(self):
+        path = os.path.join(self.tmpdir.name, "orders.ndjson.gz")
+        call_command('archive_orders', before=self.before, format='ndjson', output=path, stdout=StringIO())
+
+        with gzip.open(path, 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row['order_number'] for row in rows], ["COLD0", "COLD1", "COLD2"])
+        self.assertEqual(
+            rows[0]['items'],
+            [{"product_id": self.product.id, "quantity": 2, "unit_price": "20", "line_total": "40.00"}]
+        )
+        self.assertFalse(os.path.exists(f"{path}.partial"))
+        # 封存表只留下單號與冪等鍵，品項在檔案中
+        self.assertEqual(
+            list(ArchivedOrder.objects.order_by('id').values_list('order_number', 'items', 'archive_file')),
+            [("COLD0", [], path), ("COLD1", [], path), ("COLD2", [], path)]
+        )
+        self._assert_only_hot_orders_remain()
+
+    def test_archived_keys_cannot_be_imported_again(self):
+        Order.objects.filter(id=self.cold[0].id).update(idempotency_key="cold-key")
+        call_command('archive_orders', before=self.before, stdout=StringIO())
+        lines = [{"product_id": self.product.id, "quantity": 1}]
+
+        results = import_orders([
+            {"order_number": "COLD1", "products": lines},
+            {"order_number": "NEW1", "idempotency_key": "cold-key", "products": lines},
+        ])
+        self.assertEqual(
+            [result['detail'] for result in results],
+            ["Order number already exists", "Idempotency key already used"]
+        )
+        self.assertFalse(Order.objects.filter(order_number__in=["COLD1", "NEW1"]).exists())
+
+        # 以封存訂單的冪等鍵重送，仍回放原本的結果
+        replay = self.client.post(
+            reverse('import_order'), {"order_number": "NEW1", "products": lines},
+            content_type='application/json',
+            headers={'X-Access-Token': 'omni_pretest_token', 'Idempotency-Key': "cold-key"},
+        )
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json()['final_price'], 40)
+        self.assertFalse(Order.objects.filter(order_number="NEW1").exists())
+
+    def test_file_formats_need_output(self):
+        with self.assertRaisesMessage(CommandError, "needs an output path"):
+            call_command('archive_orders', before=self.before, format='ndjson', stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 4)
+
+    @skipUnless(connection.vendor != 'postgresql', "Partitioning is supported on PostgreSQL")
+    def test_partitioning_needs_postgresql(self):
+        with self.assertRaisesMessage(CommandError, "needs PostgreSQL"):
+            call_command('partition_orders', 'enable', stdout=StringIO())
+        out = StringIO()
+        call_command('partition_orders', 'status', stdout=out)
+        self.assertIn("not partitioned", out.getvalue())
+
+
+class PromotionCacheTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Cached Product", price=100)
+        self.other = Product.objects.create(name="Other Product", price=100)
+        self.promo = PromotionCode.objects.create(
+            name="Cached Sale",
+            code="CACHE10",
+            discount_type="percent",
+            value=10,
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1)
+        )
+        self.promo.products.add(self.product)
+
+    def test_snapshot_is_served_without_queries(self):
+        snapshot = get_promotion("CACHE10")
+        self.assertEqual(snapshot.product_ids, {self.product.id})
+
+        with self.assertNumQueries(0):
+            snapshot = get_promotion("CACHE10")
+        self.assertTrue(snapshot.is_valid("CACHE10"))
+        self.assertEqual(snapshot.apply_discount(200), 180)
+
+    def test_changes_invalidate_snapshot(self):
+        get_promotion("CACHE10")
+
+        self.promo.products.add(self.other)
+        self.assertEqual(get_promotion("CACHE10").product_ids, {self.product.id, self.other.id})
+
+        self.other.promotions.remove(self.promo)
+        self.assertEqual(get_promotion("CACHE10").product_ids, {self.product.id})
+
+        self.promo.value = 50
+        self.promo.save()
+        self.assertEqual(get_promotion("CACHE10").value, 50)
+
+        self.promo.code = "CACHE50"
+        self.promo.save()
+        self.assertIsNone(get_promotion("CACHE10"))
+
+        self.promo.delete()
+        self.assertIsNone(get_promotion("CACHE50"))
+
+    def test_snapshot_cached_before_commit_is_dropped_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.promo.value = 30
+            self.promo.save()
+            # 另一個連線在提交前讀到舊資料並寫回快取
+            stale = get_promotion("CACHE10")
+            stale.value = 10
+            cache.set("promo:cache10", stale)
+        self.assertEqual(get_promotion("CACHE10").value, 30)
+
+class ProductCacheTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Cached Product", price=100, quantity_in_stock=10)
+        self.other = Product.objects.create(name="Other Product", price=50, quantity_in_stock=10)
+
+    def test_snapshots_are_served_without_queries(self):
+        snapshots = get_products([self.product.id, self.other.id, 99999])
+        self.assertEqual(snapshots[self.product.id].price, 100)
+        self.assertNotIn(99999, snapshots)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_product(self.other.id).name, "Other Product")
+
+        # 清掉本機層後仍由共用快取回答
+        _local_products.clear()
+        local = registry.value('api_product_cache_lookups_total', (('result', 'shared'),))
+        with self.assertNumQueries(0):
+            get_products([self.product.id, self.other.id])
+        self.assertEqual(registry.value('api_product_cache_lookups_total', (('result', 'shared'),)), local + 2)
+
+    def test_writes_invalidate_snapshot(self):
+        get_products([self.product.id, self.other.id])
+
+        self.product.price = 120
+        self.product.save()
+        self.assertEqual(get_product(self.product.id).price, 120)
+
+        self.product.adjust_stock(3)
+        self.assertEqual(get_product(self.product.id).quantity_in_stock, 7)
+
+        self.product.restock(5)
+        self.assertEqual(get_product(self.product.id).quantity_in_stock, 12)
+
+        restock_products({self.other.id: 5})
+        self.assertEqual(get_product(self.other.id).quantity_in_stock, 15)
+
+        self.other.price = 70
+        Product.objects.bulk_update([self.other], ['price'])
+        self.assertEqual(get_product(self.other.id).price, 70)
+
+        self.other.delete()
+        self.assertIsNone(get_product(self.other.id))
+
+    def test_snapshot_cached_under_old_version_is_not_served(self):
+        get_product(self.product.id)
+        stale_version = cache.get(f"product-version:{self.product.id}")
+        Product.objects.filter(pk=self.product.pk).update(price=300)
+        invalidate_products([self.product.id])
+        # 失效前開始的讀取把舊資料寫回舊版本的鍵
+        cache.set(f"product:{self.product.id}:{stale_version}", get_product(self.product.id)._replace(price=100))
+        _local_products.clear()
+        self.assertEqual(get_product(self.product.id).price, 300)
+
+    def test_import_resolves_prices_from_cache(self):
+        def import_queries(order_number):
+            with CaptureQueriesContext(connection) as ctx:
+                results = import_orders([{
+                    "order_number": order_number,
+                    "products": [{"product_id": self.product.id, "quantity": 1}],
+                }])
+            self.assertEqual(results[0]['final_price'], 100)
+            return len(ctx.captured_queries)
+
+        invalidate_products([self.product.id])
+        self.assertEqual(import_queries("CACHE_COLD"), import_queries("CACHE_WARM") + 1)
+
+        order = Order.objects.get(order_number="CACHE_WARM")
+        with self.assertNumQueries(1):
+            self.assertEqual(order.calculate_total(save=False), 100)
+
+class PromotionCodeIndexTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        PromotionCode.objects.bulk_create([
+            PromotionCode(
+                name=f"Promo {i}",
+                code=f"Code{i:05d}",
+                discount_type="fixed",
+                value=1,
+                start_date=now,
+                end_date=now + timedelta(days=1)
+            )
+            for i in range(5000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE "api_promotioncode"')
+
+    def test_codes_are_unique_ignoring_case(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PromotionCode.objects.create(
+                name="Duplicate",
+                code="CODE00001",
+                discount_type="fixed",
+                value=1,
+                start_date=timezone.now(),
+                end_date=timezone.now()
+            )
+
+    def test_case_insensitive_lookup_uses_index(self):
+        queryset = PromotionCode.objects.filter_codes(["code04321"])
+        self.assertEqual([promo.code for promo in queryset], ["Code04321"])
+        self.assertIn("promotioncode_code_lower_uniq", queryset.explain())
+
+class AsyncViewsTestCase(TestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Async Product",
+            price=30,
+            quantity_in_stock=10
+        )
+
+    async def test_async_import_order(self):
+        data = {
+            "order_number": "ASYNC1",
+            "products": [{"product_id": self.product.id, "quantity": 2}]
+        }
+        response = await self.async_client.post(
+            reverse('import_order_async'), data, content_type='application/json',
+            headers={'X-Access-Token': self.ACCEPTED_TOKEN}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['final_price'], 60)
+
+        replay = await self.async_client.post(
+            reverse('import_order_async'), data, content_type='application/json',
+            headers={'X-Access-Token': self.ACCEPTED_TOKEN}
+        )
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+        product = await Product.objects.aget(pk=self.product.pk)
+        self.assertEqual(product.quantity_in_stock, 8)
+
+    async def test_async_replay_by_idempotency_key_in_body(self):
+        data = {
+            "order_number": "ASYNC_BODY_KEY",
+            "idempotency_key": "async-body-key",
+            "products": [{"product_id": self.product.id, "quantity": 1}]
+        }
+        for order_number in ("ASYNC_BODY_KEY", "ASYNC_BODY_KEY_RETRY"):
+            response = await self.async_client.post(
+                reverse('import_order_async'), {**data, "order_number": order_number},
+                content_type='application/json', headers={'X-Access-Token': self.ACCEPTED_TOKEN}
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertFalse(await Order.objects.filter(order_number="ASYNC_BODY_KEY_RETRY").aexists())
+
+    async def test_async_import_order_requires_token(self):
+        response = await self.async_client.post(
+            reverse('import_order_async'),
+            {"order_number": "ASYNC2"},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Invalid or missing access token", response.json()['detail'])
+
+    async def test_async_restock(self):
+        url = reverse('restock_product_async', args=[self.product.id])
+        response = await self.async_client.post(url, {"quantity": 5}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("restocked", response.json()['detail'])
+
+        product = await Product.objects.aget(pk=self.product.pk)
+        self.assertEqual(product.quantity_in_stock, 15)
+
+        response = await self.async_client.post(url, {"quantity": 0}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class ApiTokenTestCase(APITestCase):
+    def setUp(self):
+        self.url = reverse('import_order')
+        self.key = ApiToken.issue("warehouse")
+        self.product = Product.objects.create(
+            name="Token Product",
+            price=10,
+            quantity_in_stock=10
+        )
+        self.data = {
+            "order_number": "ORD_TOKEN",
+            "products": [{"product_id": self.product.id, "quantity": 1}]
+        }
+
+    def test_issued_token_accepted_in_authorization_header(self):
+        response = self.client.post(
+            self.url, self.data, format='json', HTTP_AUTHORIZATION=f"Token {self.key}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_token_in_body_is_ignored(self):
+        response = self.client.post(self.url, {**self.data, "access_token": self.key}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_revoked_token_is_rejected(self):
+        ApiToken.objects.get(name="warehouse").revoke()
+        response = self.client.post(self.url, self.data, format='json', HTTP_X_ACCESS_TOKEN=self.key)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unauthorized_request_body_is_not_read(self):
+        request = APIRequestFactory().post(
+            self.url, {**self.data, "padding": "x" * 100000}, format='json',
+            HTTP_X_ACCESS_TOKEN="invalid"
+        )
+        response = import_order(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(request._read_started)
+
+@skipUnless(connection.vendor == 'postgresql', "row locking needs PostgreSQL")
+class ConcurrentStockReservationTestCase(TransactionTestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Flash Sale Product",
+            price=10,
+            quantity_in_stock=20
+        )
+
+    def test_concurrent_reservations_never_oversell(self):
+        results = []
+
+        def buy():
+            try:
+                Product.objects.reserve_stock({self.product.id: 3})
+                results.append(True)
+            except InsufficientStock:
+                results.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        self.assertEqual(results.count(True), 6)
+        self.assertEqual(self.product.quantity_in_stock, 2)
+
+class StockShardTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Hot Product", price=10, quantity_in_stock=10)
+        self.product.enable_sharding(4)
+
+    def _shards(self):
+        return list(self.product.stock_shards.order_by('shard').values_list('quantity', flat=True))
+
+    def test_enable_sharding_splits_stock(self):
+        self.assertEqual(self._shards(), [3, 3, 2, 2])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 10)
+
+    def test_import_reserves_from_shards_and_consolidate_stores_sum(self):
+        results = import_orders([
+            {"order_number": f"HOT{i}", "products": [{"product_id": self.product.id, "quantity": 2}]}
+            for i in range(6)
+        ])
+        self.assertEqual([result['status'] for result in results], ['created'] * 5 + ['error'])
+        self.assertIn(f"Insufficient stock for product {self.product.id}", results[5]['detail'])
+        self.assertEqual(sum(self._shards()), 0)
+
+        self.product.restock(7)
+        self.assertEqual(self.product.quantity_in_stock, 7)
+        StockShard.objects.filter(product=self.product, shard=0).update(quantity=0)
+        self.assertEqual(StockShard.objects.consolidate(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 5)
+        self.assertEqual(self._shards(), [2, 1, 1, 1])
+
+    def test_reserve_spans_shards_when_no_single_shard_suffices(self):
+        Product.objects.reserve_stock({self.product.id: 7})
+        self.assertEqual(sum(self._shards()), 3)
+        with self.assertRaises(InsufficientStock):
+            Product.objects.reserve_stock({self.product.id: 4})
+        self.assertEqual(sum(self._shards()), 3)
+
+    def test_adjust_stock_and_bulk_restock_keep_sum(self):
+        self.product.adjust_stock(12)
+        self.assertEqual(self.product.quantity_in_stock, 0)
+        self.assertEqual(self._shards(), [0, 0, 0, 0])
+
+        restock_products({self.product.id: 6})
+        self.assertEqual(self._shards(), [2, 2, 1, 1])
+
+        self.product.disable_sharding()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity_in_stock, self.product.shard_count), (6, 0))
+        self.assertFalse(StockShard.objects.exists())
+
+    def test_stock_shards_command(self):
+        out = StringIO()
+        call_command('stock_shards', 'enable', str(self.product.id), '--shards', '2', stdout=out)
+        self.assertEqual(self._shards(), [5, 5])
+        call_command('stock_shards', 'consolidate', stdout=out)
+        self.assertIn("Consolidated 1 sharded products", out.getvalue())
+
+@skipUnless(connection.vendor == 'postgresql', "Row-level locking needs PostgreSQL")
+class ConcurrentShardedStockTestCase(TransactionTestCase):
+    def test_concurrent_sharded_reservations_never_oversell(self):
+        product = Product.objects.create(name="Sharded Flash Sale", price=10, quantity_in_stock=20)
+        product.enable_sharding(4)
+        results = []
+
+        def buy():
+            try:
+                Product.objects.reserve_stock({product.id: 3})
+                results.append(True)
+            except InsufficientStock:
+                results.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 6)
+        self.assertEqual(StockShard.objects.consolidate(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity_in_stock, 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', "Partitioning needs PostgreSQL")
+class PartitionedOrdersTestCase(TransactionTestCase):
+    def setUp(self):
+        self.addCleanup(self._restore_unpartitioned_tables)
+        self.product = Product.objects.create(name="Partitioned Product", price=10, quantity_in_stock=100)
+        self.now = timezone.now()
+        self.cold_at = self.now - timedelta(days=90)
+        self.cold = self._order("PART-COLD", self.cold_at, "cold-key")
+
+        partitions.enable(months_ahead=1)
+        self.hot = self._order("PART-HOT", self.now, "hot-key")
+
+    def _order(self, order_number, created_at, idempotency_key=None):
+        order = Order.objects.create(
+            order_number=order_number, idempotency_key=idempotency_key, total_price=10, created_at=created_at
+        )
+        OrderProduct.objects.create(
+            order=order, product=self.product, quantity=1, unit_price=10, line_total=10, created_at=created_at
+        )
+        return order
+
+    def _restore_unpartitioned_tables(self):
+        # 分區版面無法以 migration 還原，直接重建成一般資料表，讓其他測試不受影響
+        partitions._enabled = None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DROP TABLE IF EXISTS api_orderproduct, api_order, "
+                f"{partitions.ORDER_NUMBER_TABLE}, {partitions.IDEMPOTENCY_KEY_TABLE} CASCADE"
+            )
+            cursor.execute("DROP FUNCTION IF EXISTS api_order_register_keys()")
+        with connection.schema_editor() as editor:
+            editor.create_model(Order)
+            editor.create_model(OrderProduct)
+
+    def test_orders_land_in_monthly_partitions(self):
+        self.assertTrue(partitions.is_partitioned())
+        month = partitions.month_start(self.now)
+        self.assertEqual(
+            [name for name, _ in partitions.partitions(Order)],
+            ["api_order_legacy", f"api_order_p{month:%Y%m}", f"api_order_p{partitions.next_month(month):%Y%m}"]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT order_number FROM api_order_p{month:%Y%m}")
+            self.assertEqual(cursor.fetchall(), [("PART-HOT",)])
+            cursor.execute("SELECT order_number FROM api_order_legacy")
+            self.assertEqual(cursor.fetchall(), [("PART-COLD",)])
+
+    def test_keys_stay_unique_across_partitions(self):
+        for order_number, idempotency_key in (("PART-COLD", None), ("PART-NEW", "cold-key")):
+            with self.subTest(order_number=order_number), self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    Order.objects.create(
+                        order_number=order_number, idempotency_key=idempotency_key, created_at=self.now
+                    )
+
+        results = import_orders([
+            {"order_number": "PART-HOT", "products": [{"product_id": self.product.id, "quantity": 1}]},
+            {"order_number": "PART-NEW", "idempotency_key": "cold-key",
+             "products": [{"product_id": self.product.id, "quantity": 1}]},
+        ])
+        self.assertEqual(
+            [result['detail'] for result in results],
+            ["Order number already exists", "Idempotency key already used"]
+        )
+
+    def test_archive_drops_only_cold_partitions(self):
+        before = partitions.month_start(self.now)
+        out = StringIO()
+        call_command('archive_orders', before=before.isoformat(), stdout=out)
+
+        self.assertIn("Archived 1 orders", out.getvalue())
+        self.assertIn("Dropped partitions: api_order_legacy, api_orderproduct_legacy", out.getvalue())
+        self.assertEqual(list(ArchivedOrder.objects.values_list('order_number', flat=True)), ["PART-COLD"])
+        self.assertEqual(list(Order.objects.values_list('order_number', flat=True)), ["PART-HOT"])
+        self.assertEqual(list(OrderProduct.objects.values_list('order_id', flat=True)), [self.hot.id])
+        self.assertEqual(
+            [name for name, _ in partitions.partitions(OrderProduct)],
+            [f"api_orderproduct_p{before:%Y%m}", f"api_orderproduct_p{partitions.next_month(before):%Y%m}"]
+        )
+
+        # 封存後單號與冪等鍵仍登記為已使用
+        results = import_orders([{
+            "order_number": "PART-COLD", "products": [{"product_id": self.product.id, "quantity": 1}]
+        }])
+        self.assertEqual(results[0]['detail'], "Order number already exists")
+
 class RestockProductTestCase(APITestCase):
     def setUp(self):
         self.product = Product.objects.create(
@@ -170,6 +2001,83 @@ class RestockProductTestCase(APITestCase):
 
         self.product.refresh_from_db()
         self.assertEqual(self.product.quantity_in_stock, initial_stock + 10)
+        self.assertEqual(
+            list(self.product.stock_movements.values_list('quantity', 'reason')),
+            [(10, StockMovement.RESTOCK)]
+        )
+
+
+class BulkRestockTestCase(APITestCase):
+    ACCEPTED_TOKEN = 'omni_pretest_token'
+
+    def setUp(self):
+        self.url = reverse('restock_products_bulk')
+        self.client.credentials(HTTP_X_ACCESS_TOKEN=self.ACCEPTED_TOKEN)
+        self.products = Product.objects.bulk_create([
+            Product(name=f"SKU {i}", price=1, quantity_in_stock=i)
+            for i in range(50)
+        ])
+
+    def test_bulk_restock_uses_set_based_updates(self):
+        items = [{"product_id": product.id, "quantity": 5} for product in self.products]
+        items.append({"product_id": self.products[0].id, "quantity": 1})
+        items.append({"product_id": 999999, "quantity": 1})
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, {"items": items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['restocked'], 50)
+        self.assertEqual(response.data['missing'], [999999])
+
+        updates = [query for query in ctx.captured_queries if 'UPDATE "api_product"' in query['sql']]
+        self.assertEqual(len(updates), 1)
+
+        stock = dict(Product.objects.values_list('id', 'quantity_in_stock'))
+        self.assertEqual(stock[self.products[0].id], 6)
+        self.assertEqual(stock[self.products[49].id], 54)
+        self.assertEqual(StockMovement.objects.count(), 50)
+
+    def test_bulk_restock_rejects_invalid_quantity(self):
+        items = [{"product_id": self.products[0].id, "quantity": -3}]
+        response = self.client.post(self.url, {"items": items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_bulk_restock_rejects_invalid_product_id(self):
+        for product_id in [1e+20, "7", True, 0, 2 ** 63]:
+            with self.subTest(product_id=product_id):
+                items = [{"product_id": product_id, "quantity": 1}]
+                response = self.client.post(self.url, {"items": items}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(response.data['detail'], f"Invalid product_id {product_id}")
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_restock_products_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write("product_id,quantity\n")
+            for product in self.products[:3]:
+                f.write(f"{product.id},7\n")
+        self.addCleanup(os.remove, f.name)
+
+        call_command('restock_products', f.name, chunk_size=2, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(
+            list(Product.objects.filter(id__in=[p.id for p in self.products[:3]])
+                 .order_by('id').values_list('quantity_in_stock', flat=True)),
+            [7, 8, 9]
+        )
+
+    def test_restock_products_command_checks_whole_file_first(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write("product_id,quantity\n")
+            f.write(f"{self.products[0].id},5\n")
+            f.write(f"{self.products[1].id},oops\n")
+            f.write(f"{self.products[2].id},5\n")
+        self.addCleanup(os.remove, f.name)
+
+        with self.assertRaisesMessage(CommandError, ":3: invalid row"):
+            call_command('restock_products', f.name, chunk_size=1, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Product.objects.get(id=self.products[0].id).quantity_in_stock, 0)
+        self.assertFalse(StockMovement.objects.exists())
 
 
 # class PromotionCodeTestCase(APITestCase):
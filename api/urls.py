@@ -1,7 +1,22 @@
 from django.urls import path
-from api.views import import_order, restock_product
+from api.async_views import import_order_async, restock_product_async
+from api.views import (
+    hourly_product_sales, hourly_promo_sales, import_job_detail, import_order, import_orders_bulk, list_orders, list_products, order_detail, restock_product, restock_products_bulk,
+    sales_report,
+)
 
 urlpatterns = [
     path('import-order/', import_order, name='import_order'),
+    path('import-orders/bulk/', import_orders_bulk, name='import_orders_bulk'),
+    path('import-jobs/<int:job_id>/', import_job_detail, name='import_job_detail'),
+    path('orders/', list_orders, name='list_orders'),
+    path('orders/<str:order_number>/', order_detail, name='order_detail'),
+    path('products/', list_products, name='list_products'),
     path('products/<int:product_id>/restock/', restock_product, name='restock_product'),
+    path('products/restock/bulk/', restock_products_bulk, name='restock_products_bulk'),
+    path('reports/sales/', sales_report, name='sales_report'),
+    path('reports/hourly/products/', hourly_product_sales, name='hourly_product_sales'),
+    path('reports/hourly/promos/', hourly_promo_sales, name='hourly_promo_sales'),
+    path('async/import-order/', import_order_async, name='import_order_async'),
+    path('async/products/<int:product_id>/restock/', restock_product_async, name='restock_product_async'),
 ]
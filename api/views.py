@@ -1,69 +1,129 @@
-from rest_framework.decorators import api_view
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError
+from django.db.models import Prefetch
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.decorators import api_view, parser_classes
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Order, Product, OrderProduct, PromotionCode
+from .models import Order, OrderImportJob, OrderProduct, Product, ProductSalesRollup, PromoSalesRollup
+from .caches import get_promotion
 from .decorators import validate_access_token
+from .jobs import enqueue_order, job_status
+from .metrics import phase
+from .pagination import InvalidCursor, keyset_page
+from .parsers import FastJSONParser, NDJSONParser
+from .services import (
+    MAX_PRODUCT_ID, OrderImportError, RestockError, find_imported_order, import_orders, import_orders_retrying,
+    parse_restock_items, restock_products, sales_by_product_day, search_products,
+)
+
+def _replay_response(order):
+    response = Response(
+        {
+            "detail": "Order created successfully",
+            "final_price": order.total_price
+        },
+        status=status.HTTP_201_CREATED
+    )
+    response['Idempotent-Replayed'] = 'true'
+    return response
 
 @api_view(['POST'])
 @validate_access_token
 def import_order(request):
-    order_number = request.data.get('order_number')
-    promo_code_str = request.data.get('promo_code')  
-    products_data = request.data.get('products', [])
+    with phase('parse'):
+        payload = request.data
+    if not isinstance(payload, dict):
+        return Response({"detail": "Missing required fields"}, status=status.HTTP_400_BAD_REQUEST)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        payload = {**payload, 'idempotency_key': idempotency_key}
+    # 冪等鍵也可以放在 body 中，標頭優先
+    idempotency_key = payload.get('idempotency_key')
+
+    # 重送的請求直接回傳原本的結果，不重新計價或扣庫存
+    previous = find_imported_order(payload.get('order_number'), idempotency_key)
+    if previous:
+        return _replay_response(previous)
 
-    if not order_number or not products_data:
+    if _wants_queued(request):
+        return _enqueue(payload)
+
+    try:
+        result = import_orders([payload])[0]
+    except IntegrityError:
+        previous = find_imported_order(payload.get('order_number'), idempotency_key)
+        if previous is None:
+            raise
+        return _replay_response(previous)
+
+    if result['status'] != 'created':
         return Response(
-            {"detail": "Missing required fields"},
+            {"detail": result['detail']},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    order = Order.objects.create(order_number=order_number)
-
-    if promo_code_str:
-        try:
-            promo = PromotionCode.objects.get(code=promo_code_str)
-            if promo.is_valid(promo_code_str):
-                order.promo_code = promo
-                order.save()
-            else:
-                return Response(
-                    {"detail": "Invalid or expired promo code"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        except PromotionCode.DoesNotExist:
-            return Response(
-                {"detail": "Promo code not found"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-    for item in products_data:
-        product_id = item.get('product_id')
-        quantity = item.get('quantity', 1)
-
-        try:
-            product = Product.objects.get(id=product_id)
-        except Product.DoesNotExist:
-            return Response(
-                {"detail": f"Product with id {product_id} not found"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        OrderProduct.objects.create(
-            order=order,
-            product=product,
-            quantity=quantity
-        )
+    return Response(
+        {
+            "detail": result['detail'],
+            "final_price": result['final_price']
+        },
+        status=status.HTTP_201_CREATED
+    )
+
+def _wants_queued(request):
+    return (
+        request.query_params.get('mode') == 'queued'
+        or 'respond-async' in request.headers.get('Prefer', '')
+    )
 
-    order.calculate_total()
+def _enqueue(payload):
+    try:
+        job = enqueue_order(payload)
+    except OrderImportError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = Response(job_status(job), status=status.HTTP_202_ACCEPTED)
+    response['Location'] = reverse('import_job_detail', args=[job.id])
+    return response
 
-    order.update_stock()
+@api_view(['GET'])
+@validate_access_token
+def import_job_detail(request, job_id):
+    try:
+        job = OrderImportJob.objects.get(id=job_id)
+    except OrderImportJob.DoesNotExist:
+        return Response({"detail": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(job_status(job), status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@parser_classes([FastJSONParser, NDJSONParser])
+@validate_access_token
+def import_orders_bulk(request):
+    with phase('parse'):
+        orders_data = request.data
+    if isinstance(orders_data, dict):
+        orders_data = orders_data.get('orders')
 
+    if not orders_data or not isinstance(orders_data, list):
+        return Response(
+            {"detail": "Missing required fields"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = import_orders_retrying(orders_data)
+    created = sum(1 for result in results if result['status'] == 'created')
     return Response(
         {
-            "detail": "Order created successfully",
-            "final_price": order.total_price
+            "created": created,
+            "failed": len(results) - created,
+            "results": results
         },
-        status=status.HTTP_201_CREATED
+        status=status.HTTP_200_OK
     )
 
 @api_view(['POST'])
@@ -80,3 +140,256 @@ def restock_product(request, product_id):
 
     product.restock(quantity)
     return Response({"detail": f"{product.name} restocked by {quantity}"}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@parser_classes([FastJSONParser, NDJSONParser])
+@validate_access_token
+def restock_products_bulk(request):
+    items_data = request.data
+    if isinstance(items_data, dict):
+        items_data = items_data.get('items')
+
+    if not items_data or not isinstance(items_data, list):
+        return Response({"detail": "Missing required fields"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        deltas = parse_restock_items(items_data)
+    except RestockError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    missing_ids = restock_products(deltas)
+    return Response(
+        {
+            "restocked": len(deltas) - len(missing_ids),
+            "missing": missing_ids
+        },
+        status=status.HTTP_200_OK
+    )
+
+ORDER_PAGE_SIZE = 50
+MAX_ORDER_PAGE_SIZE = 200
+
+def _orders_with_items():
+    return Order.objects.select_related('promo_code').prefetch_related(
+        Prefetch(
+            'orderproduct_set',
+            queryset=OrderProduct.objects.select_related('product').only(
+                'order_id', 'quantity', 'unit_price', 'line_total', 'product__id', 'product__name'
+            ).order_by('id')
+        )
+    )
+
+def _serialize_order(order):
+    promo = order.promo_code
+    return {
+        "order_number": order.order_number,
+        "total_price": order.total_price,
+        "created_at": order.created_at,
+        "promo_code": {"code": promo.code, "name": promo.name} if promo else None,
+        "items": [
+            {
+                "product_id": item.product.id,
+                "product_name": item.product.name,
+                "quantity": item.quantity,
+                "unit_price": item.unit_price,
+                "line_total": item.line_total
+            }
+            for item in order.orderproduct_set.all()
+        ]
+    }
+
+@api_view(['GET'])
+@validate_access_token
+def list_orders(request):
+    try:
+        page_size = min(int(request.query_params.get('page_size', ORDER_PAGE_SIZE)), MAX_ORDER_PAGE_SIZE)
+    except ValueError:
+        page_size = 0
+    if page_size < 1:
+        return Response({"detail": "Invalid page_size"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        orders, next_cursor = keyset_page(
+            _orders_with_items(),
+            ('created_at', 'id'),
+            cursor=request.query_params.get('cursor'),
+            page_size=page_size
+        )
+    except InvalidCursor as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            "results": [_serialize_order(order) for order in orders],
+            "next_cursor": next_cursor
+        },
+        status=status.HTTP_200_OK
+    )
+
+@api_view(['GET'])
+@validate_access_token
+def order_detail(request, order_number):
+    order = _orders_with_items().filter(order_number=order_number).first()
+    if order is None:
+        return Response({"detail": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(_serialize_order(order), status=status.HTTP_200_OK)
+
+PRODUCT_PAGE_SIZE = 50
+MAX_PRODUCT_PAGE_SIZE = 200
+PRODUCT_SORT_FIELDS = ('id', 'name', 'price')
+MAX_PRODUCT_QUERY_LENGTH = 200
+
+@api_view(['GET'])
+@validate_access_token
+def list_products(request):
+    params = request.query_params
+    try:
+        page_size = min(int(params.get('page_size', PRODUCT_PAGE_SIZE)), MAX_PRODUCT_PAGE_SIZE)
+    except ValueError:
+        page_size = 0
+    if page_size < 1:
+        return Response({"detail": "Invalid page_size"}, status=status.HTTP_400_BAD_REQUEST)
+
+    sort = params.get('sort', 'id')
+    if sort not in PRODUCT_SORT_FIELDS:
+        return Response({"detail": "Invalid sort"}, status=status.HTTP_400_BAD_REQUEST)
+
+    query = params.get('q', '').strip()
+    if len(query) > MAX_PRODUCT_QUERY_LENGTH:
+        return Response({"detail": "Search query too long"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        price_min = _query_price(request, 'price_min')
+        price_max = _query_price(request, 'price_max')
+    except ValueError:
+        return Response({"detail": "Invalid price"}, status=status.HTTP_400_BAD_REQUEST)
+
+    in_stock = params.get('in_stock')
+    if in_stock is not None:
+        if in_stock not in ('true', 'false', '1', '0'):
+            return Response({"detail": "Invalid in_stock"}, status=status.HTTP_400_BAD_REQUEST)
+        in_stock = in_stock in ('true', '1')
+
+    try:
+        products, next_cursor = keyset_page(
+            search_products(query, price_min, price_max, in_stock),
+            (sort, 'id'),
+            cursor=params.get('cursor'),
+            page_size=page_size,
+            descending=False
+        )
+    except InvalidCursor as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            "results": products,
+            "next_cursor": next_cursor
+        },
+        status=status.HTTP_200_OK
+    )
+
+SALES_REPORT_DEFAULT_DAYS = 30
+SALES_REPORT_MAX_DAYS = 366
+
+@api_view(['GET'])
+@validate_access_token
+def sales_report(request):
+    try:
+        end = _query_date(request, 'end') or timezone.localdate()
+        start = _query_date(request, 'start') or end - timedelta(days=SALES_REPORT_DEFAULT_DAYS)
+    except ValueError:
+        return Response({"detail": "Invalid date"}, status=status.HTTP_400_BAD_REQUEST)
+    if start > end or (end - start).days > SALES_REPORT_MAX_DAYS:
+        return Response({"detail": "Invalid date range"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # end 為包含當日，查詢時轉成隔日零時的開區間
+    rows = sales_by_product_day(
+        _start_of_day(start),
+        _start_of_day(end + timedelta(days=1))
+    )
+    return Response(
+        {
+            "start": start,
+            "end": end,
+            "results": list(rows)
+        },
+        status=status.HTTP_200_OK
+    )
+
+HOURLY_REPORT_MAX_DAYS = 31
+
+def _hourly_report(request, queryset, fields):
+    try:
+        end = _query_date(request, 'end') or timezone.localdate()
+        start = _query_date(request, 'start') or end
+    except ValueError:
+        return Response({"detail": "Invalid date"}, status=status.HTTP_400_BAD_REQUEST)
+    if start > end or (end - start).days > HOURLY_REPORT_MAX_DAYS:
+        return Response({"detail": "Invalid date range"}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = queryset.filter(
+        hour__gte=_start_of_day(start),
+        hour__lt=_start_of_day(end + timedelta(days=1))
+    ).order_by('hour', fields[0]).values('hour', *fields)
+    return Response(
+        {
+            "start": start,
+            "end": end,
+            "results": list(rows)
+        },
+        status=status.HTTP_200_OK
+    )
+
+@api_view(['GET'])
+@validate_access_token
+def hourly_product_sales(request):
+    queryset = ProductSalesRollup.objects.all()
+    try:
+        product_id = _query_id(request, 'product_id')
+    except ValueError:
+        return Response({"detail": "Invalid product_id"}, status=status.HTTP_400_BAD_REQUEST)
+    if product_id is not None:
+        queryset = queryset.filter(product_id=product_id)
+    return _hourly_report(request, queryset, ('product_id', 'quantity', 'revenue'))
+
+@api_view(['GET'])
+@validate_access_token
+def hourly_promo_sales(request):
+    queryset = PromoSalesRollup.objects.all()
+    if request.query_params.get('promo_code'):
+        promo = get_promotion(request.query_params['promo_code'])
+        queryset = queryset.filter(promo_code_id=promo.id if promo else None)
+    return _hourly_report(request, queryset, ('promo_code_id', 'promo_code__code', 'order_count', 'revenue'))
+
+def _query_date(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
+
+def _query_id(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    if not (value.isascii() and value.isdigit()) or not 0 < int(value) <= MAX_PRODUCT_ID:
+        raise ValueError(value)
+    return int(value)
+
+def _query_price(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+    if not price.is_finite() or price < 0:
+        raise ValueError(value)
+    return price
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
@@ -0,0 +1,40 @@
+# gunicorn -c gunicorn.conf.py pretest.wsgi_api:application
+#
+# Every worker thread keeps its own persistent database connection, so
+# WEB_WORKERS * WEB_THREADS must stay below the Postgres (or PgBouncer)
+# client connection limit. The ASGI entry points used with the uvicorn
+# worker class default DB_CONN_MAX_AGE to 0 instead: Django 4.2 cannot
+# reuse connections across ASGI requests, so each request opens and
+# closes its own.
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8008')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 1))
+# WEB_WORKER_CLASS=uvicorn.workers.UvicornWorker serves pretest.asgi_api:application
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+# 定期重啟 worker，避免長時間執行累積的記憶體
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('WEB_ACCESS_LOG') or None
+# 在 master 載入並預熱應用程式後再 fork，worker 與 master 共用已載入的記憶體頁面，
+# 新 worker 啟動時不必重新匯入 Django
+preload_app = os.environ.get('WEB_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    if preload_app:
+        # 把預載的物件移出 GC 追蹤，worker 執行 GC 時不會寫入（複製）這些頁面
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # 不可沿用 master 在預載期間開啟的資料庫連線
+        from django.db import connections
+        connections.close_all()
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pretest.settings')
+# Django 4.2 不會在 ASGI 請求之間重用持久連線，保留只會讓連線越積越多
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
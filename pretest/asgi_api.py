@@ -0,0 +1,21 @@
+"""
+ASGI entry point of the lean api profile (``pretest.settings_api``).
+
+The application is built and warmed up at import time, so a server that
+preloads it (gunicorn ``preload_app``) does that work once before forking
+the workers.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pretest.settings_api')
+# Django 4.2 不會在 ASGI 請求之間重用持久連線，保留只會讓連線越積越多
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+
+application = get_asgi_application()
+
+from api.startup import warm_up  # noqa: E402
+
+warm_up()
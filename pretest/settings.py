@@ -20,10 +20,11 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # See https://docs.djangoproject.com/en/3.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = '=hj+vsp4o6)0gq7*)7oskvaap83vd%*$jhi#9c8u7z1@-c0#e!'
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', '=hj+vsp4o6)0gq7*)7oskvaap83vd%*$jhi#9c8u7z1@-c0#e!')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DEBUG 會記錄每一筆 SQL 到 connection.queries，長時間執行會持續佔用記憶體
+DEBUG = os.environ.get('DJANGO_DEBUG') == '1'
 
 ALLOWED_HOSTS = ['*']
 
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,12 +82,83 @@ DATABASES = {
         'NAME': os.environ.get('POSTGRES_NAME'),
         'USER': os.environ.get('POSTGRES_USER'),
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
-        'HOST': 'db',
+        'HOST': os.environ.get('POSTGRES_HOST', 'db'),
         'PORT': os.environ.get('POSTGRES_PORT'),
+        # 連線在請求之間保留 CONN_MAX_AGE 秒，重用前先檢查是否仍可用。
+        # ASGI 入口 (pretest.asgi*) 預設為 0：Django 4.2 在 ASGI 下每個請求都在新的
+        # 執行緒情境中執行，持久連線不會被重用，只會累積到資料庫的 max_connections
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # PgBouncer 交易模式下，同一個 server-side cursor 可能跨到不同的後端連線
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == 'pgbouncer',
     }
 }
 
 
+# Django REST framework
+# orjson is used for JSON bodies when installed, with the standard library
+# as fallback.
+
+REST_FRAMEWORK = {
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    # 商品快照每項佔兩個鍵，預設上限 300 的本機快取會不斷淘汰
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 50000))}
+
+# Promotion codes are cached per process for PROMO_CACHE_LOCAL_TTL seconds
+# and in the shared cache for up to PROMO_CACHE_TIMEOUT seconds.
+PROMO_CACHE_TIMEOUT = 300
+PROMO_CACHE_LOCAL_TTL = 5
+PROMO_CACHE_LOCAL_SIZE = 1024
+
+# Product snapshots (name, price, shard count and a stock hint) are cached
+# per process for PRODUCT_CACHE_LOCAL_TTL seconds, so a price change can
+# take that long to reach other workers, and in the shared cache under
+# versioned keys for up to PRODUCT_CACHE_TIMEOUT seconds.
+PRODUCT_CACHE_TIMEOUT = 300
+PRODUCT_CACHE_LOCAL_TTL = 1
+PRODUCT_CACHE_LOCAL_SIZE = 10000
+
+# Active ApiToken digests are reloaded per process at most this often, so a
+# revoked token stops working everywhere within API_TOKEN_CACHE_TTL seconds.
+API_TOKEN_CACHE_TTL = 30
+
+# Sales rollup deltas are buffered in memory and written every
+# ROLLUP_FLUSH_INTERVAL seconds, or sooner once the buffer holds
+# ROLLUP_FLUSH_MAX_KEYS (hour, product/promo) keys.
+ROLLUP_FLUSH_INTERVAL = 5
+ROLLUP_FLUSH_MAX_KEYS = 5000
+
+# Queued imports claimed by a worker that has not finished within
+# ORDER_JOB_CLAIM_TIMEOUT seconds are handed to another worker; a job is
+# marked failed after ORDER_JOB_MAX_ATTEMPTS claims.
+ORDER_JOB_CLAIM_TIMEOUT = 300
+ORDER_JOB_MAX_ATTEMPTS = 3
+
+# Requests slower than SLOW_REQUEST_MS are logged as JSON on the
+# api.performance logger.
+SLOW_REQUEST_MS = 500
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -0,0 +1,48 @@
+"""
+Lean settings profile for the api service.
+
+The api endpoints authenticate with X-Access-Token and never use the
+admin, sessions, messages, static files or Django's user model, so this
+profile drops those apps and their middleware to cut worker start-up
+time and memory. Everything else comes from ``pretest.settings``; run
+migrations and management commands with the full profile.
+
+Served by ``pretest.wsgi_api`` and ``pretest.asgi_api``.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'api',
+]
+
+MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'pretest.urls_api'
+
+# 錯誤頁使用 Django 內建的預設頁面，不需要樣板引擎
+TEMPLATES = []
+
+WSGI_APPLICATION = 'pretest.wsgi_api.application'
+
+# Without django.contrib.auth there is no user model: DRF must not try
+# session or basic authentication, or build an AnonymousUser.
+REST_FRAMEWORK = {
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
+}
+
+AUTH_PASSWORD_VALIDATORS = []
+
+USE_I18N = False
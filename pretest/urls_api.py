@@ -0,0 +1,10 @@
+"""URL configuration of the lean api profile (``pretest.settings_api``): the
+api endpoints and metrics, without the admin site."""
+from django.urls import path, include
+
+from api.metrics import metrics_view
+
+urlpatterns = [
+    path('api/', include('api.urls')),
+    path('metrics', metrics_view, name='metrics'),
+]
@@ -0,0 +1,19 @@
+"""
+WSGI entry point of the lean api profile (``pretest.settings_api``).
+
+The application is built and warmed up at import time, so a server that
+preloads it (gunicorn ``preload_app``) does that work once before forking
+the workers.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pretest.settings_api')
+
+application = get_wsgi_application()
+
+from api.startup import warm_up  # noqa: E402
+
+warm_up()
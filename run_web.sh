@@ -1,5 +1,19 @@
 #!/bin/sh
 
-sh wait-for-postgres.sh db
+sh wait-for-postgres.sh ${POSTGRES_HOST:-db}
 python manage.py migrate
-python manage.py runserver 0.0.0.0:8008
\ No newline at end of file
+
+if [ "$DJANGO_DEBUG" = "1" ]; then
+    exec python manage.py runserver 0.0.0.0:8008
+fi
+
+# 預設使用只含 api 的精簡設定；WEB_PROFILE=full 改用含 admin 的完整設定
+SUFFIX=_api
+if [ "$WEB_PROFILE" = "full" ]; then
+    SUFFIX=
+fi
+case "$WEB_WORKER_CLASS" in
+    uvicorn*) APP=pretest.asgi$SUFFIX:application ;;
+    *) APP=pretest.wsgi$SUFFIX:application ;;
+esac
+exec gunicorn -c gunicorn.conf.py $APP